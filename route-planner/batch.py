@@ -0,0 +1,204 @@
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+# Import the route finding engine, resident data loaders and node pollution names
+from engine import (Inputs, findroutes, warmup, routelimits, checkweight, RouteError, MODES, NETWORK_TYPES,
+                    LIMIT_STANDARDS)
+from network import NODE_ATTRS
+from cube import cube
+from metrics import trace, finish, writeprometheus
+
+# Columns giving the coordinates of each pair, used in place of addresses where present
+COORDINATE_COLUMNS = ('start_lat', 'start_lon', 'end_lat', 'end_lon')
+
+# Columns giving the addresses of each pair, geocoded in the workers
+ADDRESS_COLUMNS = ('start', 'end')
+
+# Columns written for each pair, exposures are in µg/m³·m
+RESULT_COLUMNS = (('shortest_length', 'alt_length')
+                  + tuple(f'shortest_{attr}_exposure' for attr in NODE_ATTRS)
+                  + tuple(f'alt_{attr}_exposure' for attr in NODE_ATTRS)
+                  + ('error',))
+
+
+def readpairs(path):
+    """
+        Reads origin-destination pairs from a CSV or Parquet file
+
+        Args
+            path (str): File path, read as Parquet if it ends in .parquet or .pq and as CSV otherwise
+
+        Returns
+            pairs (DataFrame): Pairs with either start_lat, start_lon, end_lat and end_lon or start and end columns,
+            raises ValueError if neither are present
+    """
+
+    if path.lower().endswith(('.parquet', '.pq')):
+        pairs = pd.read_parquet(path)
+    else:
+        pairs = pd.read_csv(path)
+    if not (set(COORDINATE_COLUMNS) <= set(pairs.columns) or set(ADDRESS_COLUMNS) <= set(pairs.columns)):
+        raise ValueError(f"Pairs need {', '.join(COORDINATE_COLUMNS)} or {', '.join(ADDRESS_COLUMNS)} columns")
+    return pairs
+
+
+def writeresults(results, path):
+    """
+        Writes scored pairs to a Parquet or CSV file
+
+        Args
+            results (DataFrame): Pairs with their result columns, as from runbatch()
+            path (str): File path, written as Parquet if it ends in .parquet or .pq and as CSV otherwise
+
+        Returns
+            None
+    """
+
+    if path.lower().endswith(('.parquet', '.pq')):
+        results.to_parquet(path, index=False)
+    else:
+        results.to_csv(path, index=False)
+
+
+def scorepair(job):
+    """
+        Routes one pair in a worker process and measures both routes
+
+        Args
+            job (tuple): Tuple of start, end, mode, nettype, weight, scenario, year, limits and pollutant weights,
+            where start and end are either addresses or (latitude, longitude) tuples
+
+        Returns
+            scores (dict): Route lengths and per-pollutant exposure, with an error message if no route was found or
+            the pair failed
+            record (Trace): Timings and counters of the pair, finished in the parent process
+    """
+
+    start, end, mode, nettype, weight, scenario, year, limits, pollutantweights = job
+    scores = dict.fromkeys(RESULT_COLUMNS)
+    with trace('batch', mode=mode, nettype=nettype, scenario=scenario) as record:
+        try:
+            if isinstance(start, str):
+                geo_initial, geo_target = Inputs(start, end).geocodeaddresses()
+                if geo_initial == 'Fail' and geo_target == 'Fail':
+                    raise RouteError('One or more addresses could not be located')
+            else:
+                geo_initial = [str(start), start[0], start[1]]
+                geo_target = [str(end), end[0], end[1]]
+
+            csr, route, attempt = findroutes(geo_initial, geo_target, mode, nettype, weight, None, scenario, year,
+                                             limits, pollutantweights)
+
+            # Edges of the network type, choosing between parallel edges of the unified graph
+            edges = csr.modeedges(nettype)
+            for prefix, path in (('shortest', route), ('alt', attempt)):
+                length, exposure = csr.pathexposure(path, edges)
+                scores[f'{prefix}_length'] = length
+                for attr, value in zip(NODE_ATTRS, exposure):
+                    scores[f'{prefix}_{attr}_exposure'] = float(value)
+        except RouteError as error:
+            scores = dict.fromkeys(RESULT_COLUMNS)
+            scores['error'] = str(error)
+            record.status = type(error).__name__
+        except Exception as error:
+            # Unexpected errors are recorded against the pair, so one bad pair does not end the whole batch
+            scores = dict.fromkeys(RESULT_COLUMNS)
+            scores['error'] = f'{type(error).__name__}: {error}'
+            record.status = type(error).__name__
+    return scores, record
+
+
+def runbatch(pairs, mode='limits', nettype='walk', weight=1.0, workers=None, scenario=None, year=None, limits=None,
+             pollutantweights=None):
+    """
+        Routes every pair across a pool of worker processes
+        Data is loaded once before the pool starts, so forked workers share the graph and raster arrays
+        rather than each loading a copy, and only the pairs and their scores are sent between processes
+
+        Args
+            pairs (DataFrame): Pairs, as from readpairs()
+            mode (str): Routing mode - limits, exposure or pareto
+            nettype (str): Network type - walk or bike
+            weight (float): Weighting of exposure against length for the exposure mode
+            workers (int): Number of worker processes, defaults to the number of CPUs
+            scenario (str): Pollution scenario from the cube, defaults to the rasters in the data folder
+            year (int): Year of the pollution scenario, defaults to its latest year
+            limits (str or tuple): Limit standard or PM2.5, PM10 and NO2 limits, defaults to WHO 2005
+            pollutantweights (tuple): PM2.5, PM10 and NO2 weights, 0 ignores a pollutant, defaults to 1 for each
+
+        Returns
+            results (DataFrame): Pairs with result columns added
+    """
+
+    if mode not in MODES:
+        raise ValueError(f"Unknown routing mode {mode}, expected one of {MODES}")
+    if nettype not in NETWORK_TYPES:
+        raise ValueError(f"Unknown network type {nettype}, expected one of {NETWORK_TYPES}")
+    if scenario is not None:
+        year = cube.resolve(scenario, year)
+    weight = checkweight(weight)
+    routelimits(limits, pollutantweights)
+
+    if set(COORDINATE_COLUMNS) <= set(pairs.columns):
+        starts = list(zip(pairs['start_lat'].astype(float), pairs['start_lon'].astype(float)))
+        ends = list(zip(pairs['end_lat'].astype(float), pairs['end_lon'].astype(float)))
+    else:
+        starts = pairs['start'].astype(str).tolist()
+        ends = pairs['end'].astype(str).tolist()
+    jobs = [(start, end, mode, nettype, weight, scenario, year, limits, pollutantweights)
+            for start, end in zip(starts, ends)]
+
+    warmup((nettype,))
+    workers = workers or os.cpu_count() or 1
+    # Forking shares the loaded arrays copy on write, other platforms fall back to loading them in each worker
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context, initializer, initargs = multiprocessing.get_context('fork'), None, ()
+    else:
+        context, initializer, initargs = None, warmup, ((nettype,),)
+    # Several pairs are sent to a worker at a time so messaging between processes stays small
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initializer,
+                             initargs=initargs) as pool:
+        scores = []
+        for pairscores, record in pool.map(scorepair, jobs, chunksize=chunksize):
+            scores.append(pairscores)
+            finish(record)
+
+    results = pd.DataFrame(scores, columns=list(RESULT_COLUMNS), index=pairs.index)
+    return pd.concat([pairs.drop(columns=list(RESULT_COLUMNS), errors='ignore'), results], axis=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Routes origin-destination pairs and scores their pollution exposure')
+    parser.add_argument('pairs', help='CSV or Parquet file of pairs, with start_lat, start_lon, end_lat and end_lon '
+                                      'or start and end address columns')
+    parser.add_argument('output', help='CSV or Parquet file to write, chosen by extension')
+    parser.add_argument('--mode', choices=MODES, default='limits', help='Routing mode, defaults to limits')
+    parser.add_argument('--nettype', choices=NETWORK_TYPES, default='walk', help='Network type, defaults to walk')
+    parser.add_argument('--weight', type=float, default=1.0, help='Exposure weighting for the exposure mode, 0 or '
+                                                                  'more')
+    parser.add_argument('--scenario', default=None, help='Pollution scenario from the cube, defaults to the rasters')
+    parser.add_argument('--year', type=int, default=None, help='Year of the scenario, defaults to its latest year')
+    parser.add_argument('--limits', default=None, help='Limit standard, one of '
+                                                       f"{', '.join(LIMIT_STANDARDS)}, or PM2.5, PM10 and NO2 limits "
+                                                       'as 5,15,10, defaults to who2005')
+    parser.add_argument('--pollutantweights', default=None, help='PM2.5, PM10 and NO2 weights as 1,1,1, 0 ignores a '
+                                                                 'pollutant')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes, defaults to the number of CPUs')
+    parser.add_argument('--metrics', default=None, help='File to write stage timings and counters to, in the '
+                                                        'Prometheus text format')
+    args = parser.parse_args()
+
+    batchpairs = readpairs(args.pairs)
+    print(f'Routing {len(batchpairs)} pairs...')
+    batchresults = runbatch(batchpairs, args.mode, args.nettype, args.weight, args.workers, args.scenario,
+                            args.year, args.limits, args.pollutantweights)
+    writeresults(batchresults, args.output)
+    if args.metrics:
+        writeprometheus(args.metrics)
+    failed = batchresults['error'].notna().sum()
+    print(f'Saved {len(batchresults) - failed} routes to {args.output}, {failed} pairs could not be routed')
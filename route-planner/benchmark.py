@@ -0,0 +1,364 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import networkx as nx
+import numpy as np
+import rasterio as rio
+from rasterio.transform import from_origin
+
+# Import the route finding engine and the data it is run against
+import engine
+import raster
+from network import annotategraph, haversine
+from csrgraph import CSRGraph
+from geocoder import Geocoder
+
+# Centre of the synthetic street grid, in central London so coordinates are realistic
+ORIGIN = (51.5, -0.12)
+
+# Spacing between grid junctions in degrees of latitude, roughly 80 metres
+SPACING = 0.0007
+
+# Pixel size of the synthetic rasters in degrees, close to that of the London rasters
+RESOLUTION = 0.0002
+
+# Background, hotspot and road pollution of each synthetic raster in μg/m3, hotspots exceed the WHO limits
+FIELDS = {
+    'PM2.5': (7.0, 12.0, 4.0),
+    'PM10': (14.0, 20.0, 8.0),
+    'NO2': (25.0, 45.0, 20.0),
+}
+
+# Place names answered by the stub geocoder
+START, END = 'Synthetic Start', 'Synthetic End'
+
+# Stages timed for each graph size, in the order they run when a route is planned
+STAGES = ('geocoding', 'graph_build', 'snapping', 'shortest_route', 'limits_route', 'exposure_route',
+          'route_lengths', 'edgepollution', 'drawfig')
+
+
+def syntheticgraph(size, seed=0):
+    """
+        Builds a street grid shaped like an OSMnx graph, with jittered junctions, diagonal shortcuts and a few
+        missing streets so that routes are not all straight lines
+
+        Args
+            size (int): Junctions along each side of the grid
+            seed (int): Random seed, the same seed always gives the same graph
+
+        Returns
+            graph (MultiDiGraph): Graph with x and y on nodes and length on edges, not yet annotated with pollution
+    """
+
+    rng = np.random.default_rng(seed)
+    graph = nx.MultiDiGraph(crs='epsg:4326')
+    scale = 1 / np.cos(np.radians(ORIGIN[0]))
+    half = (size - 1) / 2
+    jitter = rng.uniform(-0.25, 0.25, (size, size, 2)) * SPACING
+    for row in range(size):
+        for col in range(size):
+            graph.add_node(row * size + col, y=ORIGIN[0] + (row - half) * SPACING + jitter[row, col, 0],
+                           x=ORIGIN[1] + ((col - half) * SPACING + jitter[row, col, 1]) * scale, street_count=4)
+
+    streets = []
+    for row in range(size):
+        for col in range(size):
+            node = row * size + col
+            if col < size - 1:
+                streets.append((node, node + 1))
+            if row < size - 1:
+                streets.append((node, node + size))
+            if row < size - 1 and col < size - 1 and rng.random() < 0.1:
+                streets.append((node, node + size + 1))
+    # Streets are removed at random, leaving the grid's outer edge so every junction stays reachable
+    for u, v in streets:
+        border = u < size or v >= size * (size - 1) or u % size == 0 or v % size == size - 1
+        if not border and rng.random() < 0.08:
+            continue
+        length = float(haversine(graph.nodes[u]['y'], graph.nodes[u]['x'], graph.nodes[v]['y'], graph.nodes[v]['x']))
+        graph.add_edge(u, v, length=length, osmid=len(streets))
+        graph.add_edge(v, u, length=length, osmid=len(streets))
+    return graph
+
+
+def syntheticrasters(graph, folder, seed=0, resolution=RESOLUTION):
+    """
+        Writes a GeoTIFF pollution field for each pollutant covering a graph, with a smooth background, hotspots
+        and busier roads along some rows and columns of the grid
+
+        Args
+            graph (MultiDiGraph): Graph the rasters should cover, with a margin around it
+            folder (str): Folder to write the rasters to
+            seed (int): Random seed
+            resolution (float): Pixel size in degrees
+
+        Returns
+            rasters (dict): Pollutant key to raster file path, as for RasterStore
+    """
+
+    rng = np.random.default_rng(seed)
+    xs = np.fromiter((attrs['x'] for node, attrs in graph.nodes(data=True)), dtype=float)
+    ys = np.fromiter((attrs['y'] for node, attrs in graph.nodes(data=True)), dtype=float)
+    margin = 20 * resolution
+    west, north = xs.min() - margin, ys.max() + margin
+    width = int(np.ceil((xs.max() + margin - west) / resolution))
+    height = int(np.ceil((north - ys.min() + margin) / resolution))
+    lons = west + (np.arange(width) + 0.5) * resolution
+    lats = north - (np.arange(height) + 0.5) * resolution
+
+    # Hotspots and roads are shared by the pollutants, as they come from the same traffic
+    hotspots = np.zeros((height, width))
+    for lat, lon in zip(rng.uniform(lats.min(), lats.max(), 12), rng.uniform(lons.min(), lons.max(), 12)):
+        spread = rng.uniform(5, 15) * SPACING
+        hotspots += np.exp(-((lats[:, None] - lat) ** 2 + (lons[None, :] - lon) ** 2) / (2 * spread ** 2))
+    roads = np.zeros((height, width))
+    for lat in rng.choice(lats, 4):
+        roads = np.maximum(roads, np.exp(-((lats[:, None] - lat) / SPACING) ** 2))
+    for lon in rng.choice(lons, 4):
+        roads = np.maximum(roads, np.exp(-((lons[None, :] - lon) / SPACING) ** 2))
+
+    rasters = {}
+    transform = from_origin(west, north, resolution, resolution)
+    for key, (background, hotspot, road) in FIELDS.items():
+        noise = rng.normal(0, background * 0.05, (height, width))
+        band = (background + hotspot * np.clip(hotspots, 0, 1.5) + road * roads + noise).astype(np.float32)
+        rasters[key] = os.path.join(folder, f"{key.replace('.', '_')}_synthetic.tif")
+        with rio.open(rasters[key], 'w', driver='GTiff', height=height, width=width, count=1, dtype='float32',
+                      crs='EPSG:4326', transform=transform) as dst:
+            dst.write(band, 1)
+    return rasters
+
+
+def stubgeocoder(graph):
+    """
+        Returns a geocoder answering the start and end names with points near opposite corners of a graph,
+        with no gazetteer, postcode or cache files and no network access
+
+        Args
+            graph (MultiDiGraph): Synthetic graph
+
+        Returns
+            geocoder (Geocoder): Geocoder whose remote lookup is a dictionary
+    """
+
+    xs = np.fromiter((attrs['x'] for node, attrs in graph.nodes(data=True)), dtype=float)
+    ys = np.fromiter((attrs['y'] for node, attrs in graph.nodes(data=True)), dtype=float)
+    spanx, spany = xs.max() - xs.min(), ys.max() - ys.min()
+    places = {
+        START: (START, float(ys.min() + spany * 0.1), float(xs.min() + spanx * 0.1)),
+        END: (END, float(ys.max() - spany * 0.1), float(xs.max() - spanx * 0.1)),
+    }
+    return Geocoder(remote=places.get, gazetteer=None, postcodepath=None, cachepath=None)
+
+
+def timed(function, repeat):
+    """
+        Runs a function several times and times every run
+
+        Args
+            function (function): Called with no arguments
+            repeat (int): Number of runs
+
+        Returns
+            result: Return value of the last run
+            times (list): Seconds taken by each run
+    """
+
+    times = []
+    result = None
+    for run in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return result, times
+
+
+def summarise(times):
+    """
+        Summarises the run times of a stage
+
+        Args
+            times (list): Seconds taken by each run
+
+        Returns
+            summary (dict): Minimum, median, mean and maximum in milliseconds and the number of runs
+    """
+
+    milliseconds = [value * 1000 for value in times]
+    return {'min_ms': min(milliseconds), 'median_ms': statistics.median(milliseconds),
+            'mean_ms': statistics.fmean(milliseconds), 'max_ms': max(milliseconds), 'runs': len(milliseconds)}
+
+
+def benchmarksize(size, folder, repeat=5, seed=0, weight=1.0):
+    """
+        Times every stage of planning a route on a synthetic graph and rasters, in the order plan_route() runs them
+
+        Args
+            size (int): Junctions along each side of the grid
+            folder (str): Folder to write the synthetic rasters to
+            repeat (int): Runs of each stage
+            seed (int): Random seed
+            weight (float): Exposure weighting of the exposure route
+
+        Returns
+            result (dict): Graph size and the timings of each stage, keyed by stage name
+    """
+
+    template = syntheticgraph(size, seed)
+    raster.usestore(raster.RasterStore(syntheticrasters(template, folder, seed)))
+    geocoder = stubgeocoder(template)
+    engine.geocoder = geocoder
+    timings = {}
+
+    def geocode():
+        # Clearing the memo so every run looks the places up again
+        geocoder.memo.clear()
+        return engine.Inputs(START, END).geocodeaddresses()
+
+    (geo_initial, geo_target), timings['geocoding'] = timed(geocode, repeat)
+
+    def build():
+        # Annotating a fresh copy each run, as annotategraph() changes the graph in place
+        graph = template.copy()
+        annotategraph(graph)
+        csr = CSRGraph.fromgraph(graph)
+        csr.snapindex()
+        return graph, csr
+
+    (graph, csr), timings['graph_build'] = timed(build, repeat)
+
+    locations = engine.Locations([geo_initial[0], geo_target[0]], [geo_initial[1], geo_target[1]],
+                                 [geo_initial[2], geo_target[2]])
+    corridor = locations.corridor()
+    mask = csr.within(corridor)
+    (source, target), timings['snapping'] = timed(lambda: locations.getnodes(csr, mask), repeat)
+
+    route, timings['shortest_route'] = timed(lambda: csr.shortestpath(source, target, mask=mask), repeat)
+    limits = engine.limitervalues()
+
+    def limitsroute():
+        ratios = csr.noderatios(limits)
+        tolerance = max(1.0, csr.mintolerance(source, target, ratios, mask))
+        return csr.limitedpath(source, target, ratios, tolerance, mask)
+
+    attempt, timings['limits_route'] = timed(limitsroute, repeat)
+    exposure, timings['exposure_route'] = timed(
+        lambda: csr.exposurepath(source, target, csr.edgeratios(limits), weight, mask), repeat)
+
+    def lengths():
+        return csr.pathexposure(route)[0], csr.pathexposure(attempt)[0]
+
+    (shortest_length, alt_length), timings['route_lengths'] = timed(lengths, repeat)
+    (edges_values, alt_edges_values), timings['edgepollution'] = timed(
+        lambda: (engine.edgepollution(csr, route), engine.edgepollution(csr, attempt)), repeat)
+
+    result = engine.RouteResult(geo_initial, geo_target, 'walk', 'limits', shortest_length, alt_length,
+                                edges_values, alt_edges_values, csr)
+    # The map is rendered to HTML as well as built, as it is when saved for the viewer
+    html, timings['drawfig'] = timed(lambda: engine.drawfig(result).get_root().render(), repeat)
+
+    return {
+        'size': size,
+        'nodes': graph.number_of_nodes(),
+        'edges': graph.number_of_edges(),
+        'route_nodes': {'shortest': len(route), 'limits': len(attempt), 'exposure': len(exposure)},
+        'map_bytes': len(html.encode()),
+        'stages': {stage: summarise(timings[stage]) for stage in STAGES},
+    }
+
+
+def runbenchmarks(sizes, repeat=5, seed=0, weight=1.0):
+    """
+        Benchmarks every graph size, writing the synthetic rasters to a temporary folder which is then removed
+
+        Args
+            sizes (list): Junctions along each side of the grid, one benchmark per size
+            repeat (int): Runs of each stage
+            seed (int): Random seed
+            weight (float): Exposure weighting of the exposure route
+
+        Returns
+            report (dict): Details of the machine and run with the results of each size
+    """
+
+    with tempfile.TemporaryDirectory(prefix='routeplanner-benchmark') as folder:
+        results = [benchmarksize(size, folder, repeat, seed, weight) for size in sizes]
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'networkx': nx.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'repeat': repeat,
+        'seed': seed,
+        'weight': weight,
+        'results': results,
+    }
+
+
+def compare(report, baseline, threshold=1.25):
+    """
+        Compares the median time of each stage against an earlier report
+
+        Args
+            report (dict): Report from runbenchmarks()
+            baseline (dict): Earlier report to compare against
+            threshold (float): Ratio of new to old median time above which a stage counts as slower
+
+        Returns
+            rows (list): Size, stage, old and new median in milliseconds and their ratio for stages in both reports
+            slower (list): Rows of stages slower than the threshold
+    """
+
+    previous = {result['size']: result['stages'] for result in baseline['results']}
+    rows = []
+    for result in report['results']:
+        for stage, timing in result['stages'].items():
+            old = previous.get(result['size'], {}).get(stage)
+            if old is None:
+                continue
+            ratio = timing['median_ms'] / old['median_ms'] if old['median_ms'] > 0 else float('inf')
+            rows.append((result['size'], stage, old['median_ms'], timing['median_ms'], ratio))
+    slower = [row for row in rows if row[4] > threshold]
+    return rows, slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times each stage of route planning on synthetic data, offline')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 200],
+                        help='Junctions along each side of the synthetic grids, defaults to 50 100 200')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each stage, defaults to 5')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic data')
+    parser.add_argument('--weight', type=float, default=1.0, help='Exposure weighting of the exposure route')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file to write, defaults to benchmark.json')
+    parser.add_argument('--compare', help='Earlier JSON report to compare the median times against')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='Ratio of median times counted as a slowdown, defaults to 1.25')
+    args = parser.parse_args()
+
+    benchmarkreport = runbenchmarks(args.sizes, args.repeat, args.seed, args.weight)
+    with open(args.output, 'w') as file:
+        json.dump(benchmarkreport, file, indent=2)
+
+    for sizeresult in benchmarkreport['results']:
+        print(f"{sizeresult['size']} x {sizeresult['size']} grid, {sizeresult['nodes']} nodes, "
+              f"{sizeresult['edges']} edges")
+        for stagename, stagetiming in sizeresult['stages'].items():
+            print(f"  {stagename:<16} {stagetiming['median_ms']:10.2f} ms")
+    print(f'Saved results to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as file:
+            comparerows, slowerrows = compare(benchmarkreport, json.load(file), args.threshold)
+        for rowsize, rowstage, oldms, newms, rowratio in comparerows:
+            flag = '  SLOWER' if rowratio > args.threshold else ''
+            print(f'{rowsize:>5} {rowstage:<16} {oldms:10.2f} ms -> {newms:10.2f} ms  x{rowratio:.2f}{flag}')
+        if slowerrows:
+            sys.exit(f'{len(slowerrows)} stages slower than x{args.threshold} of {args.compare}')
@@ -0,0 +1,832 @@
+import heapq
+import math
+import os
+
+import numpy as np
+import shapely
+from networkx import NetworkXNoPath, NodeNotFound
+
+# Import pollution arrays and distances from network script
+from network import pollutionarray, edgearray, EARTH_RADIUS
+from nodeindex import NodeIndex
+
+# Arrays saved for each graph, loaded memory mapped so they are shared and only paged in when used
+ARRAYS = ('nodes', 'offsets', 'targets', 'length', 'x', 'y', 'pollution', 'exposure', 'access', 'shapeoffsets',
+          'shapex', 'shapey')
+
+# Bit of each network type in the access flags of edges, where an edge may be used by several network types
+ACCESS_BITS = {'walk': 1, 'bike': 2}
+
+# Nodes or labels settled between calls to the stop function of a search, so checking it costs little
+STOP_INTERVAL = 4096
+
+# Fraction by which each longer Pareto route must lower the exposure of the shorter routes
+PARETO_EPSILON = 0.01
+
+# Longest Pareto route followed, as a multiple of the length of the shortest route
+PARETO_DETOUR = 2.0
+
+
+class CSRGraph:
+    """
+    Compact routing graph held as compressed sparse row (CSR) NumPy arrays
+    The edges leaving node i are targets[offsets[i]:offsets[i + 1]], parallel edges are kept as the shortest
+    of those used by the same network types, so one graph can hold the edges of every network type
+
+    Attributes
+        nodes (numpy.ndarray): Sorted OSMnx node IDs, a node's position in this array is its index
+        offsets (numpy.ndarray): Index of the first edge of each node, length N + 1
+        targets (numpy.ndarray): Node index at the end of each edge
+        length (numpy.ndarray): Length of each edge in metres
+        x (numpy.ndarray): Longitude of each node
+        y (numpy.ndarray): Latitude of each node
+        pollution (numpy.ndarray): Array of shape (N, 3) of PM2.5, PM10 and NO2 values of each node
+        exposure (numpy.ndarray): Array of shape (E, 3) of PM2.5, PM10 and NO2 exposure along each edge in µg/m³·m
+        access (numpy.ndarray): ACCESS_BITS of the network types using each edge, None where every type uses all
+        shapeoffsets (numpy.ndarray): Index of the first shape point of each edge, length E + 1, None where edges
+            have no stored shape and are drawn straight between their nodes
+        shapex (numpy.ndarray): Longitude of the points along each edge between its nodes, from source to target
+        shapey (numpy.ndarray): Latitude of the points along each edge between its nodes
+        nodeindex (NodeIndex): Spatial index of the nodes, built on first use if not loaded
+
+    Methods
+        .__init___(): Constructs the graph object from arrays
+        .fromgraph(): Constructs the graph object from an annotated OSMnx graph
+        .save(): Saves the arrays to a folder
+        .load(): Loads the arrays from a folder
+        .withpollution(): Returns a copy of the graph with other node pollution and edge exposure
+        .index(): Converts node IDs to node indexes
+        .within(): Returns a mask of nodes inside a polygon
+        .snapindex(): Returns the spatial index of the nodes
+        .snap(): Returns the nearest node to many points and their distances
+        .nearest(): Returns the nearest node to points
+        .modeedges(): Returns a mask of edges used by a network type
+        .modenodes(): Returns a mask of nodes joined by edges of a mask
+        .noderatios(): Returns each node's ratio of pollution to limits
+        .edgeratios(): Returns each edge's ratio of mean pollution to limits
+        .exposureweights(): Returns edge weights of length plus weighted exposure
+        .pathedges(): Returns the edges along a path
+        .pathexposure(): Returns the length of a path and its exposure to each pollutant
+        .pathlines(): Returns the coordinates along each edge of a path for drawing
+        .edgegeometries(): Returns the shape of many edges as lines
+        .shortestpath(): A* search for the route with the lowest total weight
+        .mintolerance(): Minimax search for the smallest tolerance connecting two nodes
+        .limitedpath(): Shortest route through nodes within a tolerance
+        .exposurepath(): Route minimising length plus weighted exposure
+        .paretopaths(): Every route trading length against exposure, from one multi-objective search
+        .distinctpaths(): Chooses the routes which share the least length with each other
+
+    """
+
+    def __init__(self, nodes, offsets, targets, length, x, y, pollution, exposure=None, access=None,
+                 shapeoffsets=None, shapex=None, shapey=None):
+        """
+        Constructs all the necessary attributes for the graph object.
+
+        Args
+            nodes (numpy.ndarray): Sorted OSMnx node IDs
+            offsets (numpy.ndarray): Index of the first edge of each node, length N + 1
+            targets (numpy.ndarray): Node index at the end of each edge
+            length (numpy.ndarray): Length of each edge in metres
+            x (numpy.ndarray): Longitude of each node
+            y (numpy.ndarray): Latitude of each node
+            pollution (numpy.ndarray): Array of shape (N, 3) of PM2.5, PM10 and NO2 values of each node
+            exposure (numpy.ndarray): Array of shape (E, 3) of exposure along each edge, defaults to the edge length
+                multiplied by the mean pollution of its end nodes
+            access (numpy.ndarray): ACCESS_BITS of the network types using each edge, defaults to every type
+            shapeoffsets (numpy.ndarray): Index of the first shape point of each edge, length E + 1, optional
+            shapex (numpy.ndarray): Longitude of the points along each edge between its nodes
+            shapey (numpy.ndarray): Latitude of the points along each edge between its nodes
+
+        Returns
+            None
+        """
+
+        if exposure is None:
+            sources = np.repeat(np.arange(len(nodes)), np.diff(offsets))
+            ends = (pollution[sources].astype(float) + pollution[targets]) / 2
+            exposure = (ends * np.asarray(length)[:, None]).astype(np.float32)
+        self.nodes = nodes
+        self.offsets = offsets
+        self.targets = targets
+        self.length = length
+        self.x = x
+        self.y = y
+        self.pollution = pollution
+        self.exposure = exposure
+        self.access = access
+        self.shapeoffsets = shapeoffsets
+        self.shapex = shapex
+        self.shapey = shapey
+        self.nodeindex = None
+
+    @classmethod
+    def fromgraph(cls, graph):
+        """
+        Exports an OSMnx graph annotated by annotategraph() to CSR arrays
+        Access flags are kept where the graph's edges have them, as on the unified graph of every network type,
+        along with the shape of each edge so routes can be drawn without the graph
+
+        Args
+            graph (MultiDiGraph): OSMnx graph annotated with pollution
+
+        Returns
+            csr (CSRGraph): Graph as CSR arrays
+        """
+
+        nodes = np.array(sorted(graph.nodes), dtype=np.int64)
+        nodelist = nodes.tolist()
+        x = np.fromiter((graph.nodes[node]['x'] for node in nodelist), dtype=float, count=len(nodes))
+        y = np.fromiter((graph.nodes[node]['y'] for node in nodelist), dtype=float, count=len(nodes))
+        pollution = pollutionarray(graph, nodelist).astype(np.float32)
+
+        edges = list(graph.edges(keys=True, data='length'))
+        sources = np.searchsorted(nodes, np.fromiter((u for u, v, k, length in edges), dtype=np.int64,
+                                                     count=len(edges)))
+        targets = np.searchsorted(nodes, np.fromiter((v for u, v, k, length in edges), dtype=np.int64,
+                                                     count=len(edges)))
+        length = np.fromiter((length for u, v, k, length in edges), dtype=float, count=len(edges))
+        flagged = any('access' in attrs for u, v, attrs in graph.edges(data=True))
+        access = np.fromiter((attrs.get('access', 0) for u, v, attrs in graph.edges(data=True)) if flagged else (),
+                             dtype=np.uint8, count=len(edges) if flagged else 0)
+
+        # Sorting edges by source, target, access then length, so the first of any parallel edges used by the same
+        # network types is the shortest
+        order = np.lexsort((length, access, targets, sources) if flagged else (length, targets, sources))
+        sources, targets, length = sources[order], targets[order], length[order]
+        keep = np.ones(len(order), dtype=bool)
+        keep[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+        if flagged:
+            access = access[order]
+            keep[1:] |= access[1:] != access[:-1]
+            access = access[keep]
+        sources, targets, length = sources[keep], targets[keep], length[keep]
+        kept = [edges[edge][:3] for edge in order[keep].tolist()]
+        exposure = edgearray(graph, kept).astype(np.float32)
+
+        # Points along each edge between its nodes, from simplified ways, oriented from the source to the target
+        shapex, shapey, counts = [], [], np.zeros(len(kept), dtype=np.int64)
+        for position, (u, v, k) in enumerate(kept):
+            geometry = graph.edges[u, v, k].get('geometry')
+            if geometry is None:
+                continue
+            coords = list(geometry.coords)
+            ux, uy = graph.nodes[u]['x'], graph.nodes[u]['y']
+            if (abs(coords[-1][0] - ux) + abs(coords[-1][1] - uy) <
+                    abs(coords[0][0] - ux) + abs(coords[0][1] - uy)):
+                coords.reverse()
+            for pointx, pointy in coords[1:-1]:
+                shapex.append(pointx)
+                shapey.append(pointy)
+            counts[position] = len(coords) - 2
+        shapeoffsets = np.zeros(len(kept) + 1, dtype=np.int64)
+        np.cumsum(counts, out=shapeoffsets[1:])
+
+        offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(nodes)), out=offsets[1:])
+        return cls(nodes, offsets, targets.astype(np.int32), length, x, y, pollution, exposure,
+                   access if flagged else None, shapeoffsets, np.array(shapex, dtype=float),
+                   np.array(shapey, dtype=float))
+
+    def save(self, folder):
+        """
+        Saves each array as a .npy file in a folder, along with the spatial index of the nodes
+
+        Args
+            folder (str): Folder path, created if it does not exist
+
+        Returns
+            None
+        """
+
+        os.makedirs(folder, exist_ok=True)
+        for name in ARRAYS:
+            if getattr(self, name) is None:
+                continue
+            np.save(os.path.join(folder, f'{name}.npy'), getattr(self, name))
+        self.snapindex().save(folder)
+
+    @classmethod
+    def load(cls, folder, mmap=True):
+        """
+        Loads a graph saved by save()
+
+        Args
+            folder (str): Folder path
+            mmap (bool): Memory maps the arrays rather than reading them into memory
+
+        Returns
+            csr (CSRGraph): Graph as CSR arrays
+        """
+
+        mode = 'r' if mmap else None
+        # Graphs saved before exposure was integrated along edges have no exposure array, graphs of a single
+        # network type have no access flags, and graphs saved before edge shapes were stored have no shape arrays
+        arrays = [np.load(os.path.join(folder, f'{name}.npy'), mmap_mode=mode)
+                  if os.path.exists(os.path.join(folder, f'{name}.npy')) else None for name in ARRAYS]
+        csr = cls(*arrays)
+        csr.nodeindex = NodeIndex.load(folder, csr.x, csr.y)
+        return csr
+
+    def withpollution(self, pollution, exposure=None):
+        """
+        Returns a copy of the graph sharing its arrays but with other node pollution, e.g. of another scenario
+
+        Args
+            pollution (numpy.ndarray): Array of shape (N, 3) of PM2.5, PM10 and NO2 values of each node
+            exposure (numpy.ndarray): Array of shape (E, 3) of exposure along each edge, defaults to the edge length
+                multiplied by the mean pollution of its end nodes
+
+        Returns
+            csr (CSRGraph): Graph with the new pollution
+        """
+
+        csr = CSRGraph(self.nodes, self.offsets, self.targets, self.length, self.x, self.y, pollution, exposure,
+                       access=self.access, shapeoffsets=self.shapeoffsets, shapex=self.shapex, shapey=self.shapey)
+        csr.nodeindex = self.nodeindex
+        return csr
+
+    @property
+    def nbytes(self):
+        """
+        Returns the memory used by the arrays in bytes
+        """
+
+        return sum(getattr(self, name).nbytes for name in ARRAYS if getattr(self, name) is not None)
+
+    def index(self, nodes):
+        """
+        Converts OSMnx node IDs to positions in the CSR arrays
+
+        Args
+            nodes (array-like): Node IDs
+
+        Returns
+            indexes (numpy.ndarray): Node indexes, raises NodeNotFound if a node is not in the graph
+        """
+
+        nodes = np.asarray(nodes, dtype=np.int64)
+        indexes = np.minimum(np.searchsorted(self.nodes, nodes), len(self.nodes) - 1)
+        missing = self.nodes[indexes] != nodes
+        if missing.any():
+            raise NodeNotFound(f"Nodes {nodes[missing].tolist()} not in graph.")
+        return indexes
+
+    def within(self, polygon):
+        """
+        Returns a mask of nodes inside a polygon, replacing the need to copy out a subgraph
+
+        Args
+            polygon (shapely.Polygon): Search area in EPSG:4326
+
+        Returns
+            mask (numpy.ndarray): Boolean array, True for nodes inside the polygon
+        """
+
+        # Bounding box test first so the exact test only runs on nearby nodes
+        minx, miny, maxx, maxy = polygon.bounds
+        mask = (self.x >= minx) & (self.x <= maxx) & (self.y >= miny) & (self.y <= maxy)
+        inbox = np.flatnonzero(mask)
+        mask[inbox] = shapely.contains_xy(polygon, self.x[inbox], self.y[inbox])
+        return mask
+
+    def snapindex(self):
+        """
+        Returns the spatial index of the nodes, building it the first time it is needed
+
+        Returns
+            nodeindex (NodeIndex): Spatial index of the nodes
+        """
+
+        if self.nodeindex is None:
+            self.nodeindex = NodeIndex.build(self.x, self.y)
+        return self.nodeindex
+
+    def snap(self, lats, lons, mask=None):
+        """
+        Returns the nearest node to each of many points and how far away it is, in one batch
+
+        Args
+            lats (array-like): Latitudes
+            lons (array-like): Longitudes
+            mask (numpy.ndarray): Boolean array of nodes which can be chosen, defaults to all
+
+        Returns
+            nodes (numpy.ndarray): Node ID of the nearest node to each point
+            distances (numpy.ndarray): Great circle distance from each point to its node in metres
+        """
+
+        indexes, distances = self.snapindex().snap(lats, lons, mask)
+        return self.nodes[indexes], distances
+
+    def nearest(self, lats, lons, mask=None):
+        """
+        Returns the nearest node to each point, see snap()
+
+        Args
+            lats (array-like): Latitudes
+            lons (array-like): Longitudes
+            mask (numpy.ndarray): Boolean array of nodes which can be chosen, defaults to all
+
+        Returns
+            nodes (list): Node ID of the nearest node to each point
+        """
+
+        return self.snap(lats, lons, mask)[0].tolist()
+
+    def modeedges(self, nettype):
+        """
+        Returns a mask of the edges a network type can use, so routing filters the unified graph at query time
+
+        Args
+            nettype (str): Network type - walk or bike
+
+        Returns
+            edges (numpy.ndarray): Boolean array, True for edges of the network type, or None where every edge can
+                be used
+        """
+
+        if self.access is None:
+            return None
+        return (self.access & ACCESS_BITS[nettype]) != 0
+
+    def modenodes(self, edges):
+        """
+        Returns a mask of the nodes at either end of the edges of a mask
+
+        Args
+            edges (numpy.ndarray): Boolean array of edges, as from modeedges()
+
+        Returns
+            nodes (numpy.ndarray): Boolean array, True for nodes joined by the edges
+        """
+
+        sources = np.repeat(np.arange(len(self.nodes)), np.diff(self.offsets))
+        nodes = np.zeros(len(self.nodes), dtype=bool)
+        nodes[sources[edges]] = True
+        nodes[self.targets[edges]] = True
+        return nodes
+
+    def noderatios(self, limits):
+        """
+        Returns how far each node is over its pollution limits, as the highest ratio of value to limit
+
+        Args
+            limits (tuple): Tuple of PM2.5, PM10 and NO2 limits, as from limitervalues()
+
+        Returns
+            ratios (numpy.ndarray): Ratio of each node, 1 or more means a pollutant is at or over its limit
+        """
+
+        return (self.pollution / np.asarray(limits, dtype=np.float32)).max(axis=1)
+
+    def edgeratios(self, limits):
+        """
+        Returns how far each edge is over its pollution limits, as the highest ratio of mean value to limit
+        The mean value is the exposure along the edge divided by its length
+
+        Args
+            limits (tuple): Tuple of PM2.5, PM10 and NO2 limits, as from limitervalues()
+
+        Returns
+            ratios (numpy.ndarray): Ratio of each edge, 1 or more means a pollutant is at or over its limit
+        """
+
+        length = np.asarray(self.length, dtype=float)[:, None]
+        means = np.divide(self.exposure, length, out=np.zeros(self.exposure.shape), where=length > 0)
+        return (means / np.asarray(limits, dtype=float)).max(axis=1)
+
+    def exposureweights(self, ratios, weight):
+        """
+        Returns edge weights of length + weight * exposure
+        Exposure of an edge is its length multiplied by its ratio to the limits
+
+        Args
+            ratios (numpy.ndarray): Ratio of each edge, as from edgeratios()
+            weight (float): Weighting of exposure against length, 0 gives the edge length
+
+        Returns
+            weights (numpy.ndarray): Weight of each edge
+        """
+
+        return self.length * (1 + weight * ratios)
+
+    def pathedges(self, path, edges=None):
+        """
+        Returns the edge of each consecutive pair of nodes along a path, the shortest where there are parallel edges
+
+        Args
+            path (list): List of node IDs, as from shortestpath()
+            edges (numpy.ndarray): Boolean array of edges which can be used, as from modeedges(), defaults to all
+
+        Returns
+            edges (numpy.ndarray): Edge indexes into targets, length and the other edge arrays
+        """
+
+        indexes = self.index(path)
+        pathedges = np.empty(len(indexes) - 1, dtype=np.int64)
+        for position, (u, v) in enumerate(zip(indexes[:-1], indexes[1:])):
+            start, end = self.offsets[u], self.offsets[u + 1]
+            found = self.targets[start:end] == v
+            if edges is not None:
+                found &= edges[start:end]
+            candidates = start + np.flatnonzero(found)
+            pathedges[position] = candidates[np.argmin(self.length[candidates])]
+        return pathedges
+
+    def pathexposure(self, path, edges=None):
+        """
+        Returns the length of a path and its exposure to each pollutant, summed over its edges
+
+        Args
+            path (list): List of node IDs, as from shortestpath()
+            edges (numpy.ndarray): Boolean array of edges which can be used, as from modeedges(), defaults to all
+
+        Returns
+            length (float): Length of the path in metres
+            exposure (numpy.ndarray): PM2.5, PM10 and NO2 exposure in µg/m³·m
+        """
+
+        edges = self.pathedges(path, edges)
+        return float(self.length[edges].sum()), self.exposure[edges].sum(axis=0, dtype=float)
+
+    def pathlines(self, path, edges=None):
+        """
+        Returns the coordinates along each edge of a path, following the shape of the street where it is stored
+
+        Args
+            path (list): List of node IDs, as from shortestpath()
+            edges (numpy.ndarray): Boolean array of edges which can be used, as from modeedges(), defaults to all
+
+        Returns
+            lines (list): List of each edge's [longitude, latitude] coordinates, from its source to its target
+        """
+
+        indexes = self.index(path).tolist()
+        lines = []
+        for u, v, edge in zip(indexes[:-1], indexes[1:], self.pathedges(path, edges).tolist()):
+            line = [[float(self.x[u]), float(self.y[u])]]
+            if self.shapeoffsets is not None:
+                start, end = self.shapeoffsets[edge], self.shapeoffsets[edge + 1]
+                line.extend([pointx, pointy] for pointx, pointy in zip(self.shapex[start:end].tolist(),
+                                                                      self.shapey[start:end].tolist()))
+            line.append([float(self.x[v]), float(self.y[v])])
+            lines.append(line)
+        return lines
+
+    def edgegeometries(self, edges):
+        """
+        Returns the shape of many edges as lines, running from their source to their target, in one batch
+
+        Args
+            edges (numpy.ndarray): Edge indexes
+
+        Returns
+            geometries (numpy.ndarray): Array of shapely LineStrings in EPSG:4326, straight where no shape is stored
+        """
+
+        edges = np.asarray(edges, dtype=np.int64)
+        sources = np.searchsorted(self.offsets, edges, side='right') - 1
+        targets = self.targets[edges]
+        if self.shapeoffsets is None:
+            starts = inner = np.zeros(len(edges), dtype=np.int64)
+        else:
+            starts = self.shapeoffsets[edges]
+            inner = self.shapeoffsets[edges + 1] - starts
+
+        # Each line is its source node, the stored points along the edge, then its target node
+        counts = inner + 2
+        firsts = np.zeros(len(edges) + 1, dtype=np.int64)
+        np.cumsum(counts, out=firsts[1:])
+        line = np.repeat(np.arange(len(edges)), counts)
+        position = np.arange(firsts[-1]) - firsts[line]
+        coords = np.empty((firsts[-1], 2))
+        coords[firsts[:-1]] = np.column_stack((self.x[sources], self.y[sources]))
+        coords[firsts[1:] - 1] = np.column_stack((self.x[targets], self.y[targets]))
+        between = np.flatnonzero((position > 0) & (position < counts[line] - 1))
+        points = starts[line[between]] + position[between] - 1
+        coords[between, 0] = self.shapex[points]
+        coords[between, 1] = self.shapey[points]
+        return shapely.linestrings(coords, indices=line)
+
+    def shortestpath(self, source, target, weights=None, mask=None, landmarks=None, edges=None, stop=None):
+        """
+        Finds the route with the lowest total weight using an A* search
+        Weights must be no lower than edge lengths, so straight line distance never overestimates
+
+        Args
+            source (int): Node ID of start
+            target (int): Node ID of end
+            weights (numpy.ndarray): Weight of each edge, defaults to length
+            mask (numpy.ndarray): Boolean array of nodes which can be used, defaults to all
+            landmarks (Landmarks): Distance tables valid for the weights, tightening the estimate, optional
+            edges (numpy.ndarray): Boolean array of edges which can be used, as from modeedges(), defaults to all
+            stop (function): Called every STOP_INTERVAL nodes settled, may raise to abandon the search, optional
+
+        Returns
+            path (list): List of node IDs from source to target, raises NetworkXNoPath if unreachable
+        """
+
+        weights = self.length if weights is None else weights
+        start, end = self.index([source, target]).tolist()
+        y, x, offsets, targets = self.y, self.x, self.offsets, self.targets
+
+        # Straight line distance to the end is worked out with math rather than NumPy, as it runs once per edge
+        endlat, endlon = math.radians(self.y[end]), math.radians(self.x[end])
+        endcos = math.cos(endlat)
+
+        def estimate(lat, lon):
+            lat, lon = math.radians(lat), math.radians(lon)
+            a = math.sin((endlat - lat) / 2) ** 2 + math.cos(lat) * endcos * math.sin((endlon - lon) / 2) ** 2
+            return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1)))
+
+        tableestimate = None if landmarks is None else landmarks.estimator(end)
+
+        distances = {start: 0.0}
+        previous = {start: -1}
+        heap = [(0.0, 0.0, start)]
+        settled = 0
+        while heap:
+            _, distance, node = heapq.heappop(heap)
+            settled += 1
+            if stop is not None and settled % STOP_INTERVAL == 0:
+                stop()
+            if node == end:
+                break
+            if distance > distances[node]:
+                continue
+            first, last = offsets[node], offsets[node + 1]
+            neighbours = targets[first:last]
+            allowed = [True] * len(neighbours) if mask is None else mask[neighbours].tolist()
+            passable = [True] * len(neighbours) if edges is None else edges[first:last].tolist()
+            for neighbour, cost, use, usable, lat, lon in zip(neighbours.tolist(), weights[first:last].tolist(),
+                                                              allowed, passable, y[neighbours].tolist(),
+                                                              x[neighbours].tolist()):
+                if not usable or (not use and neighbour != end):
+                    continue
+                newdistance = distance + cost
+                if newdistance < distances.get(neighbour, math.inf):
+                    bound = estimate(lat, lon)
+                    if tableestimate is not None:
+                        bound = max(bound, tableestimate(neighbour))
+                        # Landmarks show the end cannot be reached from this node
+                        if bound == math.inf:
+                            continue
+                    distances[neighbour] = newdistance
+                    previous[neighbour] = node
+                    heapq.heappush(heap, (newdistance + bound, newdistance, neighbour))
+        else:
+            raise NetworkXNoPath(f"No path between {source} and {target}.")
+
+        path = [end]
+        while previous[path[-1]] != -1:
+            path.append(previous[path[-1]])
+        return self.nodes[path[::-1]].tolist()
+
+    def mintolerance(self, source, target, ratios, mask=None, edges=None, stop=None):
+        """
+        Finds the smallest tolerance at which source and target are connected, as a minimax (bottleneck) search
+        The tolerance of a path is the highest ratio of its nodes, start and end nodes are always allowed
+
+        Args
+            source (int): Node ID of start
+            target (int): Node ID of end
+            ratios (numpy.ndarray): Ratio of each node, as from noderatios()
+            mask (numpy.ndarray): Boolean array of nodes which can be used, defaults to all
+            edges (numpy.ndarray): Boolean array of edges which can be used, as from modeedges(), defaults to all
+            stop (function): Called every STOP_INTERVAL nodes settled, may raise to abandon the search, optional
+
+        Returns
+            tolerance (float): Smallest tolerance of any path, raises NetworkXNoPath if unreachable
+        """
+
+        start, end = self.index([source, target]).tolist()
+        offsets, targets = self.offsets, self.targets
+
+        best = {start: 0.0}
+        heap = [(0.0, start)]
+        settled = 0
+        while heap:
+            bottleneck, node = heapq.heappop(heap)
+            settled += 1
+            if stop is not None and settled % STOP_INTERVAL == 0:
+                stop()
+            if node == end:
+                return bottleneck
+            if bottleneck > best[node]:
+                continue
+            first, last = offsets[node], offsets[node + 1]
+            neighbours = targets[first:last]
+            allowed = [True] * len(neighbours) if mask is None else mask[neighbours].tolist()
+            passable = [True] * len(neighbours) if edges is None else edges[first:last].tolist()
+            for neighbour, ratio, use, usable in zip(neighbours.tolist(), ratios[neighbours].tolist(), allowed,
+                                                     passable):
+                if not usable:
+                    continue
+                elif neighbour == end:
+                    nextbottleneck = bottleneck
+                elif use:
+                    nextbottleneck = max(bottleneck, ratio)
+                else:
+                    continue
+                if nextbottleneck < best.get(neighbour, math.inf):
+                    best[neighbour] = nextbottleneck
+                    heapq.heappush(heap, (nextbottleneck, neighbour))
+        raise NetworkXNoPath(f"No path between {source} and {target}.")
+
+    def limitedpath(self, source, target, ratios, tolerance, mask=None, landmarks=None, edges=None, stop=None):
+        """
+        Finds the shortest route using only nodes with a ratio no higher than the tolerance
+
+        Args
+            source (int): Node ID of start
+            target (int): Node ID of end
+            ratios (numpy.ndarray): Ratio of each node, as from noderatios()
+            tolerance (float): Highest ratio allowed, as from mintolerance()
+            mask (numpy.ndarray): Boolean array of nodes which can be used, defaults to all
+            landmarks (Landmarks): Distance tables valid for edge lengths, optional
+            edges (numpy.ndarray): Boolean array of edges which can be used, as from modeedges(), defaults to all
+            stop (function): Called every STOP_INTERVAL nodes settled, may raise to abandon the search, optional
+
+        Returns
+            path (list): List of node IDs from source to target, raises NetworkXNoPath if unreachable
+        """
+
+        allowed = ratios <= tolerance
+        if mask is not None:
+            allowed &= mask
+        return self.shortestpath(source, target, mask=allowed, landmarks=landmarks, edges=edges, stop=stop)
+
+    def exposurepath(self, source, target, ratios, weight, mask=None, landmarks=None, edges=None, stop=None):
+        """
+        Finds a route in one search by minimising length + weight * exposure
+
+        Args
+            source (int): Node ID of start
+            target (int): Node ID of end
+            ratios (numpy.ndarray): Ratio of each edge, as from edgeratios()
+            weight (float): Weighting of exposure against length, 0 gives the shortest route
+            mask (numpy.ndarray): Boolean array of nodes which can be used, defaults to all
+            landmarks (Landmarks): Distance tables valid for the weighting, optional
+            edges (numpy.ndarray): Boolean array of edges which can be used, as from modeedges(), defaults to all
+            stop (function): Called every STOP_INTERVAL nodes settled, may raise to abandon the search, optional
+
+        Returns
+            path (list): List of node IDs from source to target, raises NetworkXNoPath if unreachable
+        """
+
+        return self.shortestpath(source, target, self.exposureweights(ratios, weight), mask, landmarks, edges, stop)
+
+    def paretopaths(self, source, target, ratios, mask=None, landmarks=None, edges=None, detour=PARETO_DETOUR,
+                    epsilon=PARETO_EPSILON, stop=None):
+        """
+        Finds the Pareto set of routes trading length against exposure, in one multi-objective label-setting search
+        Each node keeps labels of the length and exposure of partial routes reaching it that no other label beats
+        on both, and labels are settled in order of length plus the distance still to go, so routes reach the end
+        shortest first with each lower in exposure than the last
+        Exposure of an edge is its length multiplied by its ratio to the limits, as in exposureweights()
+
+        Args
+            source (int): Node ID of start
+            target (int): Node ID of end
+            ratios (numpy.ndarray): Ratio of each edge, as from edgeratios()
+            mask (numpy.ndarray): Boolean array of nodes which can be used, defaults to all
+            landmarks (Landmarks): Distance tables valid for edge lengths, optional
+            edges (numpy.ndarray): Boolean array of edges which can be used, as from modeedges(), defaults to all
+            detour (float): Longest route followed as a multiple of the shortest, bounding the search
+            epsilon (float): Routes within this fraction of the exposure of a shorter route are dropped, so
+                routes differing by a few metres of pollution are not all kept
+            stop (function): Called every STOP_INTERVAL labels settled, may raise to abandon the search, optional
+
+        Returns
+            routes (list): (path, length, exposure) of each route in the set, shortest first, where path is a list
+            of node IDs, raises NetworkXNoPath if unreachable
+        """
+
+        start, end = self.index([source, target]).tolist()
+        y, x, offsets, targets, length = self.y, self.x, self.offsets, self.targets, self.length
+
+        # Straight line distance to the end, as in shortestpath()
+        endlat, endlon = math.radians(self.y[end]), math.radians(self.x[end])
+        endcos = math.cos(endlat)
+
+        def estimate(lat, lon):
+            lat, lon = math.radians(lat), math.radians(lon)
+            a = math.sin((endlat - lat) / 2) ** 2 + math.cos(lat) * endcos * math.sin((endlon - lon) / 2) ** 2
+            return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1)))
+
+        tableestimate = None if landmarks is None else landmarks.estimator(end)
+        # Lowest ratio of any usable edge, so the exposure still to come is never overestimated
+        usableratios = ratios if edges is None else ratios[edges]
+        minratio = max(float(usableratios.min()), 0.0) if usableratios.size else 0.0
+
+        # Labels as parallel lists of their node, length, exposure and the label they extend
+        labelnode, labellength, labelexposure, labelparent = [start], [0.0], [0.0], [-1]
+        alive = [True]
+        nodelabels = {start: [0]}
+        found = []
+        bestexposure = maxlength = math.inf
+        heap = [(0.0, 0.0, 0)]
+        settled = 0
+        while heap:
+            key, exposure, label = heapq.heappop(heap)
+            settled += 1
+            if stop is not None and settled % STOP_INTERVAL == 0:
+                stop()
+            if key > maxlength:
+                break
+            # Labels beaten since they were added, or by a route found since
+            if not alive[label] or exposure >= bestexposure / (1 + epsilon):
+                continue
+            node, distance = labelnode[label], labellength[label]
+            if node == end:
+                # Routes reach the end shortest first, so each one found is lower in exposure than the last
+                found.append(label)
+                bestexposure = exposure
+                if maxlength == math.inf:
+                    maxlength = distance * detour
+                continue
+            first, last = offsets[node], offsets[node + 1]
+            neighbours = targets[first:last]
+            allowed = [True] * len(neighbours) if mask is None else mask[neighbours].tolist()
+            passable = [True] * len(neighbours) if edges is None else edges[first:last].tolist()
+            for neighbour, edgelength, ratio, use, usable, lat, lon in zip(
+                    neighbours.tolist(), length[first:last].tolist(), ratios[first:last].tolist(), allowed, passable,
+                    y[neighbours].tolist(), x[neighbours].tolist()):
+                if not usable or (not use and neighbour != end):
+                    continue
+                newlength = distance + edgelength
+                newexposure = exposure + edgelength * ratio
+                existing = nodelabels.get(neighbour, [])
+                if any(labellength[other] <= newlength and labelexposure[other] <= newexposure
+                       for other in existing):
+                    continue
+                bound = estimate(lat, lon)
+                if tableestimate is not None:
+                    bound = max(bound, tableestimate(neighbour))
+                    # Landmarks show the end cannot be reached from this node
+                    if bound == math.inf:
+                        continue
+                # Dropping labels too long to keep or which cannot beat the exposure of a route already found
+                if newlength + bound > maxlength or newexposure + minratio * bound >= bestexposure / (1 + epsilon):
+                    continue
+                newlabel = len(labelnode)
+                labelnode.append(neighbour)
+                labellength.append(newlength)
+                labelexposure.append(newexposure)
+                labelparent.append(label)
+                alive.append(True)
+                # Labels the new label beats on both are no longer followed
+                keep = []
+                for other in existing:
+                    if newlength <= labellength[other] and newexposure <= labelexposure[other]:
+                        alive[other] = False
+                    else:
+                        keep.append(other)
+                keep.append(newlabel)
+                nodelabels[neighbour] = keep
+                heapq.heappush(heap, (newlength + bound, newexposure, newlabel))
+
+        if not found:
+            raise NetworkXNoPath(f"No path between {source} and {target}.")
+
+        routes = []
+        for label in found:
+            path = [label]
+            while labelparent[path[-1]] != -1:
+                path.append(labelparent[path[-1]])
+            nodes = [labelnode[step] for step in reversed(path)]
+            routes.append((self.nodes[nodes].tolist(), labellength[label], labelexposure[label]))
+        return routes
+
+    def distinctpaths(self, paths, count, edges=None):
+        """
+        Chooses the paths which share the least length with each other, always keeping the first and last
+        Paths are added one at a time, each the one whose greatest overlap with those already chosen is smallest,
+        where the overlap of two paths is the length of their shared edges over the length of both together
+
+        Args
+            paths (list): Lists of node IDs, e.g. of the routes from paretopaths()
+            count (int): Most paths to choose
+            edges (numpy.ndarray): Boolean array of edges which can be used, as from modeedges(), defaults to all
+
+        Returns
+            chosen (list): Sorted indexes of the chosen paths
+        """
+
+        if len(paths) <= count:
+            return list(range(len(paths)))
+
+        edgesets = [set(self.pathedges(path, edges).tolist()) for path in paths]
+        lengths = [float(self.length[list(edgeset)].sum()) for edgeset in edgesets]
+
+        def overlap(a, b):
+            shared = float(self.length[list(edgesets[a] & edgesets[b])].sum())
+            union = lengths[a] + lengths[b] - shared
+            return shared / union if union > 0 else 1.0
+
+        chosen = [0, len(paths) - 1][:count]
+        while len(chosen) < count:
+            candidates = [index for index in range(len(paths)) if index not in chosen]
+            chosen.append(min(candidates, key=lambda index: max(overlap(index, other) for other in chosen)))
+        return sorted(chosen)
@@ -0,0 +1,278 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import rasterio as rio
+from affine import Affine
+
+# Import raster locations, pollutant names and tiled sampling from raster script
+from raster import DATA_DIR, RASTERS, POLLUTANTS, TileCache, pollutantkey, sampletiled
+
+# Import request counters from metrics script
+from metrics import count
+
+# Folder of the pollution cube, holding one folder per scenario and year
+CUBE_DIR = os.path.join(DATA_DIR, 'cube')
+
+# Rows and columns of each stored tile
+CHUNK = 256
+
+# Memory budget of tiles held by the shared cube, set in megabytes with ROUTEPLANNER_CUBE_MB
+CUBE_BUDGET = int(float(os.environ.get('ROUTEPLANNER_CUBE_MB', 256)) * 2 ** 20)
+
+# Scenario name of the rasters in the data folder, used when no scenario is given
+BASELINE = 'baseline'
+
+
+def datasetpath(scenario, year, folder=CUBE_DIR):
+    """
+        Returns the folder path of a scenario and year in the cube
+
+        Args
+            scenario (str): Scenario name, e.g. baseline or ulez_expansion
+            year (int): Year of the projection
+            folder (str): Cube folder
+
+        Returns
+            path (str): Path of the folder of tiled arrays
+    """
+
+    return os.path.join(folder, str(scenario), str(int(year)))
+
+
+def importraster(path, scenario, year, pollutant, folder=CUBE_DIR, chunk=CHUNK):
+    """
+        Splits a pollutant raster into square tiles and saves them to the cube as one .npy array
+        Tiles are stored one after another so a memory mapped tile can be read without touching its neighbours
+
+        Args
+            path (str): Path of the GeoTIFF raster
+            scenario (str): Scenario name
+            year (int): Year of the projection
+            pollutant (str): Pollutant type - NO2, PM2.5 or PM10
+            folder (str): Cube folder
+            chunk (int): Rows and columns of each tile
+
+        Returns
+            path (str): Path of the saved array
+    """
+
+    key = pollutantkey(pollutant)
+    with rio.open(path) as src:
+        band = src.read(1).astype(np.float32)
+        transform = src.transform
+
+    # Padding the band to whole tiles, padded cells are outside the raster and never sampled
+    rows, cols = band.shape
+    tilerows, tilecols = -(-rows // chunk), -(-cols // chunk)
+    padded = np.zeros((tilerows * chunk, tilecols * chunk), dtype=np.float32)
+    padded[:rows, :cols] = band
+    tiles = padded.reshape(tilerows, chunk, tilecols, chunk).swapaxes(1, 2)
+
+    target = datasetpath(scenario, year, folder)
+    os.makedirs(target, exist_ok=True)
+    np.save(os.path.join(target, f'{key}.npy'), np.ascontiguousarray(tiles))
+    with open(os.path.join(target, f'{key}.json'), 'w') as file:
+        json.dump({'shape': [rows, cols], 'chunk': chunk, 'transform': list(transform[:6])}, file)
+    return os.path.join(target, f'{key}.npy')
+
+
+class PollutionCube:
+    """
+    Pollution data indexed by scenario, year and pollutant, stored as memory mapped arrays of tiles
+    Only the tiles a request samples are read, and recently used tiles are kept in memory under a byte budget,
+    so many scenarios can be held without loading them into memory
+
+    Attributes
+        folder (str): Cube folder
+        cache (TileCache): Recently used tiles
+        arrays (dict): (scenario, year, pollutant) to memory mapped array of tiles
+        grids (dict): (scenario, year, pollutant) to inverse transform, shape and tile size
+
+    Methods
+        .__init___(): Constructs the cube object
+        .datasets(): Lists the scenarios and years in the cube
+        .latest(): Returns the latest year of a scenario
+        .resolve(): Checks a scenario and year are in the cube
+        .open(): Memory maps the tiles of a pollutant
+        .resolution(): Returns the finest cell size of a scenario and year
+        .sample_many(): Samples many points for many pollutants of a scenario and year in one call
+
+    """
+
+    def __init__(self, folder=CUBE_DIR, budget=CUBE_BUDGET):
+        """
+        Constructs all the necessary attributes for the cube object.
+
+        Args
+            folder (str): Cube folder
+            budget (int): Most bytes of tiles to keep in memory
+
+        Returns
+            None
+        """
+
+        self.folder = folder
+        self.cache = TileCache(budget, 'cube')
+        self.arrays = {}
+        self.grids = {}
+
+    def datasets(self):
+        """
+        Lists the scenarios and years in the cube which have every pollutant
+
+        Returns
+            datasets (list): Sorted list of (scenario, year) tuples
+        """
+
+        datasets = []
+        if not os.path.isdir(self.folder):
+            return datasets
+        for scenario in sorted(os.listdir(self.folder)):
+            scenariofolder = os.path.join(self.folder, scenario)
+            if not os.path.isdir(scenariofolder):
+                continue
+            for year in sorted(os.listdir(scenariofolder)):
+                yearfolder = os.path.join(scenariofolder, year)
+                complete = all(os.path.exists(os.path.join(yearfolder, f'{key}.npy')) for key in RASTERS)
+                if year.isdigit() and complete:
+                    datasets.append((scenario, int(year)))
+        return datasets
+
+    def latest(self, scenario):
+        """
+        Returns the latest year of a scenario
+
+        Args
+            scenario (str): Scenario name
+
+        Returns
+            year (int): Latest year in the cube, raises ValueError if the scenario is not in the cube
+        """
+
+        years = [year for name, year in self.datasets() if name == scenario]
+        if not years:
+            raise ValueError(f"Unknown scenario {scenario}, expected one of "
+                             f"{sorted({name for name, year in self.datasets()})}")
+        return max(years)
+
+    def resolve(self, scenario, year=None):
+        """
+        Checks a scenario and year are in the cube, choosing the latest year where none is given
+
+        Args
+            scenario (str): Scenario name
+            year (int): Year of the projection, optional
+
+        Returns
+            year (int): Year of the projection, raises ValueError if it is not in the cube
+        """
+
+        if year is None:
+            return self.latest(scenario)
+        if (scenario, int(year)) not in self.datasets():
+            raise ValueError(f"Scenario {scenario} has no data for {year}")
+        return int(year)
+
+    def open(self, scenario, year, pollutant):
+        """
+        Memory maps the tiles of a pollutant, no values are read until tiles are sampled
+
+        Args
+            scenario (str): Scenario name
+            year (int): Year of the projection
+            pollutant (str): Pollutant type - NO2, PM2.5 or PM10
+
+        Returns
+            tiles (numpy.ndarray): Memory mapped array of shape (tile rows, tile columns, chunk, chunk)
+            grid (tuple): Inverse transform, shape and tile size of the raster
+        """
+
+        key = (scenario, int(year), pollutantkey(pollutant))
+        if key not in self.arrays:
+            target = datasetpath(scenario, year, self.folder)
+            if not os.path.exists(os.path.join(target, f'{key[2]}.npy')):
+                raise ValueError(f"Scenario {scenario} has no {key[2]} data for {year}")
+            with open(os.path.join(target, f'{key[2]}.json')) as file:
+                meta = json.load(file)
+            self.arrays[key] = np.load(os.path.join(target, f'{key[2]}.npy'), mmap_mode='r')
+            self.grids[key] = (~Affine(*meta['transform']), tuple(meta['shape']), meta['chunk'])
+        return self.arrays[key], self.grids[key]
+
+    def resolution(self, scenario=BASELINE, year=None, pollutants=POLLUTANTS):
+        """
+        Returns the finest cell width or height of a scenario and year, as RasterStore.resolution()
+
+        Args
+            scenario (str): Scenario name
+            year (int): Year of the projection, defaults to the latest year of the scenario
+            pollutants (tuple): Pollutant types to check
+
+        Returns
+            resolution (float): Smallest cell size, in degrees for EPSG:4326 rasters
+        """
+
+        year = self.latest(scenario) if year is None else int(year)
+        sizes = []
+        for pollutant in pollutants:
+            forward = ~self.open(scenario, year, pollutant)[1][0]
+            sizes.extend((abs(forward.a), abs(forward.e)))
+        return min(sizes)
+
+    def sample_many(self, lats, lons, pollutants=POLLUTANTS, scenario=BASELINE, year=None):
+        """
+        Takes arrays of lats and lons and returns the value of each pollutant at every point for a scenario
+        Points outside of the raster return 0, as with RasterStore.sample_many()
+
+        Args
+            lats (array-like): Latitudes
+            lons (array-like): Longitudes
+            pollutants (tuple): Pollutant types, one column is returned per pollutant
+            scenario (str): Scenario name
+            year (int): Year of the projection, defaults to the latest year of the scenario
+
+        Returns
+            values (numpy.ndarray): Array of shape (N, len(pollutants)) of pollution in μg/m3
+        """
+
+        year = self.latest(scenario) if year is None else int(year)
+        lats = np.asarray(lats, dtype=float).ravel()
+        lons = np.asarray(lons, dtype=float).ravel()
+        values = np.zeros((lats.size, len(pollutants)))
+        for column, pollutant in enumerate(pollutants):
+            tiles, (inverse, shape, chunk) = self.open(scenario, year, pollutant)
+            key = (scenario, year, pollutantkey(pollutant))
+
+            def tile(row, col):
+                # Copying the tile out of the memory map reads only its own bytes from disk
+                return self.cache.get(key + (row, col), lambda: np.array(tiles[row, col]))
+
+            values[:, column] = sampletiled(lats, lons, inverse, shape, chunk, tile)
+        count('raster_samples', values.size, store='cube')
+        return values
+
+
+# Cube shared by the whole process so tiles are cached across requests
+cube = PollutionCube()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manages the scenario and year pollution cube')
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('import', help='Imports the rasters of a scenario and year')
+    add.add_argument('scenario', help='Scenario name, e.g. baseline or ulez_expansion')
+    add.add_argument('year', type=int, help='Year of the projection')
+    add.add_argument('--pm2_5', help='PM2.5 raster, defaults to the raster in the data folder')
+    add.add_argument('--pm10', help='PM10 raster, defaults to the raster in the data folder')
+    add.add_argument('--no2', help='NO2 raster, defaults to the raster in the data folder')
+    commands.add_parser('list', help='Lists the scenarios and years in the cube')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        for option, pollutant in (('pm2_5', 'PM2.5'), ('pm10', 'PM10'), ('no2', 'NO2')):
+            source = getattr(args, option) or RASTERS[pollutant]
+            print(f'Saved {importraster(source, args.scenario, args.year, pollutant)}')
+    else:
+        for name, datasetyear in cube.datasets():
+            print(f'{name} {datasetyear}')
@@ -0,0 +1,1309 @@
+# ==========================================================================
+# 1.0 Importing packages, modules and scripts
+# ==========================================================================
+
+# Import networking packages, modules and errors
+import osmnx as ox
+from networkx import NetworkXNoPath
+
+# Import io for rendering maps to HTML, and threading for cancelling routes planned on other threads
+import io
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Import general geographical data packages
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+import shapely
+
+# Import raster, graph, routing and geocoding functions from other scripts
+import raster
+from raster import inlondon, loadboundary, POLLUTANTS
+from network import annotategraph, integrateexposure, EARTH_RADIUS
+from csrgraph import CSRGraph
+from graphstore import loadcsr, loadlandmarks, storename, unifygraph, keeptags, NETWORK_FILTERS
+from landmarks import choosetables
+from geocoder import geocoder
+from cube import cube
+from routecache import routecache, routekey, datasetversion
+from metrics import span, count, setvalue
+
+# Import folium for map construction
+import folium
+
+# Routing modes, avoiding pollution limits, weighing exposure against distance or offering the Pareto set of both
+MODES = ('limits', 'exposure', 'pareto')
+
+# Most routes offered by the pareto mode, including the fastest and the lowest exposure routes
+PARETO_ROUTES = 4
+
+# Network types of the walk and cycle options
+NETWORK_TYPES = ('walk', 'bike')
+
+# Longest route held by the search area, as a multiple of the straight line distance between the start and end,
+# above the 1.2 to 1.4 typical of walking and cycling routes in cities
+DETOUR_FACTOR = 1.4
+
+# Growth of the detour factor each time no route is found within the search area, up to DETOUR_LIMIT
+DETOUR_GROWTH = 2.0
+DETOUR_LIMIT = 6.0
+
+# Shortest distance in metres the search area is sized for, so nearby locations still have streets to detour along
+MIN_CORRIDOR = 2000
+
+# Scenario graphs kept with the pollution already sampled for them, most recently used last
+SCENARIO_GRAPHS = 2
+
+# Safe limits for air pollution of each World Health Organisation guideline, annual means in μg/m3
+LIMIT_STANDARDS = {
+    'who2005': {"pm2_5": 10, "pm10": 20, "no2": 40},
+    'who2021': {"pm2_5": 5, "pm10": 15, "no2": 10},
+}
+
+
+class RouteError(Exception):
+    """
+    Raised when a route cannot be planned, the message is suitable to show to the user
+    """
+
+
+class LocationError(RouteError):
+    """
+    Raised when one or more addresses could not be geocoded
+    """
+
+
+class RouteCancelled(Exception):
+    """
+    Raised by a progress function or checkcancelled() to stop planning a route which is no longer wanted
+    """
+
+
+# Cancellation event of the route being planned on each thread, set by cancellable()
+_cancel = threading.local()
+
+
+@contextmanager
+def cancellable(event):
+    """
+    Lets a route planned on this thread be stopped within its long stages, such as searches, as well as between
+    stages, by checking the event with checkcancelled()
+
+    Args
+        event (threading.Event): Set to cancel the route
+
+    Returns
+        None
+    """
+
+    outer = getattr(_cancel, 'event', None)
+    _cancel.event = event
+    try:
+        yield
+    finally:
+        _cancel.event = outer
+
+
+def checkcancelled():
+    """
+    Raises RouteCancelled if the route being planned on this thread has been cancelled, see cancellable()
+
+    Returns
+        None
+    """
+
+    event = getattr(_cancel, 'event', None)
+    if event is not None and event.is_set():
+        raise RouteCancelled()
+
+
+# ==========================================================================
+# 4.1 Getting user inputs and geocoding locations
+# ==========================================================================
+
+class Inputs:
+    """
+    Class representing user inputs
+
+    Attributes
+        initial (str): Inital location
+        target (str): Target location
+
+    Methods
+        .__init___(): Constructs the object
+        .geocodeaddresses(): Geocodes the inputs
+
+    """
+
+    def __init__(self, initial, target):
+        """
+        Constructs all the necessary attributes for the inputs object.
+
+        Args
+            initial(str): Initial location
+            target(str): Target location
+
+        Returns
+            None
+        """
+
+        self.initial = initial
+        self.target = target
+
+    def geocodeaddresses(self):
+        """
+        Adds locational context to user input
+        Locations are found in the bundled gazetteer, imported postcodes or the geocoding cache where possible,
+        only falling back to the remote geocoder for new queries
+
+        Args
+
+        Returns
+            geocodeinit (list): Initial address, latitude and longtitude
+            geocodetarget (list): Target address, latitude and longtitude
+
+        """
+        initloc = geocoder.geocode(self.initial)
+        targetloc = geocoder.geocode(self.target)
+        if initloc is None or targetloc is None:
+            geocodeinit = "Fail"
+            geocodetarget = "Fail"
+            return geocodeinit, geocodetarget
+        geocodeinit = list(initloc)
+        geocodetarget = list(targetloc)
+        return geocodeinit, geocodetarget
+
+
+def checkboundary(geocodedinital, geocodedtarget):
+    """
+    Takes a latitude and longitude and checks whether it is in the Greater London boundary
+    This is done with a bitmask of the raster cells with data, so the rasters are not sampled
+
+    Args
+        geocodedinital (list): Input class style list with location, latitude, longitude of start location
+        geocodedtarget (list): Input class style list with location, latitude, longitude of end location
+
+    Returns
+        in_london (bool): True or false of whether location is within Greater London boundary
+    """
+    lats = [geocodedinital[-2], geocodedtarget[-2]]
+    lons = [geocodedinital[-1], geocodedtarget[-1]]
+    in_london = bool(inlondon(lats, lons).all())
+    return in_london
+
+
+# ==========================================================================
+# 4.2 Processing initial fastest route
+# ==========================================================================
+
+class Locations:
+    """
+    Class representing users locations, capable of producing geodataframes and nodes
+    Attributes easiest constructed using Nomantim tool within the Inputs class
+
+    Attributes
+        places (list): List of addresses
+        latitudes (list): List of latitudes
+        longtitudes (list): List of longtitudes
+
+    Methods
+        .__init___(): Constructs the object
+        .gpdframe(): Constructs a geopandas frame from the inputs with CRS 4326 geometry
+        .corridor(): Constructs the search area around the locations
+        .getnodes(): Returns the closest nodes to the inital and target locations
+
+    """
+
+    def __init__(self, places, latitudes, longitudes):
+        """
+        Constructs all the necessary attributes for the locations object.
+
+        Args
+            places (list): List of addresses
+            latitudes (list): List of latitudes
+            longtitudes (list): List of longtitudes
+
+        Returns
+            None
+
+        """
+        self.places = places
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+
+    def gpdframe(self):
+        """
+        Constructs a geopandas frame from the inputs with CRS 4326 geometry
+
+        Args
+
+        Returns
+            geodf(geopandas.geodataframe.GeoDataFrame): Geodataframe of the given inputs
+
+        """
+        df = pd.DataFrame({
+            "Places": self.places,
+            "Latitudes": self.latitudes,
+            "Longitudes": self.longitudes,
+        })
+        geodf = gpd.GeoDataFrame(
+            df, geometry=gpd.points_from_xy(df.Longitudes, df.Latitudes), crs="EPSG:4326"
+        )
+        return geodf
+
+    def plane(self):
+        """
+        Returns the locations in metres on a plane centred between them, accurate over the size of a city
+
+        Returns
+            origin (tuple): Latitude and longitude of the centre of the plane in radians
+            xs (numpy.ndarray): Eastings of the locations in metres
+            ys (numpy.ndarray): Northings of the locations in metres
+
+        """
+        lat0 = np.radians((self.latitudes[0] + self.latitudes[1]) / 2)
+        lon0 = np.radians((self.longitudes[0] + self.longitudes[1]) / 2)
+        xs = (np.radians(np.asarray(self.longitudes, dtype=float)) - lon0) * np.cos(lat0) * EARTH_RADIUS
+        ys = (np.radians(np.asarray(self.latitudes, dtype=float)) - lat0) * EARTH_RADIUS
+        return (lat0, lon0), xs, ys
+
+    def reach(self, detour=DETOUR_FACTOR):
+        """
+        Returns the length of the longest route held by the search area of a detour factor, every point of a route
+        no longer than this is within the ellipse of corridor()
+
+        Args
+            detour (float): Longest route held as a multiple of the straight line distance, above 1
+
+        Returns
+            reach (float): Route length in metres
+
+        """
+        _, xs, ys = self.plane()
+        return detour * max(float(np.hypot(xs[1] - xs[0], ys[1] - ys[0])), MIN_CORRIDOR)
+
+    def corridor(self, detour=DETOUR_FACTOR):
+        """
+        Constructs the search area as an ellipse with the two locations at its foci, holding every route no longer
+        than the detour factor times the straight line distance between them
+        Unlike a box around the locations, the ellipse follows the direction of travel, so diagonal routes do not
+        load the streets in the far corners
+
+        Args
+            detour (float): Longest route held as a multiple of the straight line distance, above 1
+
+        Returns
+            ellipse (shapely.Polygon): Search area in EPSG:4326
+
+        """
+        # Working in metres on a plane centred between the locations
+        (lat0, lon0), xs, ys = self.plane()
+        distance = float(np.hypot(xs[1] - xs[0], ys[1] - ys[0]))
+
+        # Every point of the ellipse is the detour distance from the two foci added together
+        major = self.reach(detour) / 2
+        minor = np.sqrt(major ** 2 - (distance / 2) ** 2)
+        angle = np.arctan2(ys[1] - ys[0], xs[1] - xs[0])
+        turn = np.linspace(0, 2 * np.pi, 72, endpoint=False)
+        ex = major * np.cos(turn) * np.cos(angle) - minor * np.sin(turn) * np.sin(angle)
+        ey = major * np.cos(turn) * np.sin(angle) + minor * np.sin(turn) * np.cos(angle)
+
+        lons = np.degrees(ex / (np.cos(lat0) * EARTH_RADIUS) + lon0)
+        lats = np.degrees(ey / EARTH_RADIUS + lat0)
+        return shapely.Polygon(np.column_stack((lons, lats)))
+
+    def getnodes(self, csr, mask=None):
+        """
+        Returns the closest nodes within the search area to the inital and target locations
+
+        Args
+            csr (CSRGraph): Routing graph as CSR arrays
+            mask (numpy.ndarray): Boolean array of nodes within the search area, defaults to all
+
+        Returns
+            orig_node (int): Node ID of nearest node on graph to initial location
+            target_node (int): Node ID of nearest node on graph to target location
+
+        """
+        orig_node, target_node = csr.nearest(self.latitudes, self.longitudes, mask)
+        return orig_node, target_node
+
+
+def routinggraph(polygon, nettype):
+    """
+    Returns the routing graph of a search area, using the prebuilt Greater London graph where it has been built
+    The graph holds the edges of every network type, flagged with the types which can use them, unless only a
+    graph of the network type itself has been built
+
+    Args
+        polygon (shapely.Polygon): Search area in EPSG:4326
+        nettype (str): Network type - walk or bike
+
+    Returns
+        csr (CSRGraph): Graph as CSR arrays, with access flags on its edges where it holds every network type
+        mask (numpy.ndarray): Boolean array of nodes within the search area, or None for the whole graph
+        tables (list): Landmark tables of the graph, empty if none have been built
+    """
+
+    # Using the prebuilt Greater London graph with correct transport type, limited to the search area by a mask
+    # The CSR arrays hold the shape of each edge for drawing, so the OSMnx graph is not kept in memory
+    csr = loadcsr(nettype)
+    if csr is not None:
+        return csr, csr.within(polygon), loadlandmarks(nettype)
+
+    # Where no graph has been prebuilt, drawing graph of search area from OpenStreetMap, with the ways of every
+    # network type in one download so switching between walking and cycling does not download it again
+    with span('osm_download'):
+        keeptags()
+        graph = ox.graph_from_polygon(polygon, custom_filter=[NETWORK_FILTERS[name] for name in NETWORK_TYPES],
+                                      simplify=False, truncate_by_edge=False, retain_all=True)
+        graph = unifygraph(graph)
+    checkcancelled()
+    # Sampling pollution for every node of the graph in one pass and exporting to compact arrays for routing
+    with span('annotation'):
+        annotategraph(graph)
+    return CSRGraph.fromgraph(graph), None, []
+
+
+# Graph of each scenario and year, as (scenario, year) to (base graph, version, graph, sampled nodes, sampled edges)
+_scenariographs = OrderedDict()
+_scenariolock = threading.Lock()
+
+
+def scenariograph(csr, mask, scenario, year, version=None):
+    """
+    Returns the routing graph with node pollution and edge exposure of a scenario and year from the pollution cube
+    Only the nodes and edges of the search area not sampled by earlier requests are sampled, so only the cube tiles
+    under it are read, and exposure is integrated along each edge as for the rasters, see annotateedges()
+
+    Args
+        csr (CSRGraph): Graph as CSR arrays
+        mask (numpy.ndarray): Boolean array of nodes within the search area, None for all nodes
+        scenario (str): Scenario name
+        year (int): Year of the projection
+        version (str): Version of the graph and scenario data, the graph is sampled again when it changes
+
+    Returns
+        csr (CSRGraph): Graph sharing the arrays of csr but with the scenario's pollution
+    """
+
+    key = (scenario, year)
+    with _scenariolock:
+        entry = _scenariographs.get(key)
+        if entry is None or entry[0] is not csr or entry[1] != version:
+            pollution = np.zeros(csr.pollution.shape, dtype=np.float32)
+            exposure = np.zeros(csr.exposure.shape, dtype=np.float32)
+            entry = (csr, version, csr.withpollution(pollution, exposure), np.zeros(len(csr.nodes), dtype=bool),
+                     np.zeros(len(csr.targets), dtype=bool))
+        _scenariographs[key] = entry
+        _scenariographs.move_to_end(key)
+        while len(_scenariographs) > SCENARIO_GRAPHS:
+            _scenariographs.popitem(last=False)
+        graph, samplednodes, samplededges = entry[2:]
+
+        # Edges leaving the nodes of the search area, which are all a search within it can use
+        areanodes = np.ones(len(csr.nodes), dtype=bool) if mask is None else mask
+        nodes = np.flatnonzero(areanodes & ~samplednodes)
+        edges = np.flatnonzero(np.repeat(areanodes, np.diff(csr.offsets)) & ~samplededges)
+
+        def sample(lats, lons):
+            return cube.sample_many(lats, lons, POLLUTANTS, scenario, year)
+
+        if len(nodes):
+            graph.pollution[nodes] = sample(csr.y[nodes], csr.x[nodes])
+            samplednodes[nodes] = True
+        if len(edges):
+            graph.exposure[edges] = integrateexposure(csr.edgegeometries(edges), csr.length[edges], sample,
+                                                      cube.resolution(scenario, year))
+            samplededges[edges] = True
+    return graph
+
+
+# ==========================================================================
+# 4.3 Finding lower pollution route
+# ==========================================================================
+
+def limitervalues(standard='who2005'):
+    """
+    Returns a tuple of three values used as pollution limits
+    Allows one place to change values rather than constant redefinition
+
+    Args
+        standard (str): Guideline the limits are taken from, a key of LIMIT_STANDARDS
+
+    Returns
+        chosenlimits (tuple): Tuple of PM2.5, PM10 and NO2 values
+
+    """
+
+    if standard not in LIMIT_STANDARDS:
+        raise ValueError(f"Unknown limit standard {standard}, expected one of {', '.join(LIMIT_STANDARDS)}")
+    chosen = LIMIT_STANDARDS[standard]
+    pm2_5value = float(chosen["pm2_5"])
+    pm10value = float(chosen["pm10"])
+    no2value = float(chosen["no2"])
+    chosenlimits = (pm2_5value, pm10value, no2value)
+    return chosenlimits
+
+
+def routelimits(limits=None, pollutantweights=None):
+    """
+    Returns the limits a route is found with, from a standard or given values and the weight of each pollutant
+    Each limit is divided by its pollutant's weight, so a weight of 2 halves the limit and a weight of 0 ignores the
+    pollutant, e.g. weights of (0, 0, 1) route around NO2 alone
+
+    Args
+        limits (str or tuple): Name of a standard in LIMIT_STANDARDS or PM2.5, PM10 and NO2 limits, also as text
+            e.g. 5,15,10, defaults to limitervalues()
+        pollutantweights (str or tuple): PM2.5, PM10 and NO2 weights, also as text e.g. 0,0,1, defaults to 1 for each
+
+    Returns
+        effective (tuple): PM2.5, PM10 and NO2 limits, infinite for ignored pollutants, raises ValueError if the
+            limits or weights are invalid
+    """
+
+    if limits is None or (isinstance(limits, str) and limits in LIMIT_STANDARDS):
+        limits = limitervalues() if limits is None else limitervalues(limits)
+    weights = (1.0, 1.0, 1.0) if pollutantweights is None else pollutantweights
+    try:
+        limits = tuple(float(limit) for limit in (limits.split(',') if isinstance(limits, str) else limits))
+        weights = tuple(float(value) for value in (weights.split(',') if isinstance(weights, str) else weights))
+    except ValueError:
+        raise ValueError(f"limits must be one of {', '.join(LIMIT_STANDARDS)} or three values, and pollutant "
+                         f"weights three values")
+    if len(limits) != 3 or min(limits) <= 0:
+        raise ValueError('limits must be three positive values for PM2.5, PM10 and NO2')
+    if len(weights) != 3 or min(weights) < 0 or max(weights) == 0:
+        raise ValueError('pollutant weights must be three values of 0 or more for PM2.5, PM10 and NO2, '
+                         'at least one above 0')
+    return tuple(limit / weight if weight > 0 else float('inf') for limit, weight in zip(limits, weights))
+
+
+# ==========================================================================
+# 4.4 Styling routes based on pollution
+# ==========================================================================
+
+def edgepollution(csr, figroute, edges=None):
+    """
+    Takes a route and the graph it was found on, and returns an edge index of pollution based on three pollutants
+
+    Args
+        csr (CSRGraph): Graph as CSR arrays to read pollution from, e.g. of a scenario
+        figroute (list): OSMnx list of node values constructed using routing module
+        edges (numpy.ndarray): Boolean array of the CSR edges of the network type, as from CSRGraph.modeedges()
+    Returns
+        route_values (dict):
+            'edges': List of node IDs of the route
+            'values': Pollutant index of each edge, in route order
+            'length': Length of the route in metres
+            'exposure': Mean pollutant index along the route, weighted by edge length
+
+    """
+
+    edges = csr.pathedges(figroute, edges)
+    length = np.asarray(csr.length[edges], dtype=float)
+    # Mean of the three pollutants along each edge, from the exposure integrated along it
+    exposure = csr.exposure[edges].mean(axis=1, dtype=float)
+    nodevalues = csr.pollution[csr.index(figroute)].mean(axis=1, dtype=float)
+    avgvalue = np.divide(exposure, length, out=(nodevalues[:-1] + nodevalues[1:]) / 2, where=length > 0)
+    route_values = {'edges': figroute, 'values': avgvalue.tolist(), **routeexposure(length, avgvalue)}
+    return route_values
+
+
+def routeexposure(length, values):
+    """
+    Summarises the edges of a route as its length and mean pollution
+
+    Args
+        length (numpy.ndarray): Length of each edge in metres
+        values (numpy.ndarray): Pollutant index of each edge
+
+    Returns
+        summary (dict): 'length' of the route in metres and its length weighted mean 'exposure'
+    """
+
+    total = float(length.sum())
+    if total > 0:
+        exposure = float((values * length).sum() / total)
+    else:
+        # Routes of a single node have no edges to weigh
+        exposure = float(np.mean(values)) if len(values) else 0.0
+    return {'length': total, 'exposure': exposure}
+
+
+def colorpicker(value):
+    """
+    Takes float and returns a color from green to red to black scale based on how high the integer is
+
+    Args
+        value (float): Pollution edge value
+
+    Returns
+        color (string): Hexcode of color
+
+    """
+
+    if value < 10:
+        color = "#40b81c"
+    elif value < 20:
+        color = "#d1d119"
+    elif value < 30:
+        color = "#d1a619"
+    elif value < 40:
+        color = "#d14419"
+    elif value < 50:
+        color = "#9c1919"
+    elif value < 60:
+        color = "#3d0101"
+    else:
+        color = "#000000"
+    return color
+
+
+class RouteResult:
+    """
+    Class representing a planned pair of routes, the fastest route and its lower pollution alternative
+
+    Attributes
+        initial (list): Start address, latitude and longitude
+        target (list): End address, latitude and longitude
+        nettype (str): Network type - walk or bike
+        mode (str): Routing mode - limits, exposure or pareto
+        shortest_length (float): Length of the fastest route in metres
+        alt_length (float): Length of the alternative route in metres
+        edges_values (dict): Nodes and edge pollution of the fastest route, as from edgepollution()
+        alt_edges_values (dict): Nodes and edge pollution of the alternative route, as from edgepollution()
+        csr (CSRGraph): Graph the routes were found on, used for drawing and not exported
+        scenario (str): Pollution scenario the routes were found with, None for the rasters in the data folder
+        year (int): Year of the pollution scenario
+        cachekey (str): Key of the routes in the route cache, None if they were not cached
+        limits (tuple): PM2.5, PM10 and NO2 limits the alternative was found with, after pollutant weighting
+        alternatives (list): Nodes, edge pollution, length and exposure of the other Pareto routes between the
+            fastest and lowest exposure routes, shortest first, empty outside of the pareto mode
+
+    Methods
+        .__init___(): Constructs the object
+        .samepath(): Checks if the alternative is the same as the fastest route
+        .todict(): Returns the result as a dictionary of plain values for JSON
+
+    """
+
+    def __init__(self, initial, target, nettype, mode, shortest_length, alt_length, edges_values,
+                 alt_edges_values, csr=None, scenario=None, year=None, cachekey=None,
+                 limits=None, alternatives=None):
+        """
+        Constructs all the necessary attributes for the result object.
+
+        Args
+            initial (list): Start address, latitude and longitude
+            target (list): End address, latitude and longitude
+            nettype (str): Network type - walk or bike
+            mode (str): Routing mode - limits, exposure or pareto
+            shortest_length (float): Length of the fastest route in metres
+            alt_length (float): Length of the alternative route in metres
+            edges_values (dict): Nodes and edge pollution of the fastest route
+            alt_edges_values (dict): Nodes and edge pollution of the alternative route
+            csr (CSRGraph): Graph the routes were found on
+            scenario (str): Pollution scenario, None for the rasters in the data folder
+            year (int): Year of the pollution scenario
+            cachekey (str): Key of the routes in the route cache
+            limits (tuple): PM2.5, PM10 and NO2 limits after pollutant weighting, defaults to limitervalues()
+            alternatives (list): Other Pareto routes, each as from edgepollution()
+
+        Returns
+            None
+        """
+
+        self.initial = initial
+        self.target = target
+        self.nettype = nettype
+        self.mode = mode
+        self.shortest_length = shortest_length
+        self.alt_length = alt_length
+        self.edges_values = edges_values
+        self.alt_edges_values = alt_edges_values
+        self.csr = csr
+        self.scenario = scenario
+        self.year = year
+        self.cachekey = cachekey
+        self.limits = limitervalues() if limits is None else tuple(limits)
+        self.alternatives = list(alternatives or [])
+
+    def samepath(self):
+        """
+        Checks if the alternative is the same as the fastest route, i.e. pollution along the route is low
+
+        Returns
+            same (bool): True if the routes have the same length
+        """
+
+        return self.alt_length == self.shortest_length
+
+    def todict(self):
+        """
+        Returns the result as a dictionary of plain values, without the graph, for JSON or passing between processes
+
+        Returns
+            result (dict): Result attributes
+        """
+
+        return {
+            'initial': list(self.initial),
+            'target': list(self.target),
+            'nettype': self.nettype,
+            'mode': self.mode,
+            'scenario': self.scenario,
+            'year': self.year,
+            # Ignored pollutants have no limit, given as null as JSON has no infinity
+            'limits': [limit if np.isfinite(limit) else None for limit in self.limits],
+            'shortest': {'nodes': [int(node) for node in self.edges_values['edges']],
+                         'length': float(self.shortest_length),
+                         'exposure': float(self.edges_values['exposure']),
+                         'values': [float(value) for value in self.edges_values['values']]},
+            'alternative': {'nodes': [int(node) for node in self.alt_edges_values['edges']],
+                            'length': float(self.alt_length),
+                            'exposure': float(self.alt_edges_values['exposure']),
+                            'values': [float(value) for value in self.alt_edges_values['values']]},
+            'alternatives': [{'nodes': [int(node) for node in values['edges']],
+                              'length': float(values['length']),
+                              'exposure': float(values['exposure']),
+                              'values': [float(value) for value in values['values']]}
+                             for values in self.alternatives],
+            'samepath': self.samepath(),
+        }
+
+
+def routelines(csr, route, values, edges=None):
+    """
+    Groups consecutive edges of a route with the same colour into lines, so that each colour can be drawn as one
+    feature rather than one line per edge
+
+    Args
+        csr (CSRGraph): Graph of the route, with the shape of its edges
+        route (list): List of node IDs of the route
+        values (list): Pollutant index of each edge, as from edgepollution()
+        edges (numpy.ndarray): Boolean array of edges of the network type, choosing between parallel edges of the
+            unified graph as for routing and edgepollution()
+
+    Returns
+        lines (dict): Colour to list of lines, each a list of [longitude, latitude] coordinates
+    """
+
+    lines = {}
+    previous = None
+    for line, value in zip(csr.pathlines(route, edges), values):
+        coords = [[round(x, 6), round(y, 6)] for x, y in line]
+        color = colorpicker(value)
+        if color == previous:
+            # Continuing the current line, skipping the point shared with the previous edge
+            lines[color][-1].extend(coords[1:])
+        else:
+            lines.setdefault(color, []).append(coords)
+        previous = color
+    return lines
+
+
+@span('drawfig')
+def drawfig(result):
+    """
+    Takes a planned route result and constructs a folium map of its routes
+    Each route is drawn as one GeoJson layer holding a MultiLineString feature per colour, with its length and
+    mean pollution shown on hover, and other Pareto routes are drawn as thinner dashed lines
+
+    Args
+        result (RouteResult): Result from plan_route(), with its graph
+    Returns
+        m (folium.Map): Folium map of final routes
+    """
+    foliumgraph = result.csr
+    foliumedges = foliumgraph.modeedges(result.nettype)
+    foliumroute = result.edges_values
+    foliumalt = result.alt_edges_values
+    initial = result.initial
+    target = result.target
+    shortest_length_round = round((result.shortest_length / 1000), 2)
+
+    if shortest_length_round > 12:
+        zoom = 11
+    elif shortest_length_round > 10:
+        zoom = 12
+    elif shortest_length_round > 5:
+        zoom = 13
+    else:
+        zoom = 14
+
+    center = [((float(initial[1]) + float(target[1])) / 2),
+              ((float(initial[2]) + float(target[2])) / 2)]
+    m = folium.Map(
+        location=center,
+        zoom_start=zoom,
+        tiles="cartodb positron",
+        opacity=1
+    )
+
+    # Fastest route first so the alternatives are drawn over it where they share streets
+    routes = [("Fastest Route", foliumroute, 10, None)]
+    routes += [(f"Alternative {number}", values, 6, '10 8') for number, values in enumerate(result.alternatives, 1)]
+    routes.append(("Lower Pollution Alternative", foliumalt, 10, None))
+    for routename, routevalues, weight, dash in routes:
+        lines = routelines(foliumgraph, routevalues['edges'], routevalues['values'], foliumedges)
+        features = [{
+            'type': 'Feature',
+            'geometry': {'type': 'MultiLineString', 'coordinates': colorlines},
+            'properties': {'color': color, 'route': routename, 'weight': weight, 'dash': dash,
+                           'length': f"{routevalues['length'] / 1000:.2f}km",
+                           'exposure': f"{routevalues['exposure']:.1f}µg/m3"},
+        } for color, colorlines in lines.items()]
+
+        folium.GeoJson(
+            {'type': 'FeatureCollection', 'features': features},
+            name=routename,
+            style_function=lambda feature: {
+                'color': feature['properties']['color'],
+                'weight': feature['properties']['weight'],
+                'dashArray': feature['properties']['dash'],
+                'opacity': 1,
+            },
+            tooltip=folium.GeoJsonTooltip(fields=['route', 'length', 'exposure'],
+                                          aliases=['', 'Length', 'Mean pollution']),
+        ).add_to(m)
+
+    folium.Marker(
+        location=[initial[1], initial[2]],
+        tooltip='Start',
+        icon=folium.Icon(color='green')
+    ).add_to(m)
+
+    folium.Marker(
+        location=[target[1], target[2]],
+        tooltip='End',
+        icon=folium.Icon(color='green')
+    ).add_to(m)
+
+    return m
+
+
+# ==========================================================================
+# 4.5 Running low-pollution route finder from start to end
+# ==========================================================================
+
+def noprogress(value, text):
+    """
+    Progress function used where none is given, does nothing
+
+    Args
+        value (int): Percentage progress
+        text (str): Message describing the stage
+
+    Returns
+        None
+    """
+
+    return None
+
+
+def checkweight(weight):
+    """
+    Checks the weighting of exposure against length
+    Negative weights would make edges cost less than their length, so the straight line and landmark estimates
+    of the searches would overestimate and routes would no longer be the best
+
+    Args
+        weight (float): Weighting of exposure against length
+
+    Returns
+        weight (float): Weight as a float, raises ValueError if it is negative or not a finite number
+    """
+
+    try:
+        weight = float(weight)
+    except (TypeError, ValueError):
+        raise ValueError(f"Weight must be a number, got {weight!r}") from None
+    if not np.isfinite(weight) or weight < 0:
+        raise ValueError(f"Weight must be a finite number of 0 or more, got {weight}")
+    return weight
+
+
+def checkoptions(mode, nettype, scenario=None, year=None, weight=1.0):
+    """
+    Checks the routing options of a request
+
+    Args
+        mode (str): Routing mode - limits, exposure or pareto
+        nettype (str): Network type - walk or bike
+        scenario (str): Pollution scenario from the cube, optional
+        year (int): Year of the pollution scenario, defaults to its latest year
+        weight (float): Weighting of exposure against length, see checkweight()
+
+    Returns
+        year (int): Year of the scenario, or None without one, raises ValueError if any option is invalid
+    """
+
+    if mode not in MODES:
+        raise ValueError(f"Unknown routing mode {mode}, expected one of {MODES}")
+    if nettype not in NETWORK_TYPES:
+        raise ValueError(f"Unknown network type {nettype}, expected one of {NETWORK_TYPES}")
+    checkweight(weight)
+    if scenario is not None:
+        return cube.resolve(scenario, year)
+    return None
+
+
+class SearchArea:
+    """
+    Routing graph of the area around a start and end, with the node and edge ratios already worked out for each set
+    of limits, kept from the last request so routes with other limits, weights or network types are found again
+    straight away
+
+    Attributes
+        csr (CSRGraph): Graph as CSR arrays, with the pollution of the scenario
+        mask (numpy.ndarray): Boolean array of nodes within the search area, or None for the whole graph
+        tables (list): Landmark tables valid for the pollution used
+        locations (Locations): Start and end locations
+        detour (float): Detour factor the search area was sized for, see Locations.corridor()
+        ratios (dict): (kind, limits) to node or edge ratios already worked out
+        modes (dict): Network type to its edges, nodes and start and end nodes, as from modeaccess()
+
+    Methods
+        .__init___(): Constructs the area object
+        .modeaccess(): Returns the edges and nodes a network type can use and its start and end nodes
+        .noderatios(): Returns each node's ratio of pollution to limits
+        .edgeratios(): Returns each edge's ratio of mean pollution to limits
+
+    """
+
+    def __init__(self, csr, mask, tables, locations, detour=DETOUR_FACTOR):
+        """
+        Constructs all the necessary attributes for the area object.
+
+        Args
+            csr (CSRGraph): Graph as CSR arrays
+            mask (numpy.ndarray): Boolean array of nodes within the search area, or None for the whole graph
+            tables (list): Landmark tables valid for the pollution used
+            locations (Locations): Start and end locations
+            detour (float): Detour factor the search area was sized for
+
+        Returns
+            None
+        """
+
+        self.csr = csr
+        self.mask = mask
+        self.tables = tables
+        self.locations = locations
+        self.detour = detour
+        self.ratios = {}
+        self.modes = {}
+
+    def modeaccess(self, nettype):
+        """
+        Returns the edges and nodes of the search area a network type can use, and the start and end snapped to
+        them, worked out the first time each network type is routed in the area
+
+        Args
+            nettype (str): Network type - walk or bike
+
+        Returns
+            edges (numpy.ndarray): Boolean array of edges the network type can use, or None for every edge
+            mask (numpy.ndarray): Boolean array of nodes within the search area the network type can reach, or None
+                for the whole graph
+            usernodes (tuple): Node IDs of the start and end
+        """
+
+        if nettype not in self.modes:
+            edges = self.csr.modeedges(nettype)
+            mask = self.mask
+            if edges is not None:
+                modenodes = self.csr.modenodes(edges)
+                mask = modenodes if mask is None else mask & modenodes
+            # Getting location nodes
+            with span('snapping'):
+                usernodes = self.locations.getnodes(self.csr, mask)
+            self.modes[nettype] = (edges, mask, usernodes)
+        return self.modes[nettype]
+
+    def noderatios(self, limits):
+        """
+        Returns each node's ratio of pollution to limits, see CSRGraph.noderatios()
+
+        Args
+            limits (tuple): Tuple of PM2.5, PM10 and NO2 limits
+
+        Returns
+            ratios (numpy.ndarray): Ratio of each node
+        """
+
+        key = ('nodes', tuple(limits))
+        if key not in self.ratios:
+            self.ratios[key] = self.csr.noderatios(limits)
+        return self.ratios[key]
+
+    def edgeratios(self, limits):
+        """
+        Returns each edge's ratio of mean pollution to limits, see CSRGraph.edgeratios()
+
+        Args
+            limits (tuple): Tuple of PM2.5, PM10 and NO2 limits
+
+        Returns
+            ratios (numpy.ndarray): Ratio of each edge
+        """
+
+        key = ('edges', tuple(limits))
+        if key not in self.ratios:
+            self.ratios[key] = self.csr.edgeratios(limits)
+        return self.ratios[key]
+
+
+# Search area of the last request, as a (key, SearchArea) tuple
+_lastarea = [None]
+
+
+def searcharea(geo_initial, geo_target, nettype='walk', progress=noprogress, scenario=None, year=None,
+               detour=DETOUR_FACTOR):
+    """
+    Builds the routing graph within an ellipse around two geocoded locations, see Locations.corridor()
+    The area of the last request is reused where the locations and data are the same and it is at least as large,
+    so only the routing step is repeated when the limits, weights or network type change, as every network type
+    shares the unified graph
+
+    Args
+        geo_initial (list): Start address, latitude and longitude, as from Inputs.geocodeaddresses()
+        geo_target (list): End address, latitude and longitude
+        nettype (str): Network type - walk or bike
+        progress (function): Called with a percentage and message as each stage starts
+        scenario (str): Pollution scenario from the cube, defaults to the rasters in the data folder
+        year (int): Year of the pollution scenario, already checked by checkoptions()
+        detour (float): Longest route held by the search area as a multiple of the straight line distance
+
+    Returns
+        area (SearchArea): Graph of the search area and the start and end locations, raises RouteError if the
+            locations are outside of Greater London
+    """
+
+    version = datasetversion(nettype, scenario, year)
+    areakey = (tuple(float(value) for value in (*geo_initial[1:], *geo_target[1:])), storename(nettype), scenario,
+               year, version)
+    last = _lastarea[0]
+    if last is not None and last[0] == areakey and last[1].detour >= detour:
+        area = last[1]
+        progress(50, 'Drawing route between locations')
+    else:
+        area = None
+
+    if area is None:
+        # If Greater London check returns False an error is raised
+        with span('boundary'):
+            inside = checkboundary(geo_initial, geo_target)
+        if not inside:
+            raise RouteError('One or more locations outside of Greater London boundary')
+
+        progress(20, 'Locating start and end points...')
+
+        # Creates an instance of the Locations class from the users earlier inputs
+        userlocations = Locations(
+            [geo_initial[0], geo_target[0]],
+            [geo_initial[1], geo_target[1]],
+            [geo_initial[2], geo_target[2]],
+        )
+
+        progress(50, 'Drawing route between locations')
+
+        # Ellipse around the locations holding every route up to the detour factor, grown if no route is found
+        corridor = userlocations.corridor(detour)
+
+        with span('graph_build'):
+            csr, mask, tables = routinggraph(corridor, nettype)
+            checkcancelled()
+            if scenario is not None:
+                csr = scenariograph(csr, mask, scenario, year, version)
+                # Exposure weighted tables were built from the data folder rasters, so only length tables stay valid
+                tables = [table for table in tables if table.weight == 0]
+        area = SearchArea(csr, mask, tables, userlocations, detour)
+        _lastarea[0] = (areakey, area)
+
+    # Size of the search area, as nodes and the edges leaving them
+    csr, mask = area.csr, area.mask
+    setvalue('detour', area.detour)
+    setvalue('graph_nodes', len(csr.nodes) if mask is None else np.count_nonzero(mask))
+    setvalue('graph_edges', len(csr.targets) if mask is None else np.diff(csr.offsets)[mask].sum())
+    return area
+
+
+def solveroutes(area, nettype='walk', mode='limits', weight=1.0, limits=None, progress=noprogress):
+    """
+    Finds the fastest route between the start and end of a search area and a lower pollution alternative
+
+    Args
+        area (SearchArea): Search area, as from searcharea()
+        nettype (str): Network type - walk or bike, only its edges are used
+        mode (str): Routing mode - limits avoids pollution over the limits, exposure weighs exposure against length,
+            pareto offers the most distinct of the routes trading length against exposure
+        weight (float): Weighting of exposure against length for the exposure mode
+        limits (tuple): PM2.5, PM10 and NO2 limits, as from routelimits(), defaults to limitervalues()
+        progress (function): Called with a percentage and message as each stage starts
+
+    Returns
+        routes (list): Node IDs of each route, the fastest first and the lower pollution alternative last, with
+        the other Pareto routes between them in the pareto mode, raises RouteError on failure
+    """
+
+    csr, tables = area.csr, area.tables
+    edges, mask, usernodes = area.modeaccess(nettype)
+
+    if mode == "pareto":
+        limits = limitervalues() if limits is None else limits
+        progress(70, 'Comparing routes')
+        # Every route no other route beats on both length and exposure, found in one search, shortest first
+        try:
+            with span('pareto_routes'):
+                paretos = csr.paretopaths(usernodes[0], usernodes[1], area.edgeratios(limits), mask,
+                                          choosetables(tables, 0, ()), edges, stop=checkcancelled)
+        except NetworkXNoPath:
+            raise RouteError("Unable to draw a route between locations, check addresses and retry")
+        # Keeping those sharing the fewest streets, so the routes offered are real choices
+        paths = [path for path, _, _ in paretos]
+        setvalue('pareto_routes', len(paths))
+        return [paths[index] for index in csr.distinctpaths(paths, PARETO_ROUTES, edges)]
+
+    # If inital route cannot be drawn an error is raised
+    try:
+        with span('shortest_route'):
+            route = csr.shortestpath(usernodes[0], usernodes[1], mask=mask, landmarks=choosetables(tables, 0, ()),
+                                     edges=edges, stop=checkcancelled)
+    except NetworkXNoPath:
+        raise RouteError("Unable to draw a route between locations, check addresses and retry")
+
+    # Defining limits which pollution is compared against
+    limits = limitervalues() if limits is None else limits
+
+    progress(70, 'Checking pollution along route')
+
+    with span('alternative_route'):
+        if mode == "exposure":
+            # Single search over length plus weighted exposure integrated along each edge, always succeeds as the
+            # fastest route exists
+            attempt = csr.exposurepath(usernodes[0], usernodes[1], area.edgeratios(limits), weight, mask,
+                                       choosetables(tables, weight, limits), edges, checkcancelled)
+        else:
+            # Each node's ratio of pollution to the limits
+            ratios = area.noderatios(limits)
+            # Smallest tolerance connecting the locations, never below 1 so routes within limits are kept
+            tolerance = max(1.0, csr.mintolerance(usernodes[0], usernodes[1], ratios, mask, edges, checkcancelled))
+            # Shortest route through nodes within the tolerance, found in a single search
+            attempt = csr.limitedpath(usernodes[0], usernodes[1], ratios, tolerance, mask,
+                                      choosetables(tables, 0, ()), edges, checkcancelled)
+            # Nodes of the search area over the limits, and those still excluded at the tolerance found
+            inarea = ratios if mask is None else ratios[mask]
+            setvalue('tolerance', tolerance)
+            setvalue('bad_nodes', np.count_nonzero(inarea > 1))
+            setvalue('excluded_nodes', np.count_nonzero(inarea > tolerance))
+
+    return [route, attempt]
+
+
+def arearoutes(geo_initial, geo_target, nettype='walk', mode='limits', weight=1.0, limits=None, progress=noprogress,
+               scenario=None, year=None):
+    """
+    Finds the routes within the search area around two geocoded locations, growing the area by DETOUR_GROWTH each
+    time no route is found within it, up to DETOUR_LIMIT or until it holds the whole prebuilt graph
+    The area is also grown where the fastest route is longer than the area holds, see Locations.reach(), as a
+    shorter route leaving the area could then have been missed
+
+    Args
+        geo_initial (list): Start address, latitude and longitude, as from Inputs.geocodeaddresses()
+        geo_target (list): End address, latitude and longitude
+        nettype (str): Network type - walk or bike
+        mode (str): Routing mode - limits, exposure or pareto
+        weight (float): Weighting of exposure against length for the exposure mode
+        limits (tuple): PM2.5, PM10 and NO2 limits, as from routelimits()
+        progress (function): Called with a percentage and message as each stage starts
+        scenario (str): Pollution scenario from the cube, defaults to the rasters in the data folder
+        year (int): Year of the pollution scenario, already checked by checkoptions()
+
+    Returns
+        area (SearchArea): Search area the routes were found in
+        routes (list): Node IDs of each route, as from solveroutes(), raises RouteError on failure
+    """
+
+    detour = DETOUR_FACTOR
+    while True:
+        area = searcharea(geo_initial, geo_target, nettype, progress, scenario, year, detour)
+        whole = area.mask is not None and area.mask.all()
+        final = whole or area.detour * DETOUR_GROWTH > DETOUR_LIMIT
+        try:
+            routes = solveroutes(area, nettype, mode, weight, limits, progress)
+        except RouteError:
+            if final:
+                raise
+        else:
+            # Every route no longer than the reach of the area lies inside it, so the fastest route is the shortest
+            length = area.csr.pathexposure(routes[0], area.modeaccess(nettype)[0])[0]
+            if final or length <= area.locations.reach(area.detour):
+                return area, routes
+            count('search_area_clipped')
+        detour = area.detour * DETOUR_GROWTH
+        count('search_area_growth')
+        progress(50, 'Widening search area...')
+
+
+def findroutes(geo_initial, geo_target, mode='limits', nettype='walk', weight=1.0, progress=None, scenario=None,
+               year=None, limits=None, pollutantweights=None):
+    """
+    Finds the fastest route between two geocoded locations and a lower pollution alternative
+
+    Args
+        geo_initial (list): Start address, latitude and longitude, as from Inputs.geocodeaddresses()
+        geo_target (list): End address, latitude and longitude
+        mode (str): Routing mode - limits avoids pollution over the limits, exposure weighs exposure against length,
+            pareto offers the most distinct of the routes trading length against exposure
+        nettype (str): Network type - walk or bike
+        weight (float): Weighting of exposure against length for the exposure mode
+        progress (function): Called with a percentage and message as each stage starts, optional
+        scenario (str): Pollution scenario from the cube, defaults to the rasters in the data folder
+        year (int): Year of the pollution scenario, defaults to its latest year
+        limits (str or tuple): Limit standard or PM2.5, PM10 and NO2 limits, see routelimits()
+        pollutantweights (tuple): PM2.5, PM10 and NO2 weights, see routelimits()
+
+    Returns
+        csr (CSRGraph): Graph as CSR arrays the routes were found on, with the pollution of the scenario
+        route (list): Node IDs of the fastest route
+        attempt (list): Node IDs of the lower pollution alternative, raises RouteError on failure
+    """
+
+    year = checkoptions(mode, nettype, scenario, year, weight)
+    effective = routelimits(limits, pollutantweights)
+    progress = noprogress if progress is None else progress
+    area, routes = arearoutes(geo_initial, geo_target, nettype, mode, weight, effective, progress, scenario, year)
+    # The lowest exposure route is the alternative of the pareto mode
+    return area.csr, routes[0], routes[-1]
+
+
+def plan_route(start, end, mode='limits', nettype='walk', weight=1.0, progress=None, scenario=None, year=None,
+               limits=None, pollutantweights=None):
+    """
+    Plans the fastest route between two addresses and a lower pollution alternative, without any UI
+    Routes already planned between the same nodes with the same options and data are taken from the route cache,
+    and the search area of the last request is reused, so changing only the limits or weights re-solves the routes
+    without geocoding, building the graph or sampling pollution again
+
+    Args
+        start (str): Start location, e.g. an address, postcode or landmark
+        end (str): End location
+        mode (str): Routing mode - limits avoids pollution over the limits, exposure weighs exposure against length,
+            pareto offers the most distinct of the routes trading length against exposure
+        nettype (str): Network type - walk or bike
+        weight (float): Weighting of exposure against length for the exposure mode
+        progress (function): Called with a percentage and message as each stage starts, optional, and may raise
+            RouteCancelled to stop planning between stages
+        scenario (str): Pollution scenario from the cube, defaults to the rasters in the data folder
+        year (int): Year of the pollution scenario, defaults to its latest year
+        limits (str or tuple): Limit standard, e.g. who2021, or PM2.5, PM10 and NO2 limits, defaults to WHO 2005
+        pollutantweights (tuple): PM2.5, PM10 and NO2 weights, 0 ignores a pollutant, defaults to 1 for each
+
+    Returns
+        result (RouteResult): Routes with their lengths and edge pollution, raises RouteError on failure
+    """
+
+    year = checkoptions(mode, nettype, scenario, year, weight)
+    effective = routelimits(limits, pollutantweights)
+    progress = noprogress if progress is None else progress
+    progress(10, 'Finding addresses...')
+
+    # Creates class instance of Inputs with two user inputs and geocodes both
+    userinputs = Inputs(start, end)
+    with span('geocoding'):
+        geo_initial, geo_target = userinputs.geocodeaddresses()
+
+    # If geocoding returns a fail from the try/except block an error is raised
+    if geo_initial == 'Fail' and geo_target == 'Fail':
+        raise LocationError('One or more addresses could not be located')
+
+    area = searcharea(geo_initial, geo_target, nettype, progress, scenario, year)
+
+    # Routes between the same nodes are reused while the graph, pollution data and search area size are unchanged
+    edges, mask, usernodes = area.modeaccess(nettype)
+    cachekey = routekey(usernodes[0], usernodes[1], nettype, mode, weight, effective,
+                        f'{datasetversion(nettype, scenario, year)}:{DETOUR_FACTOR:g}')
+    entry = routecache.get(cachekey)
+    if entry is None:
+        area, routes = arearoutes(geo_initial, geo_target, nettype, mode, weight, effective, progress, scenario,
+                                  year)
+        route, attempt = routes[0], routes[-1]
+        # The area may have grown to find the routes
+        csr = area.csr
+        edges = area.modeaccess(nettype)[0]
+
+        # Gathering route lengths, along the edges of the network type where the graph holds every type
+        with span('route_lengths'):
+            shortest_length = csr.pathexposure(route, edges)[0]
+            alt_length = csr.pathexposure(attempt, edges)[0]
+
+        progress(80, 'Drawing routes')
+
+        # Getting edge colors
+        with span('edgepollution'):
+            edges_values = edgepollution(csr, route, edges)
+            alt_edges_values = edgepollution(csr, attempt, edges)
+            alternatives = [edgepollution(csr, path, edges) for path in routes[1:-1]]
+
+        entry = (float(shortest_length), float(alt_length), edges_values, alt_edges_values, area.detour, alternatives)
+        routecache.put(cachekey, entry)
+
+    shortest_length, alt_length, edges_values, alt_edges_values, detour, alternatives = entry
+    if detour > area.detour:
+        # Routes found once the area had grown are drawn on the graph of the grown area
+        area = searcharea(geo_initial, geo_target, nettype, progress, scenario, year, detour)
+    return RouteResult(geo_initial, geo_target, nettype, mode, shortest_length, alt_length, edges_values,
+                       alt_edges_values, area.csr, scenario, year, cachekey, effective, alternatives)
+
+
+def maphtml(result):
+    """
+    Returns the folium map of a planned route as HTML, reusing a map already drawn for the same routes and points
+
+    Args
+        result (RouteResult): Result from plan_route()
+
+    Returns
+        html (str): Folium map of both routes
+    """
+
+    # Maps also depend on the start and end points, which are marked on the map
+    mapkey = None
+    if result.cachekey is not None:
+        points = tuple(round(float(value), 6) for value in (*result.initial[1:], *result.target[1:]))
+        mapkey = f'{result.cachekey}:map:{points}'
+        html = routecache.get(mapkey)
+        if html is not None:
+            return html
+
+    data = io.BytesIO()
+    drawfig(result).save(data, close_file=False)
+    html = data.getvalue().decode()
+    if mapkey is not None:
+        routecache.put(mapkey, html)
+    return html
+
+
+def warmup(nettypes=NETWORK_TYPES):
+    """
+    Loads the rasters, boundary and the CSR arrays of any prebuilt graphs so they stay resident for the rest of the
+    process
+    Where worker processes are forked after this has run, the data is shared rather than reloaded
+
+    Args
+        nettypes (tuple): Network types to load
+
+    Returns
+        None
+    """
+
+    # The store is looked up on the module as it can be replaced with raster.usestore()
+    raster.store.warm()
+    loadboundary()
+    for nettype in nettypes:
+        loadcsr(nettype)
+        loadlandmarks(nettype)
@@ -0,0 +1,259 @@
+import argparse
+import csv
+import os
+import re
+import sqlite3
+import threading
+
+# Nominatim is only needed for the remote fallback, so the planner still runs offline without GeoPy
+try:
+    from geopy import Nominatim
+    from geopy.exc import GeopyError
+except ImportError:
+    Nominatim = None
+    GeopyError = Exception
+
+# Import data folder location from raster script and request counters from metrics script
+from raster import DATA_DIR
+from metrics import count
+
+# Bundled gazetteer of London stations, landmarks and areas
+GAZETTEER_PATH = os.path.join(DATA_DIR, 'gazetteer.csv')
+
+# Postcodes imported from the ONS Postcode Directory with importpostcodes(), optional
+POSTCODE_PATH = os.path.join(DATA_DIR, 'postcodes.sqlite')
+
+# Results of remote lookups, kept between runs
+CACHE_PATH = os.path.join(DATA_DIR, 'geocode_cache.sqlite')
+
+# Setting this environment variable to 1 stops the remote geocoder being used, e.g. in an air-gapped network
+OFFLINE = os.environ.get('ROUTEPLANNER_OFFLINE', '') == '1'
+
+# Full UK postcode, with or without its space
+POSTCODE = re.compile(r'^[A-Z]{1,2}[0-9][A-Z0-9]?[0-9][A-Z]{2}$')
+
+
+def normalize(query):
+    """
+        Normalizes a query so that differences of case, punctuation and spacing share a cache entry
+
+        Args
+            query (str): Location, e.g. 'London Paddington' or 'w2 1hq'
+
+        Returns
+            key (str): Lower case words separated by single spaces
+    """
+
+    return ' '.join(re.sub(r"[^\w\s]", ' ', str(query).lower().replace("'", '')).split())
+
+
+def postcodekey(query):
+    """
+        Returns a query as a postcode without its space if it is a full UK postcode
+
+        Args
+            query (str): Location
+
+        Returns
+            postcode (str): Upper case postcode such as 'W21HQ', or None if the query is not a postcode
+    """
+
+    postcode = re.sub(r'\s', '', str(query)).upper()
+    return postcode if POSTCODE.match(postcode) else None
+
+
+def nominatimlookup(query):
+    """
+        Geocodes a query with the Nominatim tool, the default remote geocoder
+
+        Args
+            query (str): Location
+
+        Returns
+            location (tuple): Address, latitude and longitude, or None if not found or the service is unreachable
+    """
+
+    if Nominatim is None:
+        return None
+    try:
+        location = Nominatim(user_agent="Geopy Library").geocode(query)
+    except GeopyError:
+        return None
+    if location is None:
+        return None
+    return location.address, location.latitude, location.longitude
+
+
+class Geocoder:
+    """
+    Geocoder checking local sources before an optional remote geocoder
+    Queries are looked up in order in memory, the bundled gazetteer, imported postcodes, the disk cache and
+    finally the remote geocoder, whose results are added to the disk cache
+
+    Attributes
+        places (dict): Normalized gazetteer name to (address, latitude, longitude)
+        remote (function): Takes a query and returns (address, latitude, longitude) or None, None for offline use
+        cachepath (str): Path of the SQLite cache of remote results
+        postcodepath (str): Path of the SQLite table of postcodes
+        memo (dict): Results already found in this process
+
+    Methods
+        .__init___(): Constructs the geocoder object
+        .connect(): Opens a SQLite database for this process and thread
+        .lookup(): Looks up a key in a SQLite table of locations
+        .geocode(): Geocodes a query
+
+    """
+
+    def __init__(self, remote=nominatimlookup, gazetteer=GAZETTEER_PATH, postcodepath=POSTCODE_PATH,
+                 cachepath=CACHE_PATH):
+        """
+        Constructs all the necessary attributes for the geocoder object.
+
+        Args
+            remote (function): Remote geocoder, defaults to Nominatim unless ROUTEPLANNER_OFFLINE is set
+            gazetteer (str): Path of the gazetteer CSV with name, address, latitude and longitude columns
+            postcodepath (str): Path of the SQLite table of postcodes
+            cachepath (str): Path of the SQLite cache of remote results, None to not cache
+
+        Returns
+            None
+        """
+
+        self.remote = None if OFFLINE and remote is nominatimlookup else remote
+        self.places = {}
+        if gazetteer and os.path.exists(gazetteer):
+            with open(gazetteer, newline='', encoding='utf-8') as file:
+                for row in csv.DictReader(file):
+                    self.places[normalize(row['name'])] = (row['address'], float(row['latitude']),
+                                                           float(row['longitude']))
+        self.postcodepath = postcodepath
+        self.cachepath = cachepath
+        self.memo = {}
+        self._connections = {}
+
+    def connect(self, path):
+        """
+        Opens a SQLite database, once per process and thread as connections cannot be shared with forked workers
+        or between the threads of GUI workers
+
+        Args
+            path (str): Database path
+
+        Returns
+            connection (sqlite3.Connection): Open connection
+        """
+
+        key = (os.getpid(), threading.get_ident(), path)
+        if key not in self._connections:
+            self._connections[key] = sqlite3.connect(path, timeout=30)
+        return self._connections[key]
+
+    def lookup(self, path, table, key):
+        """
+        Looks up a key in a SQLite table of locations
+
+        Args
+            path (str): Database path
+            table (str): Table name - cache or postcodes
+            key (str): Normalized query or postcode
+
+        Returns
+            location (tuple): Address, latitude and longitude, or None if not found
+        """
+
+        if not path or not os.path.exists(path):
+            return None
+        column = 'postcode' if table == 'postcodes' else 'query'
+        row = self.connect(path).execute(
+            f'SELECT address, latitude, longitude FROM {table} WHERE {column} = ?', (key,)).fetchone()
+        return tuple(row) if row else None
+
+    def geocode(self, query):
+        """
+        Geocodes a query, only using the remote geocoder where no local source has it
+
+        Args
+            query (str): Location, e.g. an address, postcode or landmark
+
+        Returns
+            location (tuple): Address, latitude and longitude, or None if the location could not be found
+        """
+
+        key = normalize(query)
+        if key in self.memo:
+            count('geocode_lookups', source='memo')
+            return self.memo[key]
+
+        # Gazetteer names are also tried without London and Station, e.g. 'Paddington Station, London'
+        location, source = None, 'miss'
+        stripped = ' '.join(re.sub(r'\b(london|station)\b', ' ', key).split())
+        for name in (key, stripped, 'london ' + stripped):
+            if name in self.places:
+                location, source = self.places[name], 'gazetteer'
+                break
+
+        postcode = postcodekey(query)
+        if location is None and postcode is not None:
+            location = self.lookup(self.postcodepath, 'postcodes', postcode)
+            source = 'postcode' if location is not None else source
+        if location is None:
+            location = self.lookup(self.cachepath, 'cache', key)
+            source = 'cache' if location is not None else source
+        if location is None and self.remote is not None:
+            location = self.remote(query)
+            source = 'remote' if location is not None else source
+            # Only found locations are cached, as a miss may be the service being unreachable
+            if location is not None and self.cachepath:
+                connection = self.connect(self.cachepath)
+                with connection:
+                    connection.execute('CREATE TABLE IF NOT EXISTS cache '
+                                       '(query TEXT PRIMARY KEY, address TEXT, latitude REAL, longitude REAL)')
+                    connection.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', (key, *location))
+
+        count('geocode_lookups', source=source)
+        if location is not None:
+            self.memo[key] = location
+        return location
+
+
+def importpostcodes(onspd, path=POSTCODE_PATH, region='E12000007'):
+    """
+        Imports the postcodes of a region from an ONS Postcode Directory CSV into a SQLite table
+
+        Args
+            onspd (str): Path of the ONS Postcode Directory CSV, with pcds, lat, long and rgn columns
+            path (str): Path of the SQLite table to write
+            region (str): ONS region code to keep, defaults to London
+
+        Returns
+            count (int): Number of postcodes imported
+    """
+
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute('CREATE TABLE IF NOT EXISTS postcodes '
+                           '(postcode TEXT PRIMARY KEY, address TEXT, latitude REAL, longitude REAL)')
+        rows = []
+        with open(onspd, newline='', encoding='utf-8-sig') as file:
+            for row in csv.DictReader(file):
+                # Terminated postcodes have a date of termination and are skipped
+                if row.get('rgn') != region or row.get('doterm'):
+                    continue
+                rows.append((postcodekey(row['pcds']), f"{row['pcds']}, London", float(row['lat']),
+                             float(row['long'])))
+        connection.executemany('INSERT OR REPLACE INTO postcodes VALUES (?, ?, ?, ?)', rows)
+    connection.close()
+    return len(rows)
+
+
+# Geocoder shared by the engine, its remote geocoder can be replaced with a local stand-in
+geocoder = Geocoder()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Imports postcodes for offline geocoding')
+    parser.add_argument('onspd', help='Path of the ONS Postcode Directory CSV')
+    parser.add_argument('--region', default='E12000007', help='ONS region code to keep, defaults to London')
+    args = parser.parse_args()
+    print(f'Imported {importpostcodes(args.onspd, region=args.region)} postcodes to {POSTCODE_PATH}')
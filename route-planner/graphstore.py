@@ -0,0 +1,393 @@
+import argparse
+import operator
+import os
+import pickle
+import re
+from functools import reduce
+
+import osmnx as ox
+
+# Import data folder location from raster script and pollution annotation from network script
+from raster import DATA_DIR
+from network import annotategraph, annotateedges
+from csrgraph import CSRGraph, ACCESS_BITS
+from landmarks import Landmarks
+
+# Folder holding the prebuilt Greater London graphs, one file per network type
+GRAPH_DIR = os.path.join(DATA_DIR, 'graphs')
+
+# Network types which can be prebuilt, matching the walk and cycle options of the GUI
+NETWORK_TYPES = ('walk', 'bike')
+
+# Name of the unified graph holding the edges of every network type, each flagged with the types which can use it
+MULTIMODAL = 'multimodal'
+
+# Way filters for each network type, these follow the OSMnx filters used by graph_from_polygon()
+NETWORK_FILTERS = {
+    'walk': '["highway"]["area"!~"yes"]["access"!~"private"]'
+            '["highway"!~"abandoned|bus_guideway|construction|cycleway|motor|no|planned|platform|proposed|'
+            'raceway|razed|rest_area|services"]["foot"!~"no"]["service"!~"private"]["sidewalk"!~"separate"]'
+            '["sidewalk:both"!~"separate"]["sidewalk:left"!~"separate"]["sidewalk:right"!~"separate"]',
+    'bike': '["highway"]["area"!~"yes"]["access"!~"private"]'
+            '["highway"!~"abandoned|bus_guideway|construction|corridor|elevator|escalator|footway|motor|no|'
+            'planned|platform|proposed|raceway|razed|rest_area|services|steps"]["bicycle"!~"no"]'
+            '["service"!~"private"]',
+}
+
+# Graphs, CSR arrays and landmark tables already loaded in this process, keyed by the name they are stored under
+_graphs = {}
+_csrs = {}
+_tables = {}
+
+
+def graphpath(nettype):
+    """
+        Returns the file path of the prebuilt graph for a network type
+
+        Args
+            nettype (str): Network type - walk or bike, or multimodal for the unified graph
+
+        Returns
+            path (str): Path of the pickled graph
+    """
+
+    return os.path.join(GRAPH_DIR, f'london_{nettype}.pickle')
+
+
+def csrpath(nettype):
+    """
+        Returns the folder path of the prebuilt CSR arrays for a network type
+
+        Args
+            nettype (str): Network type - walk or bike, or multimodal for the unified graph
+
+        Returns
+            path (str): Path of the folder of .npy arrays
+    """
+
+    return os.path.join(GRAPH_DIR, f'london_{nettype}_csr')
+
+
+def landmarkpath(nettype):
+    """
+        Returns the folder path of the landmark tables for a network type, holding one folder per weighting
+
+        Args
+            nettype (str): Network type - walk or bike, or multimodal for the unified graph
+
+        Returns
+            path (str): Path of the folder of landmark tables
+    """
+
+    return os.path.join(GRAPH_DIR, f'london_{nettype}_landmarks')
+
+
+def storename(nettype):
+    """
+        Returns the name the graph of a network type is stored under, which is the unified graph unless only a
+        graph of the network type itself has been built, so walking and cycling share one loaded graph
+
+        Args
+            nettype (str): Network type - walk or bike, or multimodal for the unified graph
+
+        Returns
+            name (str): multimodal, or the network type for graphs built before the unified graph
+    """
+
+    if nettype == MULTIMODAL or os.path.exists(graphpath(MULTIMODAL)) or os.path.isdir(csrpath(MULTIMODAL)):
+        return MULTIMODAL
+    if os.path.exists(graphpath(nettype)) or os.path.isdir(csrpath(nettype)):
+        return nettype
+    return MULTIMODAL
+
+
+def parsefilter(osmfilter):
+    """
+        Splits an Overpass style way filter into (tag, negated, pattern) conditions
+
+        Args
+            osmfilter (str): Filter such as '["highway"]["area"!~"yes"]'
+
+        Returns
+            conditions (list): List of (tag, negated, compiled pattern or None) tuples
+    """
+
+    conditions = []
+    for tag, operator, pattern in re.findall(r'\["([^"]+)"(?:(!?~)"([^"]*)")?\]', osmfilter):
+        if operator:
+            conditions.append((tag, operator == '!~', re.compile(pattern)))
+        else:
+            conditions.append((tag, False, None))
+    return conditions
+
+
+def keepway(attrs, conditions):
+    """
+        Checks whether an edge's OSM tags pass every condition of a parsed filter
+
+        Args
+            attrs (dict): Edge attributes from an unsimplified OSMnx graph
+            conditions (list): Conditions from parsefilter()
+
+        Returns
+            keep (bool): True if the edge belongs to the network type
+    """
+
+    for tag, negated, pattern in conditions:
+        value = attrs.get(tag)
+        if pattern is None:
+            if value is None:
+                return False
+        elif value is not None and bool(pattern.search(str(value))) == negated:
+            return False
+        elif value is None and not negated:
+            return False
+    return True
+
+
+def keeptags():
+    """
+        Keeps the OSM tags used by the network filters on edges when ways are parsed or downloaded by OSMnx
+    """
+
+    ox.settings.useful_tags_way = sorted(set(ox.settings.useful_tags_way) | {
+        'foot', 'bicycle', 'sidewalk', 'sidewalk:both', 'sidewalk:left', 'sidewalk:right'})
+
+
+def commonaccess(values):
+    """
+        Returns the network types which can use every edge merged into one when a graph is simplified
+
+        Args
+            values (list): ACCESS_BITS of each merged edge
+
+        Returns
+            access (int): ACCESS_BITS shared by every edge
+    """
+
+    return reduce(operator.and_, values)
+
+
+def unifygraph(graph):
+    """
+        Turns an unsimplified graph of the ways of every network type into the unified graph
+        Each edge is flagged with the ACCESS_BITS of the network types whose filter it passes, one way edges gain a
+        walking only reverse edge as walking ignores one way streets, and the graph is then simplified
+
+        Args
+            graph (MultiDiGraph): Unsimplified OSMnx graph with one way streets in their direction of travel only
+
+        Returns
+            graph (MultiDiGraph): Simplified OSMnx graph with an access attribute on every edge
+    """
+
+    conditions = {nettype: parsefilter(NETWORK_FILTERS[nettype]) for nettype in NETWORK_TYPES}
+    reverse = []
+    for u, v, k, attrs in graph.edges(keys=True, data=True):
+        attrs['access'] = sum(bit for nettype, bit in ACCESS_BITS.items() if keepway(attrs, conditions[nettype]))
+        if attrs['access'] & ACCESS_BITS['walk'] and attrs.get('oneway'):
+            reverse.append((v, u, dict(attrs, access=ACCESS_BITS['walk'], reversed=not attrs.get('reversed'))))
+    graph.add_edges_from(reverse)
+
+    graph.remove_edges_from([(u, v, k) for u, v, k, access in graph.edges(keys=True, data='access') if not access])
+    graph.remove_nodes_from([node for node, degree in graph.degree() if degree == 0])
+    graph = ox.simplify_graph(graph, edge_attr_aggs={'length': sum, 'access': commonaccess})
+    # Merged edges no network type can use end to end are dropped
+    graph.remove_edges_from([(u, v, k) for u, v, k, access in graph.edges(keys=True, data='access') if not access])
+    graph.remove_nodes_from([node for node, degree in graph.degree() if degree == 0])
+    return graph
+
+
+def buildgraph(osmfile, nettype=MULTIMODAL):
+    """
+        Builds a routing graph from a local OSM XML extract without network access, by default the unified graph
+        of every network type
+        The graph is annotated with pollution so this does not need repeating when it is loaded
+
+        Args
+            osmfile (str): Path of an .osm XML extract (e.g. Greater London converted from .pbf with osmium)
+            nettype (str): multimodal for the unified graph, or a network type - walk or bike - for its own graph
+
+        Returns
+            graph (MultiDiGraph): OSMnx graph
+    """
+
+    # Tags used by the network filters must be kept on edges when the extract is parsed
+    keeptags()
+
+    if nettype == MULTIMODAL:
+        graph = unifygraph(ox.graph_from_xml(osmfile, bidirectional=False, simplify=False, retain_all=True))
+    else:
+        # Walking ignores one way streets, as in graph_from_polygon()
+        graph = ox.graph_from_xml(osmfile, bidirectional=(nettype == 'walk'), simplify=False, retain_all=True)
+
+        conditions = parsefilter(NETWORK_FILTERS[nettype])
+        graph.remove_edges_from([(u, v, k) for u, v, k, attrs in graph.edges(keys=True, data=True)
+                                 if not keepway(attrs, conditions)])
+        graph.remove_nodes_from([node for node, degree in graph.degree() if degree == 0])
+        graph = ox.simplify_graph(graph)
+
+    annotategraph(graph)
+    return graph
+
+
+def savegraph(graph, nettype):
+    """
+        Saves a graph as a pickle, which loads far faster than GraphML, alongside its CSR arrays
+
+        Args
+            graph (MultiDiGraph): OSMnx graph
+            nettype (str): multimodal for the unified graph, or a network type - walk or bike
+
+        Returns
+            path (str): Path of the saved graph
+    """
+
+    os.makedirs(GRAPH_DIR, exist_ok=True)
+    path = graphpath(nettype)
+    with open(path, 'wb') as file:
+        pickle.dump(graph, file, protocol=pickle.HIGHEST_PROTOCOL)
+    CSRGraph.fromgraph(graph).save(csrpath(nettype))
+    return path
+
+
+def loadgraph(nettype):
+    """
+        Loads the prebuilt graph for a network type, keeping it resident for the rest of the process
+        Every network type shares the unified graph where it has been built
+
+        Args
+            nettype (str): Network type - walk or bike
+
+        Returns
+            graph (MultiDiGraph): OSMnx graph, or None if the graph has not been built
+    """
+
+    name = storename(nettype)
+    if name not in _graphs:
+        path = graphpath(name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as file:
+            _graphs[name] = pickle.load(file)
+    return _graphs[name]
+
+
+def loadcsr(nettype):
+    """
+        Loads the prebuilt CSR arrays for a network type memory mapped, keeping them resident for the process
+        Where only the pickled graph exists the arrays are exported from it, and the graph is not kept
+
+        Args
+            nettype (str): Network type - walk or bike
+
+        Returns
+            csr (CSRGraph): Graph as CSR arrays, or None if the graph has not been built
+    """
+
+    name = storename(nettype)
+    if name not in _csrs:
+        if os.path.isdir(csrpath(name)):
+            _csrs[name] = CSRGraph.load(csrpath(name))
+        elif loadgraph(name) is not None:
+            _csrs[name] = CSRGraph.fromgraph(_graphs.pop(name))
+        else:
+            return None
+    return _csrs[name]
+
+
+def annotatestored(nettype):
+    """
+        Integrates exposure along the edges of a prebuilt graph and saves it again with its CSR arrays
+        Only needed for graphs built before exposure was stored on edges, as buildgraph() now does this
+
+        Args
+            nettype (str): Network type - walk or bike
+
+        Returns
+            path (str): Path of the saved graph
+    """
+
+    name = storename(nettype)
+    graph = loadgraph(name)
+    annotateedges(graph)
+    path = savegraph(graph, name)
+    _csrs.pop(name, None)
+    return path
+
+
+def buildlandmarks(nettype, count=8, weights=(0.0,)):
+    """
+        Builds and saves landmark tables for the prebuilt graph of a network type, one set per exposure weighting
+
+        Args
+            nettype (str): Network type - walk or bike
+            count (int): Number of landmarks
+            weights (tuple): Exposure weightings to build tables for, 0 gives plain length tables
+
+        Returns
+            folders (list): Paths of the saved tables
+    """
+
+    name = storename(nettype)
+    csr = loadcsr(name)
+    folders = []
+    for weight in sorted(set(weights) | {0.0}):
+        folder = os.path.join(landmarkpath(name), f'weight_{weight:g}')
+        Landmarks.build(csr, count, weight).save(folder)
+        folders.append(folder)
+    _tables.pop(name, None)
+    return folders
+
+
+def loadlandmarks(nettype):
+    """
+        Loads the landmark tables of a network type memory mapped, keeping them resident for the process
+
+        Args
+            nettype (str): Network type - walk or bike
+
+        Returns
+            tables (list): List of Landmarks tables, empty if none have been built
+    """
+
+    name = storename(nettype)
+    if name not in _tables:
+        folder = landmarkpath(name)
+        names = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+        _tables[name] = [Landmarks.load(os.path.join(folder, table)) for table in names]
+    return _tables[name]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the Greater London routing graphs from a local OSM extract')
+    commands = parser.add_subparsers(dest='command', required=True)
+    graphnames = (MULTIMODAL,) + NETWORK_TYPES
+    graphhelp = (f'Graph to build, defaults to {MULTIMODAL}, the unified graph used by every network type, a network '
+                 f'type builds a graph of its own which is only used where no unified graph has been built')
+    build = commands.add_parser('build', help='Builds the graphs from an OSM extract')
+    build.add_argument('osmfile', help='Path of an .osm XML extract of Greater London')
+    build.add_argument('--nettype', choices=graphnames, action='append', help=graphhelp)
+    exposure = commands.add_parser('exposure', help='Integrates exposure along the edges of the built graphs')
+    exposure.add_argument('--nettype', choices=graphnames, action='append',
+                          help=f'Graph to annotate, defaults to {MULTIMODAL}')
+    tables = commands.add_parser('landmarks', help='Builds landmark tables for faster routing on the built graphs')
+    tables.add_argument('--nettype', choices=graphnames, action='append',
+                        help=f'Graph to build tables for, defaults to {MULTIMODAL}')
+    tables.add_argument('--count', type=int, default=8, help='Number of landmarks, defaults to 8')
+    tables.add_argument('--weights', type=float, nargs='*', default=[1.0, 5.0],
+                        help='Exposure weightings to build tables for as well as plain length, defaults to 1 5')
+    args = parser.parse_args()
+
+    for buildtype in args.nettype or (MULTIMODAL,):
+        if args.command == 'build':
+            print(f'Building {buildtype} graph...')
+            builtgraph = buildgraph(args.osmfile, buildtype)
+            print(f'Saved {len(builtgraph)} nodes to {savegraph(builtgraph, buildtype)}')
+        elif args.command == 'exposure':
+            print(f'Integrating exposure along {buildtype} graph edges...')
+            print(f'Saved {annotatestored(buildtype)}')
+        else:
+            print(f'Building {buildtype} landmark tables...')
+            for saved in buildlandmarks(buildtype, args.count, args.weights):
+                print(f'Saved {saved}')
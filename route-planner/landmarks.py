@@ -0,0 +1,214 @@
+import json
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+# Limits used for exposure weighted tables unless others are given, WHO 2005 as in limitervalues()
+PROFILE_LIMITS = (10.0, 20.0, 40.0)
+
+
+def weightmatrix(csr, weights):
+    """
+        Returns the edges of a CSR graph as a sparse matrix, keeping the lowest weight of any parallel edges
+        SciPy would add parallel edges together, and the lowest weight still gives a lower bound for every network
+        type of the unified graph
+
+        Args
+            csr (CSRGraph): Graph as CSR arrays
+            weights (numpy.ndarray): Weight of each edge
+
+        Returns
+            matrix (scipy.sparse.csr_matrix): Weight of the edge from each row node to each column node
+    """
+
+    size = len(csr.nodes)
+    sources = np.repeat(np.arange(size), np.diff(csr.offsets))
+    order = np.lexsort((weights, csr.targets, sources))
+    sources, targets, weights = sources[order], np.asarray(csr.targets)[order], np.asarray(weights)[order]
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources[keep], minlength=size), out=offsets[1:])
+    return csr_matrix((weights[keep], targets[keep], offsets), shape=(size, size))
+
+
+class Landmarks:
+    """
+    ALT (A*, landmarks and triangle inequality) distance tables for a CSR graph
+    Distances to and from a few landmark nodes give a lower bound on the distance between any two nodes
+
+    Attributes
+        landmarks (numpy.ndarray): Node indexes of the landmarks
+        forward (numpy.ndarray): Array of shape (N, K) of distances from each landmark to every node
+        backward (numpy.ndarray): Array of shape (N, K) of distances from every node to each landmark
+        weight (float): Exposure weighting the tables were built with, 0 for plain length
+        limits (tuple): Tuple of PM2.5, PM10 and NO2 limits the tables were built with
+
+    Methods
+        .__init___(): Constructs the tables object from arrays
+        .build(): Selects landmarks and builds the tables for a CSR graph
+        .save(): Saves the tables to a folder
+        .load(): Loads the tables from a folder
+        .valid(): Checks if the tables give lower bounds for a weighting and set of limits
+        .estimator(): Returns a lower bound function towards a target node
+
+    """
+
+    def __init__(self, landmarks, forward, backward, weight=0.0, limits=PROFILE_LIMITS):
+        """
+        Constructs all the necessary attributes for the tables object.
+
+        Args
+            landmarks (numpy.ndarray): Node indexes of the landmarks
+            forward (numpy.ndarray): Array of shape (N, K) of distances from each landmark to every node
+            backward (numpy.ndarray): Array of shape (N, K) of distances from every node to each landmark
+            weight (float): Exposure weighting the tables were built with, 0 for plain length
+            limits (tuple): Tuple of PM2.5, PM10 and NO2 limits the tables were built with
+
+        Returns
+            None
+        """
+
+        self.landmarks = landmarks
+        self.forward = forward
+        self.backward = backward
+        self.weight = float(weight)
+        self.limits = tuple(float(limit) for limit in limits)
+
+    @classmethod
+    def build(cls, csr, count=8, weight=0.0, limits=PROFILE_LIMITS):
+        """
+        Selects landmarks spread around the edge of the graph and measures distances to and from them
+        Each landmark is the node furthest from those already chosen
+
+        Args
+            csr (CSRGraph): Graph as CSR arrays
+            count (int): Number of landmarks, more give tighter bounds but use more memory
+            weight (float): Exposure weighting of edges, 0 for plain length
+            limits (tuple): Tuple of PM2.5, PM10 and NO2 limits used for exposure weighting
+
+        Returns
+            tables (Landmarks): Distance tables
+        """
+
+        weights = csr.length if weight == 0 else csr.exposureweights(csr.edgeratios(limits), weight)
+        size = len(csr.nodes)
+        matrix = weightmatrix(csr, weights)
+        transpose = matrix.transpose().tocsr()
+
+        # Starting from the node furthest from the centre of the graph
+        centre = np.argmin((csr.x - csr.x.mean()) ** 2 + (csr.y - csr.y.mean()) ** 2)
+        spread = dijkstra(matrix, indices=centre)
+        landmarks = []
+        forward = np.empty((size, count), dtype=np.float32)
+        backward = np.empty((size, count), dtype=np.float32)
+        for column in range(count):
+            reachable = np.isfinite(spread)
+            landmark = int(np.flatnonzero(reachable)[np.argmax(spread[reachable])])
+            landmarks.append(landmark)
+            forward[:, column] = dijkstra(matrix, indices=landmark)
+            backward[:, column] = dijkstra(transpose, indices=landmark)
+            # Distance of every node to its nearest landmark so far, the next landmark is the furthest node
+            spread = forward[:, column].astype(float) if column == 0 else np.minimum(spread, forward[:, column])
+            spread[landmarks] = 0
+        return cls(np.array(landmarks), forward, backward, weight, limits)
+
+    def save(self, folder):
+        """
+        Saves the tables as .npy files and their profile as json in a folder
+
+        Args
+            folder (str): Folder path, created if it does not exist
+
+        Returns
+            None
+        """
+
+        os.makedirs(folder, exist_ok=True)
+        for name in ('landmarks', 'forward', 'backward'):
+            np.save(os.path.join(folder, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(folder, 'profile.json'), 'w') as file:
+            json.dump({'weight': self.weight, 'limits': self.limits}, file)
+
+    @classmethod
+    def load(cls, folder, mmap=True):
+        """
+        Loads tables saved by save()
+
+        Args
+            folder (str): Folder path
+            mmap (bool): Memory maps the arrays rather than reading them into memory
+
+        Returns
+            tables (Landmarks): Distance tables
+        """
+
+        mode = 'r' if mmap else None
+        arrays = [np.load(os.path.join(folder, f'{name}.npy'), mmap_mode=mode)
+                  for name in ('landmarks', 'forward', 'backward')]
+        with open(os.path.join(folder, 'profile.json')) as file:
+            profile = json.load(file)
+        return cls(*arrays, weight=profile['weight'], limits=profile['limits'])
+
+    def valid(self, weight, limits):
+        """
+        Checks if the tables give lower bounds for a query
+        This holds when every query edge weight is at least the table's, i.e. the weighting is no lower
+        and the limits no higher, with plain length tables valid for every query
+
+        Args
+            weight (float): Exposure weighting of the query, 0 for plain length
+            limits (tuple): Tuple of PM2.5, PM10 and NO2 limits of the query
+
+        Returns
+            valid (bool): True if the tables can be used
+        """
+
+        if self.weight == 0:
+            return True
+        return weight >= self.weight and all(limit <= own for limit, own in zip(limits, self.limits))
+
+    def estimator(self, target):
+        """
+        Returns a function giving a lower bound on the distance from any node to the target
+        By the triangle inequality, d(v, t) >= d(L, t) - d(L, v) and d(v, t) >= d(v, L) - d(t, L)
+
+        Args
+            target (int): Node index of the target
+
+        Returns
+            estimate (function): Takes a node index and returns a lower bound, infinite if the target is unreachable
+        """
+
+        forward = self.forward
+        backward = self.backward
+        totarget = np.asarray(forward[target], dtype=float)
+        fromtarget = np.asarray(backward[target], dtype=float)
+
+        def estimate(node):
+            # Differences of two infinite distances say nothing about the node so are skipped by fmax
+            bound = np.fmax(np.fmax.reduce(totarget - forward[node]), np.fmax.reduce(backward[node] - fromtarget))
+            return float(bound) if bound > 0 else 0.0
+
+        return estimate
+
+
+def choosetables(tables, weight, limits):
+    """
+        Chooses the tightest tables which give lower bounds for a query
+
+        Args
+            tables (list): List of Landmarks tables
+            weight (float): Exposure weighting of the query, 0 for plain length
+            limits (tuple): Tuple of PM2.5, PM10 and NO2 limits of the query
+
+        Returns
+            tables (Landmarks): Tables with the highest valid weighting, or None if none are valid
+    """
+
+    valid = [table for table in tables if table.valid(weight, limits)]
+    if not valid:
+        return None
+    return max(valid, key=lambda table: table.weight)
@@ -0,0 +1,390 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Structured log of every traced request, one JSON object per line, silent unless logging is configured
+logger = logging.getLogger('routeplanner')
+
+# Prometheus text file rewritten as requests finish, e.g. for the node exporter textfile collector, optional
+METRICS_FILE = os.environ.get('ROUTEPLANNER_METRICS_FILE')
+
+# Fewest seconds between rewrites of the metrics file, so busy processes do not write it for every request
+WRITE_INTERVAL = 1.0
+
+# Upper bounds in seconds of the span and request duration histograms
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Prefix of every Prometheus metric name
+PREFIX = 'routeplanner'
+
+
+def labelkey(labels):
+    """
+        Returns labels as a sorted tuple, so the same labels in any order share a key
+
+        Args
+            labels (dict): Label name to value
+
+        Returns
+            key (tuple): Sorted (name, value) pairs
+    """
+
+    return tuple(sorted((str(name), str(value)) for name, value in labels.items()))
+
+
+def labeltext(name, key):
+    """
+        Formats a metric name and its labels, e.g. geocode_lookups{source="memo"}
+
+        Args
+            name (str): Metric name
+            key (tuple): Sorted (name, value) pairs, as from labelkey()
+
+        Returns
+            text (str): Name followed by its labels in braces, or the name alone where it has none
+    """
+
+    if not key:
+        return name
+    return name + '{' + ','.join(f'{label}="{value}"' for label, value in key) + '}'
+
+
+class Trace:
+    """
+    Spans, counters and values recorded while one request is planned
+    Traces hold plain values so they can be sent back from worker processes and finished in the parent
+
+    Attributes
+        kind (str): Request type, e.g. route, map, batch or gui
+        fields (dict): Details of the request written to the log, e.g. the mode and network type
+        spans (list): (stage, seconds) of each timed stage in the order they finished
+        counters (dict): (name, labels) to total
+        values (dict): Name to the last value recorded, e.g. graph size or tolerance
+        seconds (float): Duration of the whole request
+        status (str): ok, or the name of the exception which ended the request
+
+    Methods
+        .__init___(): Constructs the trace object
+        .todict(): Returns the trace as plain values for the log
+
+    """
+
+    def __init__(self, kind, fields=None):
+        """
+        Constructs all the necessary attributes for the trace object.
+
+        Args
+            kind (str): Request type
+            fields (dict): Details of the request written to the log
+
+        Returns
+            None
+        """
+
+        self.kind = kind
+        self.fields = dict(fields or {})
+        self.spans = []
+        self.counters = {}
+        self.values = {}
+        self.seconds = 0.0
+        self.status = 'ok'
+
+    def todict(self):
+        """
+        Returns the trace as plain values for the structured log
+
+        Returns
+            trace (dict): Kind, status, duration and fields with the milliseconds of each span, counters and values
+        """
+
+        return {
+            'kind': self.kind,
+            'status': self.status,
+            'ms': round(self.seconds * 1000, 3),
+            **self.fields,
+            'spans': [{'stage': stage, 'ms': round(seconds * 1000, 3)} for stage, seconds in self.spans],
+            'counters': {labeltext(name, key): total for (name, key), total in self.counters.items()},
+            'values': self.values,
+        }
+
+
+class Registry:
+    """
+    Totals of every finished trace in this process, exported in the Prometheus text format
+
+    Attributes
+        requests (dict): (kind, status) to histogram of request durations
+        spans (dict): Stage to histogram of span durations
+        counters (dict): (name, labels) to total
+        values (dict): Name to [count, sum, last] of recorded values
+
+    Methods
+        .__init___(): Constructs the registry object
+        .observe(): Adds a duration to a histogram
+        .add(): Adds a finished trace to the totals
+        .prometheus(): Returns every metric in the Prometheus text format
+        .reset(): Clears every metric
+
+    """
+
+    def __init__(self):
+        """
+        Constructs all the necessary attributes for the registry object.
+
+        Returns
+            None
+        """
+
+        self.requests = {}
+        self.spans = {}
+        self.counters = {}
+        self.values = {}
+        # Traces may finish on several threads at once, e.g. GUI workers
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def observe(histograms, key, seconds):
+        """
+        Adds a duration to a histogram of cumulative bucket counts, its count and its sum
+
+        Args
+            histograms (dict): Key to [bucket counts, count, sum]
+            key: Key of the histogram
+            seconds (float): Duration to add
+
+        Returns
+            None
+        """
+
+        histogram = histograms.setdefault(key, [[0] * len(BUCKETS), 0, 0.0])
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[0][index] += 1
+        histogram[1] += 1
+        histogram[2] += seconds
+
+    def add(self, record):
+        """
+        Adds a finished trace to the totals
+
+        Args
+            record (Trace): Finished trace
+
+        Returns
+            None
+        """
+
+        with self._lock:
+            self.observe(self.requests, (record.kind, record.status), record.seconds)
+            for stage, seconds in record.spans:
+                self.observe(self.spans, stage, seconds)
+            for key, total in record.counters.items():
+                self.counters[key] = self.counters.get(key, 0) + total
+            for name, value in record.values.items():
+                summary = self.values.setdefault(name, [0, 0.0, 0.0])
+                summary[0] += 1
+                summary[1] += value
+                summary[2] = value
+
+    def prometheus(self):
+        """
+        Returns every metric in the Prometheus text exposition format
+
+        Returns
+            text (str): Metrics, one sample per line
+        """
+
+        lines = []
+        with self._lock:
+            for metric, histograms, labelname in ((f'{PREFIX}_request_seconds', self.requests, None),
+                                                  (f'{PREFIX}_span_seconds', self.spans, 'stage')):
+                lines.append(f'# TYPE {metric} histogram')
+                for key, (buckets, count, total) in sorted(histograms.items()):
+                    labels = (('kind', key[0]), ('status', key[1])) if labelname is None else ((labelname, key),)
+                    for bound, bucketcount in zip(BUCKETS, buckets):
+                        lines.append(f"{labeltext(metric + '_bucket', labels + (('le', bound),))} {bucketcount}")
+                    lines.append(f"{labeltext(metric + '_bucket', labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{labeltext(metric + '_count', labels)} {count}")
+                    lines.append(f"{labeltext(metric + '_sum', labels)} {total}")
+            for name in sorted({name for name, key in self.counters}):
+                lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+                for (countername, key), total in sorted(self.counters.items()):
+                    if countername == name:
+                        lines.append(f'{labeltext(f"{PREFIX}_{name}_total", key)} {total}')
+            for name, (count, total, last) in sorted(self.values.items()):
+                lines.append(f'# TYPE {PREFIX}_{name} summary')
+                lines.append(f'{PREFIX}_{name}_count {count}')
+                lines.append(f'{PREFIX}_{name}_sum {total}')
+                lines.append(f'# TYPE {PREFIX}_{name}_last gauge')
+                lines.append(f'{PREFIX}_{name}_last {last}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """
+        Clears every metric
+        """
+
+        with self._lock:
+            self.requests.clear()
+            self.spans.clear()
+            self.counters.clear()
+            self.values.clear()
+
+
+# Registry shared by the whole process
+registry = Registry()
+
+# Trace of the request being planned on each thread
+_local = threading.local()
+
+# Time the metrics file was last written
+_written = [0.0]
+
+
+def current():
+    """
+        Returns the trace of the request being planned on this thread
+
+        Returns
+            record (Trace): Current trace, or None outside of a traced request
+    """
+
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def trace(kind, **fields):
+    """
+        Traces a request planned on this thread, collecting the spans, counters and values recorded inside it
+        The trace is not added to the totals until it is passed to finish(), so traces from worker processes can
+        be returned and finished in the parent
+
+        Args
+            kind (str): Request type, e.g. route, map, batch or gui
+            **fields: Details of the request written to the log
+
+        Returns
+            record (Trace): Trace of the request, yielded to the block
+    """
+
+    record = Trace(kind, fields)
+    outer = current()
+    _local.trace = record
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as error:
+        record.status = type(error).__name__
+        raise
+    finally:
+        record.seconds = time.perf_counter() - start
+        _local.trace = outer
+
+
+@contextmanager
+def span(stage):
+    """
+        Times a stage of planning a route, as a with block or a function decorator
+        Spans outside of a traced request are added straight to the totals
+
+        Args
+            stage (str): Stage name, e.g. geocoding or graph_build
+
+        Returns
+            None
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        record = current()
+        if record is not None:
+            record.spans.append((stage, seconds))
+        else:
+            with registry._lock:
+                registry.observe(registry.spans, stage, seconds)
+
+
+def count(name, amount=1, **labels):
+    """
+        Adds to a counter, e.g. raster samples or cache hits
+
+        Args
+            name (str): Counter name
+            amount (float): Amount to add
+            **labels: Labels of the counter, e.g. source='memo'
+
+        Returns
+            None
+    """
+
+    key = (name, labelkey(labels))
+    record = current()
+    if record is not None:
+        record.counters[key] = record.counters.get(key, 0) + amount
+    else:
+        with registry._lock:
+            registry.counters[key] = registry.counters.get(key, 0) + amount
+
+
+def setvalue(name, value):
+    """
+        Records a value of the current request, e.g. the graph size or tolerance, ignored outside of a trace
+
+        Args
+            name (str): Value name
+            value (float): Value
+
+        Returns
+            None
+    """
+
+    active = current()
+    if active is not None:
+        active.values[name] = float(value)
+
+
+def writeprometheus(path=METRICS_FILE):
+    """
+        Writes every metric to a file in the Prometheus text format, replacing it in one step so it is never
+        read half written
+
+        Args
+            path (str): File path
+
+        Returns
+            None
+    """
+
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as file:
+        file.write(registry.prometheus())
+    os.replace(temporary, path)
+    _written[0] = time.monotonic()
+
+
+def finish(record):
+    """
+        Adds a finished trace to the totals, writes it to the structured log and rewrites the metrics file if one
+        is set and has not been written within the last second
+
+        Args
+            record (Trace): Trace from trace(), which may have been returned from a worker process
+
+        Returns
+            None
+    """
+
+    registry.add(record)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(record.todict(), default=str))
+    if METRICS_FILE and time.monotonic() - _written[0] >= WRITE_INTERVAL:
+        try:
+            writeprometheus(METRICS_FILE)
+        except OSError:
+            pass
@@ -0,0 +1,192 @@
+import numpy as np
+import shapely
+
+# Import batched raster sampling from raster script
+from raster import resolution, sample_many, POLLUTANTS
+
+# Earth radius in metres, as used by OSMnx for edge lengths
+EARTH_RADIUS = 6371009
+
+# Node attribute names for each pollutant, in the same order as POLLUTANTS and limitervalues()
+NODE_ATTRS = ('pm2_5', 'pm10', 'no2')
+
+# Edge attribute names of length-integrated exposure to each pollutant in µg/m³·m, in the same order
+EDGE_ATTRS = tuple(f'{attr}_exposure' for attr in NODE_ATTRS)
+
+
+def annotategraph(graph):
+    """
+        Samples PM2.5, PM10 and NO2 for every node of a graph in one pass and stores them as node attributes
+        Exposure along every edge is also integrated and stored as edge attributes, see annotateedges()
+        Should be called once, straight after the graph is built
+
+        Args
+            graph (MultiDiGraph): OSMnx pre-built graph as input, modified in place
+
+        Returns
+            values (numpy.ndarray): Array of shape (N, 3) of pollution values aligned with list(graph.nodes)
+    """
+
+    nodes = list(graph.nodes)
+    lons = np.fromiter((graph.nodes[node]['x'] for node in nodes), dtype=float, count=len(nodes))
+    lats = np.fromiter((graph.nodes[node]['y'] for node in nodes), dtype=float, count=len(nodes))
+    values = sample_many(lats, lons, POLLUTANTS)
+
+    for node, row in zip(nodes, values.tolist()):
+        attrs = graph.nodes[node]
+        for attr, value in zip(NODE_ATTRS, row):
+            attrs[attr] = value
+    annotateedges(graph)
+    return values
+
+
+def annotateedges(graph, step=None):
+    """
+        Integrates PM2.5, PM10 and NO2 along the geometry of every edge and stores them as edge attributes
+        Each edge is split into pieces no longer than the raster resolution, the pollution at the middle of every
+        piece is sampled in one batch and the length-weighted mean is multiplied by the edge length
+
+        Args
+            graph (MultiDiGraph): OSMnx graph, modified in place
+            step (float): Longest piece in degrees, defaults to the raster resolution
+
+        Returns
+            exposure (numpy.ndarray): Array of shape (E, 3) of exposure in µg/m³·m, aligned with
+            graph.edges(keys=True)
+    """
+
+    edges = list(graph.edges(keys=True, data=True))
+    geometries = np.array([attrs.get('geometry') for u, v, k, attrs in edges], dtype=object)
+
+    # Edges left straight by simplification have no geometry, so a line is drawn between their nodes
+    straight = np.flatnonzero([attrs.get('geometry') is None for u, v, k, attrs in edges])
+    if straight.size:
+        ends = np.array([[(graph.nodes[node]['x'], graph.nodes[node]['y']) for node in edges[index][:2]]
+                         for index in straight.tolist()]).reshape(-1, 2)
+        geometries[straight] = shapely.linestrings(ends, indices=np.repeat(np.arange(straight.size), 2))
+
+    length = np.fromiter((attrs.get('length', 0.0) for u, v, k, attrs in edges), dtype=float, count=len(edges))
+    exposure = integrateexposure(geometries, length, lambda lats, lons: sample_many(lats, lons, POLLUTANTS),
+                                 resolution() if step is None else step)
+    for (u, v, k, attrs), row in zip(edges, exposure.tolist()):
+        for attr, value in zip(EDGE_ATTRS, row):
+            attrs[attr] = value
+    return exposure
+
+
+def integrateexposure(geometries, length, sample, step):
+    """
+        Integrates PM2.5, PM10 and NO2 along lines, see annotateedges()
+        Each line is split into pieces no longer than step, the pollution at the middle of every piece is sampled in
+        one batch and the length-weighted mean is multiplied by the line's length
+
+        Args
+            geometries (numpy.ndarray): Array of shapely LineStrings in EPSG:4326
+            length (numpy.ndarray): Length of each line in metres
+            sample (function): Takes arrays of latitudes and longitudes and returns an array of shape (N, 3) of
+                PM2.5, PM10 and NO2, e.g. sample_many() of the rasters or of a scenario in the pollution cube
+            step (float): Longest piece in degrees
+
+        Returns
+            exposure (numpy.ndarray): Array of shape (E, 3) of exposure in µg/m³·m, aligned with geometries
+    """
+
+    coords, index = shapely.get_coordinates(shapely.segmentize(geometries, step), return_index=True)
+
+    # Pieces are consecutive points of the same line, sampled at their middle
+    same = index[1:] == index[:-1]
+    start, end, piece = coords[:-1][same], coords[1:][same], index[:-1][same]
+    pieces = haversine(start[:, 1], start[:, 0], end[:, 1], end[:, 0])
+    middle = (start + end) / 2
+    values = sample(middle[:, 1], middle[:, 0])
+
+    total = np.bincount(piece, weights=pieces, minlength=len(geometries))
+    weighted = np.column_stack([np.bincount(piece, weights=pieces * values[:, column], minlength=len(geometries))
+                                for column in range(len(POLLUTANTS))])
+    # Lines of no length take the pollution at their first point
+    flat = total == 0
+    if flat.any():
+        first = coords[np.searchsorted(index, np.flatnonzero(flat))]
+        weighted[flat] = sample(first[:, 1], first[:, 0])
+        total[flat] = 1
+    return weighted / total[:, None] * np.asarray(length, dtype=float)[:, None]
+
+
+def nodepollution(graph, node):
+    """
+        Returns the precomputed pollution values of a node annotated by annotategraph()
+
+        Args
+            graph (MultiDiGraph): OSMnx graph annotated with pollution
+            node (int): Node ID
+
+        Returns
+            values (tuple): Tuple of PM2.5, PM10 and NO2 values
+    """
+
+    attrs = graph.nodes[node]
+    values = tuple(attrs[attr] for attr in NODE_ATTRS)
+    return values
+
+
+def pollutionarray(graph, nodes=None):
+    """
+        Returns the precomputed pollution values of many nodes as one array
+
+        Args
+            graph (MultiDiGraph): OSMnx graph annotated with pollution
+            nodes (list): Node IDs, defaults to every node of the graph
+
+        Returns
+            values (numpy.ndarray): Array of shape (N, 3) of PM2.5, PM10 and NO2 values aligned with nodes
+    """
+
+    if nodes is None:
+        nodes = list(graph.nodes)
+    values = np.empty((len(nodes), len(NODE_ATTRS)))
+    for column, attr in enumerate(NODE_ATTRS):
+        values[:, column] = np.fromiter((graph.nodes[node][attr] for node in nodes), dtype=float, count=len(nodes))
+    return values
+
+
+def edgearray(graph, edges):
+    """
+        Returns the precomputed exposure of many edges as one array
+        Graphs annotated before exposure was integrated along edges fall back to the mean of the end nodes
+
+        Args
+            graph (MultiDiGraph): OSMnx graph annotated with pollution
+            edges (list): List of (u, v, key) edges
+
+        Returns
+            exposure (numpy.ndarray): Array of shape (E, 3) of PM2.5, PM10 and NO2 exposure in µg/m³·m
+    """
+
+    exposure = np.empty((len(edges), len(EDGE_ATTRS)))
+    for row, (u, v, k) in enumerate(edges):
+        attrs = graph.edges[u, v, k]
+        if EDGE_ATTRS[0] in attrs:
+            exposure[row] = [attrs[attr] for attr in EDGE_ATTRS]
+        else:
+            ends = (np.array(nodepollution(graph, u)) + nodepollution(graph, v)) / 2
+            exposure[row] = ends * attrs.get('length', 0.0)
+    return exposure
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+        Returns the great circle distance between points in metres, works on floats or arrays
+
+        Args
+            lat1 (float): Latitude of first point
+            lon1 (float): Longitude of first point
+            lat2 (float): Latitude of second point
+            lon2 (float): Longitude of second point
+
+        Returns
+            distance (float): Distance in metres
+    """
+
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
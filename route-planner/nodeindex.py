@@ -0,0 +1,161 @@
+import os
+import pickle
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Import distances from network script
+from network import haversine, EARTH_RADIUS
+
+# Nearest nodes checked for a point in a masked search before falling back to searching every allowed node
+CANDIDATES = 16
+
+
+class NodeIndex:
+    """
+    KD-tree of node positions for snapping points to their nearest node
+    Nodes are projected to metres on a plane around the middle latitude of the graph, the few nearest projected
+    nodes to a point are then compared by great circle distance
+
+    Attributes
+        tree (scipy.spatial.cKDTree): Tree of projected node positions, aligned with the CSR node indexes
+        latitude (float): Latitude in degrees the projection is centred on
+        x (numpy.ndarray): Longitude of each node
+        y (numpy.ndarray): Latitude of each node
+
+    Methods
+        .__init___(): Constructs the index object
+        .build(): Builds the index for node coordinates
+        .save(): Saves the index to a folder
+        .load(): Loads the index from a folder
+        .project(): Projects coordinates to metres
+        .snap(): Returns the nearest node to each of many points
+
+    """
+
+    def __init__(self, tree, latitude, x, y):
+        """
+        Constructs all the necessary attributes for the index object.
+
+        Args
+            tree (scipy.spatial.cKDTree): Tree of projected node positions
+            latitude (float): Latitude in degrees the projection is centred on
+            x (numpy.ndarray): Longitude of each node
+            y (numpy.ndarray): Latitude of each node
+
+        Returns
+            None
+        """
+
+        self.tree = tree
+        self.latitude = latitude
+        self.x = x
+        self.y = y
+
+    @classmethod
+    def build(cls, x, y):
+        """
+        Builds the index for node coordinates
+
+        Args
+            x (numpy.ndarray): Longitude of each node
+            y (numpy.ndarray): Latitude of each node
+
+        Returns
+            index (NodeIndex): Spatial index of the nodes
+        """
+
+        latitude = float((np.min(y) + np.max(y)) / 2) if len(y) else 0.0
+        index = cls(None, latitude, x, y)
+        index.tree = cKDTree(np.column_stack(index.project(y, x)))
+        return index
+
+    def save(self, folder):
+        """
+        Saves the tree as a pickle in a folder, which loads far faster than the tree is built
+
+        Args
+            folder (str): Folder path, created if it does not exist
+
+        Returns
+            None
+        """
+
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, 'nodeindex.pickle'), 'wb') as file:
+            pickle.dump((self.tree, self.latitude), file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, folder, x, y):
+        """
+        Loads an index saved by save()
+
+        Args
+            folder (str): Folder path
+            x (numpy.ndarray): Longitude of each node
+            y (numpy.ndarray): Latitude of each node
+
+        Returns
+            index (NodeIndex): Spatial index of the nodes, or None if none has been saved
+        """
+
+        path = os.path.join(folder, 'nodeindex.pickle')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as file:
+            tree, latitude = pickle.load(file)
+        return cls(tree, latitude, x, y)
+
+    def project(self, lats, lons):
+        """
+        Projects coordinates to metres on a plane centred on the index latitude
+
+        Args
+            lats (array-like): Latitudes
+            lons (array-like): Longitudes
+
+        Returns
+            eastings (numpy.ndarray): Distance east of the prime meridian in metres
+            northings (numpy.ndarray): Distance north of the equator in metres
+        """
+
+        scale = np.radians(1) * EARTH_RADIUS
+        eastings = np.asarray(lons, dtype=float) * scale * np.cos(np.radians(self.latitude))
+        northings = np.asarray(lats, dtype=float) * scale
+        return eastings, northings
+
+    def snap(self, lats, lons, mask=None):
+        """
+        Returns the nearest node to each of many points in one batch
+
+        Args
+            lats (array-like): Latitudes
+            lons (array-like): Longitudes
+            mask (numpy.ndarray): Boolean array of nodes which can be chosen, defaults to all
+
+        Returns
+            indexes (numpy.ndarray): Node index of the nearest node to each point
+            distances (numpy.ndarray): Great circle distance from each point to its node in metres
+        """
+
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lons = np.atleast_1d(np.asarray(lons, dtype=float))
+        points = np.column_stack(self.project(lats, lons))
+        # The nearest few projected nodes are compared by great circle distance, as the projection can swap
+        # nodes at almost the same distance, and the nearest allowed node is almost always among them
+        count = min(CANDIDATES if mask is not None else 4, self.tree.n)
+        candidates = self.tree.query(points, k=count)[1].reshape(len(points), count)
+        distances = haversine(lats[:, None], lons[:, None], self.y[candidates], self.x[candidates])
+        if mask is not None:
+            distances[~mask[candidates]] = np.inf
+        best = np.argmin(distances, axis=1)
+        indexes = candidates[np.arange(len(points)), best].astype(np.int64)
+        distances = distances[np.arange(len(points)), best]
+
+        if mask is not None:
+            allowednodes = np.flatnonzero(mask)
+            for row in np.flatnonzero(np.isinf(distances)).tolist():
+                fallback = haversine(lats[row], lons[row], self.y[allowednodes], self.x[allowednodes])
+                indexes[row] = allowednodes[np.argmin(fallback)]
+                distances[row] = fallback.min()
+        return indexes, distances
@@ -1,4 +1,719 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
 import rasterio as rio
+from affine import Affine
+from rasterio.windows import Window
+
+# Import request counters from metrics script
+from metrics import count
+
+# Rasters are found relative to this script so the planner can be launched from any working directory
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Raster file for each pollutant
+RASTERS = {
+    'PM2.5': os.path.join(DATA_DIR, 'PM2_5_2025.tif'),
+    'PM10': os.path.join(DATA_DIR, 'PM10_2025.tif'),
+    'NO2': os.path.join(DATA_DIR, 'NO2_2025.tif'),
+}
+
+# Column order of sampled values, matches the order of limitervalues()
+POLLUTANTS = ('PM2.5', 'PM10', 'NO2')
+
+# Greater London boundary mask, built from the NO2 raster the first time it is needed
+BOUNDARY_PATH = os.path.join(DATA_DIR, 'boundary.npz')
+
+# Setting ROUTEPLANNER_RASTER_MODE to windowed reads tiles of the rasters as they are sampled rather than whole bands
+RASTER_MODE = os.environ.get('ROUTEPLANNER_RASTER_MODE', 'resident')
+
+# Memory budget of tiles held in windowed mode, set in megabytes with ROUTEPLANNER_RASTER_MB
+RASTER_BUDGET = int(float(os.environ.get('ROUTEPLANNER_RASTER_MB', 64)) * 2 ** 20)
+
+# Rows and columns of each tile read in windowed mode
+TILE = 256
+
+
+def pollutantkey(pollutant):
+    """
+        Takes a pollutant name in any case and returns the matching key of RASTERS
+
+        Args
+            pollutant (str): Pollutant type - NO2, PM2.5 or PM10, e.g. 'no2' or 'pm2.5'
+
+        Returns
+            key (str): Pollutant key, NO2 is returned where the pollutant is not recognised
+    """
+
+    key = str(pollutant).upper().replace('_', '.')
+    if key not in RASTERS:
+        key = 'NO2'
+    return key
+
+
+def fileversion(paths):
+    """
+        Returns a short fingerprint of the name, size and modification time of files, and of every file in folders
+        Only file names are used rather than paths, so moving the data folder keeps the version
+
+        Args
+            paths (list): File or folder paths, missing paths are included as missing
+
+        Returns
+            version (str): Hex digest which changes whenever any of the files change
+    """
+
+    digest = hashlib.sha1()
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+        for file in files:
+            name = os.path.basename(file)
+            try:
+                stat = os.stat(file)
+                digest.update(f'{name}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+            except OSError:
+                digest.update(f'{name}:missing;'.encode())
+    return digest.hexdigest()[:16]
+
+
+class TileCache:
+    """
+    Least recently used cache of raster tiles held under a memory budget
+    Tiles are loaded on a miss and the least recently used tiles are dropped once the budget is exceeded
+
+    Attributes
+        budget (int): Most bytes of tiles to keep
+        name (str): Name of the cache in request counters, e.g. raster or cube
+        tiles (OrderedDict): Tile key to array, in order of use
+        nbytes (int): Bytes of tiles held
+        hits (int): Number of tiles found in the cache
+        misses (int): Number of tiles loaded
+        evictions (int): Number of tiles dropped to stay within the budget
+
+    Methods
+        .__init___(): Constructs the cache object
+        .get(): Returns a tile, loading it on a miss
+        .clear(): Drops every tile
+        .stats(): Returns the counters as a dictionary
+
+    """
+
+    def __init__(self, budget, name='raster'):
+        """
+        Constructs all the necessary attributes for the cache object.
+
+        Args
+            budget (int): Most bytes of tiles to keep
+            name (str): Name of the cache in request counters
+
+        Returns
+            None
+        """
+
+        self.budget = int(budget)
+        self.name = name
+        self.tiles = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Routes may be planned on several threads at once
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """
+        Returns a tile, loading it on a miss
+
+        Args
+            key (tuple): Key identifying the tile
+            loader (function): Called with no arguments on a miss, returns the tile as an array
+
+        Returns
+            tile (numpy.ndarray): Tile values
+        """
+
+        with self._lock:
+            if key in self.tiles:
+                self.hits += 1
+                self.tiles.move_to_end(key)
+                tile = self.tiles[key]
+            else:
+                tile = None
+        if tile is not None:
+            count('tile_cache', cache=self.name, result='hit')
+            return tile
+        count('tile_cache', cache=self.name, result='miss')
+        tile = loader()
+        with self._lock:
+            self.misses += 1
+            if key not in self.tiles:
+                self.tiles[key] = tile
+                self.nbytes += tile.nbytes
+            # The newest tile is always kept, even where it alone is over the budget
+            while self.nbytes > self.budget and len(self.tiles) > 1:
+                oldkey, oldtile = self.tiles.popitem(last=False)
+                self.nbytes -= oldtile.nbytes
+                self.evictions += 1
+        return tile
+
+    def clear(self):
+        """
+        Drops every tile, keeping the counters
+        """
+
+        with self._lock:
+            self.tiles.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """
+        Returns the counters as a dictionary
+
+        Returns
+            stats (dict): Tiles, bytes, budget, hits, misses and evictions
+        """
+
+        return {'tiles': len(self.tiles), 'bytes': self.nbytes, 'budget': self.budget, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
+def sampletiled(lats, lons, inverse, shape, chunk, tile):
+    """
+        Samples many points from a raster split into square tiles, fetching each tile the points fall in once
+
+        Args
+            lats (array-like): Latitudes
+            lons (array-like): Longitudes
+            inverse (affine.Affine): Inverse transform of the raster
+            shape (tuple): Rows and columns of the raster
+            chunk (int): Rows and columns of each tile, tiles at the right and bottom edges may be smaller
+            tile (function): Takes a tile row and column and returns the tile as an array
+
+        Returns
+            values (numpy.ndarray): Value at each point, 0 outside of the raster as with rasterio sampling
+    """
+
+    lats = np.asarray(lats, dtype=float).ravel()
+    lons = np.asarray(lons, dtype=float).ravel()
+    values = np.zeros(lats.size)
+    cols, rows = inverse * (lons, lats)
+    rows = np.floor(rows).astype(np.int64)
+    cols = np.floor(cols).astype(np.int64)
+    inside = np.flatnonzero((rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1]))
+    rows, cols = rows[inside], cols[inside]
+
+    # Points are grouped by tile so every tile is fetched once
+    tilecols = -(-int(shape[1]) // chunk)
+    keys = (rows // chunk) * tilecols + cols // chunk
+    order = np.argsort(keys, kind='stable')
+    unique, starts = np.unique(keys[order], return_index=True)
+    for key, group in zip(unique.tolist(), np.split(order, starts[1:])):
+        block = tile(key // tilecols, key % tilecols)
+        values[inside[group]] = block[rows[group] % chunk, cols[group] % chunk]
+    return values
+
+
+class RasterStore:
+    """
+    Store holding each pollutant raster in memory as a NumPy array with its affine transform
+    Bands are read from file the first time they are sampled and then kept for the life of the process
+
+    Attributes
+        rasters (dict): Pollutant key to raster file path
+        bands (dict): Pollutant key to 2D array of raster values
+        transforms (dict): Pollutant key to inverse affine transform, converting lon/lat into col/row
+
+    Methods
+        .__init___(): Constructs the store object
+        .load(): Reads a pollutant band into memory if not already loaded
+        .warm(): Loads every band so later requests do not read from file
+        .sample_many(): Samples many points for many pollutants in one call
+        .resolution(): Returns the finest pixel size of the rasters
+
+    """
+
+    def __init__(self, rasters=None):
+        """
+        Constructs all the necessary attributes for the store object.
+
+        Args
+            rasters (dict): Pollutant key to raster file path, defaults to RASTERS
+
+        Returns
+            None
+        """
+
+        self.rasters = dict(RASTERS if rasters is None else rasters)
+        self.bands = {}
+        self.transforms = {}
+
+    def load(self, pollutant):
+        """
+        Reads a pollutant band and its transform into memory, only opening the raster on first use
+
+        Args
+            pollutant (str): Pollutant type - NO2, PM2.5 or PM10
+
+        Returns
+            band (numpy.ndarray): 2D array of raster values
+            inverse (affine.Affine): Inverse transform of the raster
+        """
+
+        key = pollutantkey(pollutant)
+        if key not in self.bands:
+            with rio.open(self.rasters[key]) as src:
+                self.bands[key] = src.read(1)
+                self.transforms[key] = ~src.transform
+        return self.bands[key], self.transforms[key]
+
+    def warm(self, pollutants=POLLUTANTS):
+        """
+        Loads every band, e.g. before worker processes are forked so they share the arrays
+
+        Args
+            pollutants (tuple): Pollutant types to load
+
+        Returns
+            None
+        """
+
+        for pollutant in pollutants:
+            self.load(pollutant)
+
+    def sample_many(self, lats, lons, pollutants=POLLUTANTS):
+        """
+        Takes arrays of lats and lons and returns the value of each pollutant at every point
+        Points outside of the raster return 0, as with rasterio sampling
+
+        Args
+            lats (array-like): Latitudes
+            lons (array-like): Longitudes
+            pollutants (tuple): Pollutant types, one column is returned per pollutant
+
+        Returns
+            values (numpy.ndarray): Array of shape (N, len(pollutants)) of pollution in μg/m3
+        """
+
+        lats = np.asarray(lats, dtype=float).ravel()
+        lons = np.asarray(lons, dtype=float).ravel()
+        values = np.zeros((lats.size, len(pollutants)))
+        for column, pollutant in enumerate(pollutants):
+            band, inverse = self.load(pollutant)
+            cols, rows = inverse * (lons, lats)
+            rows = np.floor(rows).astype(np.int64)
+            cols = np.floor(cols).astype(np.int64)
+            inside = (rows >= 0) & (rows < band.shape[0]) & (cols >= 0) & (cols < band.shape[1])
+            values[inside, column] = band[rows[inside], cols[inside]]
+        count('raster_samples', values.size, store='resident')
+        return values
+
+    def resolution(self, pollutants=POLLUTANTS):
+        """
+        Returns the finest pixel width or height of the rasters, in the units of their transforms
+
+        Args
+            pollutants (tuple): Pollutant types to check
+
+        Returns
+            resolution (float): Smallest pixel size, in degrees for EPSG:4326 rasters
+        """
+
+        sizes = []
+        for pollutant in pollutants:
+            forward = ~self.load(pollutant)[1]
+            sizes.extend((abs(forward.a), abs(forward.e)))
+        return min(sizes)
+
+
+class WindowedRasterStore:
+    """
+    Store reading square windows of each pollutant raster as they are sampled, for deployments with little memory
+    Only the tiles under sampled points are read, which for a route are those covering its search area, and
+    recently used tiles are kept in a TileCache so memory use stays within its budget
+
+    Attributes
+        rasters (dict): Pollutant key to raster file path
+        cache (TileCache): Recently used tiles
+        chunk (int): Rows and columns of each tile
+        grids (dict): Pollutant key to inverse affine transform and shape of the raster
+
+    Methods
+        .__init___(): Constructs the store object
+        .dataset(): Returns the open raster of a pollutant for this process
+        .grid(): Reads the transform and shape of a pollutant raster
+        .load(): Reads a whole pollutant band without keeping it
+        .warm(): Reads the transform and shape of every raster
+        .sample_many(): Samples many points for many pollutants in one call
+        .readtile(): Reads one tile of a raster
+        .resolution(): Returns the finest pixel size of the rasters
+
+    """
+
+    def __init__(self, rasters=None, budget=RASTER_BUDGET, chunk=TILE):
+        """
+        Constructs all the necessary attributes for the store object.
+
+        Args
+            rasters (dict): Pollutant key to raster file path, defaults to RASTERS
+            budget (int): Most bytes of tiles to keep in memory
+            chunk (int): Rows and columns of each tile
+
+        Returns
+            None
+        """
+
+        self.rasters = dict(RASTERS if rasters is None else rasters)
+        self.cache = TileCache(budget)
+        self.chunk = int(chunk)
+        self.grids = {}
+        self._datasets = {}
+        # Reads from an open raster cannot run on several threads at once
+        self._lock = threading.Lock()
+
+    def dataset(self, key):
+        """
+        Returns the open raster of a pollutant, opened once per process as open files cannot be shared with forked
+        workers
+
+        Args
+            key (str): Pollutant key
+
+        Returns
+            dataset (rasterio.DatasetReader): Open raster
+        """
+
+        datasetkey = (os.getpid(), key)
+        if datasetkey not in self._datasets:
+            self._datasets[datasetkey] = rio.open(self.rasters[key])
+        return self._datasets[datasetkey]
+
+    def grid(self, pollutant):
+        """
+        Reads the transform and shape of a pollutant raster, no values are read
+
+        Args
+            pollutant (str): Pollutant type - NO2, PM2.5 or PM10
+
+        Returns
+            inverse (affine.Affine): Inverse transform of the raster
+            shape (tuple): Rows and columns of the raster
+        """
+
+        key = pollutantkey(pollutant)
+        if key not in self.grids:
+            with self._lock:
+                src = self.dataset(key)
+                self.grids[key] = (~src.transform, (src.height, src.width))
+        return self.grids[key]
+
+    def load(self, pollutant):
+        """
+        Reads a whole pollutant band, which is not kept, only used to build the boundary when none has been saved
+
+        Args
+            pollutant (str): Pollutant type - NO2, PM2.5 or PM10
+
+        Returns
+            band (numpy.ndarray): 2D array of raster values
+            inverse (affine.Affine): Inverse transform of the raster
+        """
+
+        key = pollutantkey(pollutant)
+        with self._lock:
+            band = self.dataset(key).read(1)
+        return band, self.grid(key)[0]
+
+    def warm(self, pollutants=POLLUTANTS):
+        """
+        Reads the transform and shape of every raster, tiles are still only read when sampled
+
+        Args
+            pollutants (tuple): Pollutant types to check
+
+        Returns
+            None
+        """
+
+        for pollutant in pollutants:
+            self.grid(pollutant)
+
+    def sample_many(self, lats, lons, pollutants=POLLUTANTS):
+        """
+        Takes arrays of lats and lons and returns the value of each pollutant at every point
+        Points outside of the raster return 0, as with RasterStore.sample_many()
+
+        Args
+            lats (array-like): Latitudes
+            lons (array-like): Longitudes
+            pollutants (tuple): Pollutant types, one column is returned per pollutant
+
+        Returns
+            values (numpy.ndarray): Array of shape (N, len(pollutants)) of pollution in μg/m3
+        """
+
+        lats = np.asarray(lats, dtype=float).ravel()
+        lons = np.asarray(lons, dtype=float).ravel()
+        values = np.zeros((lats.size, len(pollutants)))
+        for column, pollutant in enumerate(pollutants):
+            key = pollutantkey(pollutant)
+            inverse, shape = self.grid(key)
+
+            def tile(row, col):
+                return self.cache.get((key, row, col), lambda: self.readtile(key, row, col, shape))
+
+            values[:, column] = sampletiled(lats, lons, inverse, shape, self.chunk, tile)
+        count('raster_samples', values.size, store='windowed')
+        return values
+
+    def readtile(self, key, row, col, shape):
+        """
+        Reads one tile of a raster, tiles at the right and bottom edges are cut to the raster
+
+        Args
+            key (str): Pollutant key
+            row (int): Tile row
+            col (int): Tile column
+            shape (tuple): Rows and columns of the raster
+
+        Returns
+            tile (numpy.ndarray): Tile values
+        """
+
+        rowoff, coloff = row * self.chunk, col * self.chunk
+        window = Window(coloff, rowoff, min(self.chunk, shape[1] - coloff), min(self.chunk, shape[0] - rowoff))
+        with self._lock:
+            return self.dataset(key).read(1, window=window)
+
+    def resolution(self, pollutants=POLLUTANTS):
+        """
+        Returns the finest pixel width or height of the rasters, in the units of their transforms
+
+        Args
+            pollutants (tuple): Pollutant types to check
+
+        Returns
+            resolution (float): Smallest pixel size, in degrees for EPSG:4326 rasters
+        """
+
+        sizes = []
+        for pollutant in pollutants:
+            forward = ~self.grid(pollutant)[0]
+            sizes.extend((abs(forward.a), abs(forward.e)))
+        return min(sizes)
+
+
+# Single store shared by the whole process so each raster is only read once, or windows of it in windowed mode
+store = WindowedRasterStore() if RASTER_MODE == 'windowed' else RasterStore()
+
+
+class Boundary:
+    """
+    Greater London boundary held as a packed bitmask of the raster cells with data, with the raster's transform
+    Points can be checked without reading the rasters, one bit per cell keeps the mask small
+
+    Attributes
+        bits (numpy.ndarray): Packed bits of the mask, one per raster cell in row order
+        shape (tuple): Rows and columns of the mask
+        inverse (affine.Affine): Inverse transform, converting lon/lat into col/row
+        version (str): Version of the raster the boundary was built from, as from fileversion()
+
+    Methods
+        .__init___(): Constructs the boundary object
+        .fromraster(): Builds the boundary from the cells of a raster with data
+        .save(): Saves the boundary to a file
+        .load(): Loads the boundary from a file
+        .contains(): Checks whether many points are inside the boundary
+
+    """
+
+    def __init__(self, bits, shape, inverse, version=''):
+        """
+        Constructs all the necessary attributes for the boundary object.
+
+        Args
+            bits (numpy.ndarray): Packed bits of the mask
+            shape (tuple): Rows and columns of the mask
+            inverse (affine.Affine): Inverse transform of the raster
+            version (str): Version of the raster, empty where unknown
+
+        Returns
+            None
+        """
+
+        self.bits = bits
+        self.shape = tuple(int(size) for size in shape)
+        self.inverse = inverse
+        self.version = version
+
+    @classmethod
+    def fromraster(cls, rasterstore, pollutant='NO2'):
+        """
+        Builds the boundary from a raster, cells of 0 or no value are outside as they have no pollution data
+
+        Args
+            rasterstore (RasterStore): Store holding the raster
+            pollutant (str): Pollutant raster to use
+
+        Returns
+            boundary (Boundary): Greater London boundary
+        """
+
+        band, inverse = rasterstore.load(pollutant)
+        valid = np.isfinite(band) & (band != 0)
+        version = fileversion([rasterstore.rasters[pollutantkey(pollutant)]])
+        return cls(np.packbits(valid, axis=None), valid.shape, inverse, version)
+
+    def save(self, path):
+        """
+        Saves the boundary as a .npz file
+
+        Args
+            path (str): File path
+
+        Returns
+            None
+        """
+
+        np.savez(path, bits=self.bits, shape=np.array(self.shape), inverse=np.array(self.inverse[:6]),
+                 version=np.array(self.version))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a boundary saved by save()
+
+        Args
+            path (str): File path
+
+        Returns
+            boundary (Boundary): Greater London boundary
+        """
+
+        with np.load(path) as data:
+            # Boundaries saved before versions were stored have none, so are always rebuilt
+            version = str(data['version']) if 'version' in data.files else ''
+            return cls(data['bits'], data['shape'], Affine(*data['inverse'].tolist()), version)
+
+    def contains(self, lats, lons):
+        """
+        Checks whether many points are inside the boundary in one call
+
+        Args
+            lats (array-like): Latitudes
+            lons (array-like): Longitudes
+
+        Returns
+            inside (numpy.ndarray): Boolean array, True for points inside Greater London
+        """
+
+        lats = np.asarray(lats, dtype=float).ravel()
+        lons = np.asarray(lons, dtype=float).ravel()
+        cols, rows = self.inverse * (lons, lats)
+        rows = np.floor(rows).astype(np.int64)
+        cols = np.floor(cols).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+        cells = rows[inside] * self.shape[1] + cols[inside]
+        # Bits are packed most significant first, eight cells to a byte
+        inside[inside] = (self.bits[cells >> 3] >> (7 - (cells & 7))) & 1 == 1
+        return inside
+
+
+# Boundaries already loaded in this process, keyed by file path
+_boundaries = {}
+
+
+def loadboundary(path=BOUNDARY_PATH):
+    """
+        Returns the Greater London boundary, building and saving it from the NO2 raster if no saved copy exists
+        The saved copy is rebuilt whenever the size or modification time of the NO2 raster no longer matches it
+
+        Args
+            path (str): File path of the saved boundary
+
+        Returns
+            boundary (Boundary): Greater London boundary
+    """
+
+    if path not in _boundaries:
+        saved = Boundary.load(path) if os.path.exists(path) else None
+        if saved is not None and saved.version == fileversion([store.rasters['NO2']]):
+            _boundaries[path] = saved
+        else:
+            _boundaries[path] = Boundary.fromraster(store)
+            try:
+                _boundaries[path].save(path)
+            except OSError:
+                pass
+    return _boundaries[path]
+
+
+def inlondon(lats, lons):
+    """
+        Checks whether many points are inside the Greater London boundary, see Boundary.contains()
+
+        Args
+            lats (array-like): Latitudes
+            lons (array-like): Longitudes
+
+        Returns
+            inside (numpy.ndarray): Boolean array, True for points inside Greater London
+    """
+
+    return loadboundary().contains(lats, lons)
+
+
+def usestore(newstore, boundary=None):
+    """
+        Replaces the shared raster store, e.g. with rasters of another area, and the boundary built from it
+
+        Args
+            newstore (RasterStore): Store to sample from, or a WindowedRasterStore
+            boundary (Boundary): Boundary of the new rasters, built from its NO2 raster if not given
+
+        Returns
+            None
+    """
+
+    global store
+    store = newstore
+    _boundaries.clear()
+    # The saved boundary belongs to the old rasters, so the new one is held in memory in its place
+    _boundaries[BOUNDARY_PATH] = Boundary.fromraster(newstore) if boundary is None else boundary
+
+
+def resolution(pollutants=POLLUTANTS):
+    """
+        Returns the finest pixel size of the shared raster store, see RasterStore.resolution()
+
+        Args
+            pollutants (tuple): Pollutant types to check
+
+        Returns
+            resolution (float): Smallest pixel size, in degrees for EPSG:4326 rasters
+    """
+
+    return store.resolution(pollutants)
+
+
+def sample_many(lats, lons, pollutants=POLLUTANTS):
+    """
+        Samples many points from the shared raster store, see RasterStore.sample_many()
+
+        Args
+            lats (array-like): Latitudes
+            lons (array-like): Longitudes
+            pollutants (tuple): Pollutant types - NO2, PM2.5 or PM10
+
+        Returns
+            values (numpy.ndarray): Array of shape (N, len(pollutants)) of pollution in μg/m3
+    """
+
+    return store.sample_many(lats, lons, pollutants)
 
 
 def obtainvalue(lat, lon, pollutant):
@@ -14,18 +729,5 @@ def obtainvalue(lat, lon, pollutant):
             value (float): Value of pollution in μg/m3
     """
 
-    if pollutant == 'NO2':
-        raster = 'data/NO2_2025.tif'
-    elif pollutant == 'PM2.5':
-        raster = 'data/PM2_5_2025.tif'
-    elif pollutant == 'PM10':
-        raster = 'data/PM10_2025.tif'
-    else:
-        raster = 'data/NO2_2025.tif'
-
-    with rio.open(raster) as src:
-        lonlat = (lon, lat)
-        sample = list(src.sample([lonlat]))
-        value = sample[0][0]
-
+    value = store.sample_many([lat], [lon], (pollutant,))[0, 0]
     return value
@@ -0,0 +1,250 @@
+import argparse
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Import data locations and file versions from the raster, graph and cube scripts and request counters from metrics
+# script
+import raster
+from raster import DATA_DIR, fileversion
+from graphstore import graphpath, csrpath, storename
+from cube import cube, datasetpath
+from metrics import count
+
+# Routes kept on disk between runs
+ROUTE_CACHE_PATH = os.path.join(DATA_DIR, 'routecache.sqlite')
+
+# Routes kept in memory, set with ROUTEPLANNER_ROUTE_CACHE, 0 turns the route cache off
+ROUTE_CACHE_SIZE = int(os.environ.get('ROUTEPLANNER_ROUTE_CACHE', 256))
+
+# Setting this environment variable to 0 keeps routes in memory only
+ROUTE_CACHE_DISK = os.environ.get('ROUTEPLANNER_ROUTE_CACHE_DISK', '1') != '0'
+
+# Most bytes of routes and maps kept on disk, set in megabytes with ROUTEPLANNER_ROUTE_CACHE_DISK_MB, the least
+# recently used entries are dropped beyond it
+ROUTE_CACHE_DISK_BUDGET = int(float(os.environ.get('ROUTEPLANNER_ROUTE_CACHE_DISK_MB', 256)) * 2 ** 20)
+
+# Format of cached entries, part of every key so entries written in an older format are never read
+CACHE_FORMAT = 3
+
+
+def datasetversion(nettype, scenario=None, year=None):
+    """
+        Returns the version of the graph and pollution data a route is found on, so cached routes are not used
+        once either is rebuilt or replaced
+
+        Args
+            nettype (str): Network type - walk or bike
+            scenario (str): Pollution scenario from the cube, None for the rasters of the shared raster store
+            year (int): Year of the pollution scenario
+
+        Returns
+            version (str): Hex digest of the graph and pollution files
+    """
+
+    paths = [graphpath(storename(nettype)), csrpath(storename(nettype))]
+    if scenario is None:
+        paths.extend(raster.store.rasters[key] for key in sorted(raster.store.rasters))
+    else:
+        paths.append(datasetpath(scenario, year, cube.folder))
+    return fileversion(paths)
+
+
+def routekey(source, target, nettype, mode, weight, limits, version):
+    """
+        Returns the key of a route in the cache
+
+        Args
+            source (int): Node ID of the start
+            target (int): Node ID of the end
+            nettype (str): Network type - walk or bike
+            mode (str): Routing mode - limits, exposure or pareto
+            weight (float): Weighting of exposure against length, only part of the key for the exposure mode
+            limits (tuple): Pollution limits the alternative was found with
+            version (str): Version of the graph and pollution data, as from datasetversion()
+
+        Returns
+            key (str): Hex digest of the inputs
+    """
+
+    weight = float(weight) if mode == 'exposure' else None
+    text = repr((int(source), int(target), nettype, mode, weight, tuple(float(limit) for limit in limits), version,
+                 CACHE_FORMAT))
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class RouteCache:
+    """
+    Two level cache of planned routes, a least recently used cache in memory in front of a SQLite table on disk
+    Entries are pickled plain values, e.g. node lists, lengths and edge pollution, or rendered maps
+
+    Attributes
+        size (int): Most entries kept in memory, 0 turns the cache off
+        path (str): Path of the SQLite cache, None to keep entries in memory only
+        budget (int): Most bytes of entries kept on disk
+        entries (OrderedDict): Key to entry, in order of use
+
+    Methods
+        .__init___(): Constructs the cache object
+        .connect(): Opens the SQLite cache for this process
+        .get(): Returns an entry from memory or disk
+        .put(): Adds an entry to memory and disk
+        .remember(): Adds an entry to memory
+        .clear(): Drops every entry
+
+    """
+
+    def __init__(self, size=ROUTE_CACHE_SIZE, path=ROUTE_CACHE_PATH if ROUTE_CACHE_DISK else None,
+                 budget=ROUTE_CACHE_DISK_BUDGET):
+        """
+        Constructs all the necessary attributes for the cache object.
+
+        Args
+            size (int): Most entries kept in memory, 0 turns the cache off
+            path (str): Path of the SQLite cache, None to keep entries in memory only
+            budget (int): Most bytes of entries kept on disk
+
+        Returns
+            None
+        """
+
+        self.size = int(size)
+        self.path = path
+        self.budget = int(budget)
+        self.entries = OrderedDict()
+        self._connections = {}
+        # Routes may be planned on several threads at once
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """
+        Opens the SQLite cache, once per process and thread as connections cannot be shared between them
+
+        Returns
+            connection (sqlite3.Connection): Open connection
+        """
+
+        key = (os.getpid(), threading.get_ident())
+        if key not in self._connections:
+            connection = sqlite3.connect(self.path, timeout=30)
+            with connection:
+                columns = [row[1] for row in connection.execute('PRAGMA table_info(routes)')]
+                # Tables written before entries were sized and timed are dropped, as they cannot be bounded
+                if columns and 'used' not in columns:
+                    connection.execute('DROP TABLE routes')
+                connection.execute('CREATE TABLE IF NOT EXISTS routes '
+                                   '(key TEXT PRIMARY KEY, entry BLOB, size INTEGER, used REAL)')
+                connection.execute('CREATE INDEX IF NOT EXISTS routes_used ON routes (used)')
+            self._connections[key] = connection
+        return self._connections[key]
+
+    def get(self, key):
+        """
+        Returns an entry, checking memory then disk, and keeps entries found on disk in memory
+
+        Args
+            key (str): Key, as from routekey()
+
+        Returns
+            entry: Cached value, or None if not cached
+        """
+
+        if self.size <= 0:
+            return None
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                count('route_cache', level='memory')
+                return self.entries[key]
+
+        entry = None
+        if self.path and os.path.exists(self.path):
+            try:
+                connection = self.connect()
+                row = connection.execute('SELECT entry FROM routes WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    with connection:
+                        connection.execute('UPDATE routes SET used = ? WHERE key = ?', (time.time(), key))
+            except sqlite3.Error:
+                row = None
+            if row is not None:
+                entry = pickle.loads(row[0])
+                self.remember(key, entry)
+        count('route_cache', level='disk' if entry is not None else 'miss')
+        return entry
+
+    def put(self, key, entry):
+        """
+        Adds an entry to memory and disk, dropping the least recently used entries on disk over the budget
+
+        Args
+            key (str): Key, as from routekey()
+            entry: Value to cache, must be picklable
+
+        Returns
+            None
+        """
+
+        if self.size <= 0:
+            return
+        self.remember(key, entry)
+        if self.path:
+            try:
+                data = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+                connection = self.connect()
+                with connection:
+                    connection.execute('INSERT OR REPLACE INTO routes VALUES (?, ?, ?, ?)',
+                                       (key, data, len(data), time.time()))
+                    # Keeping the most recently used entries which fit within the budget, so entries of old
+                    # dataset versions and rarely drawn maps age out
+                    connection.execute('DELETE FROM routes WHERE key IN (SELECT key FROM (SELECT key, SUM(size) '
+                                       'OVER (ORDER BY used DESC) AS total FROM routes) WHERE total > ?)',
+                                       (self.budget,))
+            except sqlite3.Error:
+                pass
+
+    def remember(self, key, entry):
+        """
+        Adds an entry to memory, dropping the least recently used entries over the size
+
+        Args
+            key (str): Key
+            entry: Value to cache
+
+        Returns
+            None
+        """
+
+        with self._lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drops every entry from memory and disk
+        """
+
+        with self._lock:
+            self.entries.clear()
+        if self.path and os.path.exists(self.path):
+            connection = self.connect()
+            with connection:
+                connection.execute('DELETE FROM routes')
+
+
+# Route cache shared by the whole process
+routecache = RouteCache()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manages the route cache')
+    parser.add_argument('command', choices=('clear',), help='clear drops every cached route')
+    args = parser.parse_args()
+    routecache.clear()
+    print(f'Cleared {ROUTE_CACHE_PATH}')
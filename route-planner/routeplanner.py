@@ -2,28 +2,19 @@
 # 1.0 Importing packages, modules and scripts
 # ==========================================================================
 
-# Import networking packages, modules and errors
-import osmnx as ox
-from osmnx import routing
-import networkx as nx
-from networkx import NetworkXNoPath
+# Import the route finding engine, which holds the networking, geocoding and raster functions
+from engine import plan_route, maphtml, cancellable, RouteError, LocationError, RouteCancelled
+from metrics import trace, finish
 
-# Import general geographical data packages
-import geopandas as gpd
-import pandas as pd
-from geopy import Nominatim
-
-# Import raster function from raster script
-from raster import obtainvalue
-
-# Import PyQt elements, folium and sys/io for UI
+# Import PyQt elements and sys/io for UI
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit,
-                             QPushButton, QProgressBar, QRadioButton)
+                             QPushButton, QProgressBar, QRadioButton, QComboBox, QDoubleSpinBox, QCheckBox)
 from PyQt5 import QtWebEngineWidgets
-from PyQt5.QtCore import Qt
-import folium
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, QUrl, pyqtSignal
 import sys
-import io
+import os
+import tempfile
+import threading
 
 
 # ==========================================================================
@@ -31,6 +22,117 @@ import io
 # ==========================================================================
 
 
+class WorkerSignals(QObject):
+    """
+    Signals sent from a RouteWorker to the window, these are queued so the slots run on the GUI thread
+
+    Signals
+        progress (int, int, str): Request number, percentage progress and message of the stage reached
+        finished (int, object, str): Request number, RouteResult and file path of the folium map
+        failed (int, object): Request number and the error raised, a RouteError or any unexpected exception
+
+    """
+
+    progress = pyqtSignal(int, int, str)
+    finished = pyqtSignal(int, object, str)
+    failed = pyqtSignal(int, object)
+
+
+class RouteWorker(QRunnable):
+    """
+    Plans a route and draws its map on a thread pool thread, keeping the UI responsive
+
+    Attributes
+        request (int): Request number, used by the window to drop results of stale requests
+        params (tuple): Arguments of plan_route()
+        options (dict): Keyword arguments of plan_route(), e.g. limits and pollutant weights
+        mapfile (str): File path the folium map is saved to
+        signals (WorkerSignals): Signals sent back to the window
+        cancelled (threading.Event): Set to stop the worker at the next stage
+
+    Methods
+        .__init___(): Constructs the worker object
+        .cancel(): Stops the worker at the next stage
+        .checkprogress(): Sends progress to the window, stopping the worker if cancelled
+        .run(): Plans the route, called by the thread pool
+
+    """
+
+    def __init__(self, request, mapfile, *params, **options):
+        """
+        Constructs all the necessary attributes for the worker object.
+
+        Args
+            request (int): Request number
+            mapfile (str): File path to save the folium map to
+            params: Start, end, route mode, network type and weight passed to plan_route()
+            options: Limits and pollutant weights passed to plan_route()
+
+        Returns
+            None
+        """
+
+        super().__init__()
+        self.request = request
+        self.params = params
+        self.options = options
+        self.mapfile = mapfile
+        self.signals = WorkerSignals()
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        """
+        Stops the worker within its current stage, searches check for cancellation as they run
+        """
+
+        self.cancelled.set()
+
+    def checkprogress(self, value, text):
+        """
+        Progress function passed to plan_route(), raises RouteCancelled once the worker is cancelled
+
+        Args
+            value (int): Percentage progress
+            text (str): Message describing the stage
+
+        """
+
+        if self.cancelled.is_set():
+            raise RouteCancelled()
+        self.signals.progress.emit(self.request, value, text)
+
+    def run(self):
+        """
+        Plans the route and draws its map, sending the result or error back to the window
+        """
+
+        # Workers cancelled while queued behind another are never started
+        if self.cancelled.is_set():
+            return
+        record = None
+        try:
+            # Searches stop part way through once the worker is cancelled, so the next worker is not kept waiting
+            with trace('gui', request=self.request) as record, cancellable(self.cancelled):
+                result = plan_route(*self.params, progress=self.checkprogress, **self.options)
+                self.checkprogress(90, 'Drawing map')
+                # Draw and temporarily save map to file, which the view loads far faster than a HTML string
+                with open(self.mapfile, 'w', encoding='utf-8') as file:
+                    file.write(maphtml(result))
+        except RouteCancelled:
+            return
+        except Exception as error:
+            # Unexpected errors are reported as well as RouteErrors, rather than escaping the thread pool, which
+            # would end the application
+            self.signals.failed.emit(self.request, error)
+            return
+        finally:
+            # Timings are logged and added to the metrics file, if one is set, however the request ended
+            if record is not None:
+                finish(record)
+        if not self.cancelled.is_set():
+            self.signals.finished.emit(self.request, result, self.mapfile)
+
+
 class MyWindow(QWidget):
     """
     Window class for PyQt UI
@@ -42,8 +144,12 @@ class MyWindow(QWidget):
         .__init___(): Constructs the window object
         .initwindow(): Sets title, size and defines global window variables
         .overallui(): Constructs the layout and widgets for the UI
-        .selection(): Method which takes the input of the radio walk/cycle boxes and adds this to main script
-        .runscript(): Rest of main script is housed here so it can be called as one within the window class
+        .selection(): Takes the input of the walk/cycle radio boxes and route mode and adds these to main script
+        .changelimits(): Finds the shown route again with the newly chosen limits and pollutants
+        .updateprogress(): Updates the progress bar with the stage reached
+        .runscript(): Starts a worker to run the rest of main script, cancelling any route still being planned
+        .showroute(): Displays the map and distances of a finished route
+        .showerror(): Displays the warning of a route which could not be planned
 
     """
 
@@ -54,6 +160,10 @@ class MyWindow(QWidget):
         self.input2_text = None
         self.radio_walk = None
         self.radio_cycle = None
+        self.mode_box = None
+        self.weight_box = None
+        self.limits_box = None
+        self.pollutant_boxes = None
         self.progress = None
         self.progress_label = None
         self.warning = None
@@ -68,9 +178,19 @@ class MyWindow(QWidget):
         self.legend8 = None
         self.distshortest = None
         self.distalt = None
+        self.distothers = None
         self.samepath = None
+        # Routes are planned one at a time, as plan_route() shares the last search area and geocoder memo
+        # between requests, and a cancelled worker stops within its current stage so the next one starts quickly
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self.mapdir = tempfile.TemporaryDirectory(prefix='routeplanner')
+        self.worker = None
+        self.request = 0
+        self.shown = False
         self.initwindow()
         self.nettype = "walk"
+        self.routemode = "limits"
 
     # Sets the size and title of box and calls the overallui method to construct widgets and layouts
     def initwindow(self):
@@ -95,8 +215,7 @@ class MyWindow(QWidget):
                              'click FIND ROUTE. <br><br>'
                              'Hover over routes to see information. Pollution values are indicated '
                              'in the legend below. This tool currently only works for Greater London locations. Longer '
-                             'routes may take a while to load - do not close the window even if '
-                             'unresponsive for a while.')
+                             'routes may take a while to load - a new route can be requested at any time.')
         description.setStyleSheet('font-size: 7pt; font-weight: normal')
         description.setWordWrap(True)
         description.setAlignment(Qt.AlignCenter)
@@ -119,6 +238,33 @@ class MyWindow(QWidget):
         self.radio_walk.toggled.connect(self.selection)
         self.radio_cycle.toggled.connect(self.selection)
 
+        # Route mode selection, exposure weighting finds the route in one search using the pollution weight and
+        # comparing alternatives offers several routes trading distance against pollution
+        mode_label = QLabel('Route mode:')
+        mode_label.setStyleSheet('font-size: 9pt; font-weight: bold')
+        self.mode_box = QComboBox()
+        self.mode_box.addItems(['Avoid pollution limits', 'Weigh pollution exposure', 'Compare alternatives'])
+        self.mode_box.currentIndexChanged.connect(self.selection)
+        weight_label = QLabel('Pollution weight:')
+        weight_label.setStyleSheet('font-size: 9pt; font-weight: bold')
+        self.weight_box = QDoubleSpinBox()
+        self.weight_box.setRange(0, 100)
+        self.weight_box.setSingleStep(0.5)
+        self.weight_box.setValue(1)
+        self.weight_box.setEnabled(False)
+
+        # Limit standard and pollutants avoided, changing either finds the shown route again straight away
+        limits_label = QLabel('Limits:')
+        limits_label.setStyleSheet('font-size: 9pt; font-weight: bold')
+        self.limits_box = QComboBox()
+        self.limits_box.addItems(['WHO 2005', 'WHO 2021'])
+        self.limits_box.currentIndexChanged.connect(self.changelimits)
+        self.pollutant_boxes = [QCheckBox(name, self) for name in ('PM2.5', 'PM10', 'NO2')]
+        for box in self.pollutant_boxes:
+            box.setStyleSheet('font-size: 9pt; font-weight: bold')
+            box.setChecked(True)
+            box.toggled.connect(self.changelimits)
+
         # Run button triggers main script to be ran
         run_button = QPushButton('Find Route')
         run_button.setStyleSheet('font-size: 9pt; font-weight: bold; background-color: darkgreen; color: white')
@@ -157,6 +303,7 @@ class MyWindow(QWidget):
         # Route distance labels and warning message if routes are the same
         self.distshortest = QLabel('')
         self.distalt = QLabel('')
+        self.distothers = QLabel('')
         self.samepath = QLabel('')
 
 # ==========================================================================
@@ -173,6 +320,8 @@ class MyWindow(QWidget):
         hbox3 = QHBoxLayout()
         hbox4 = QHBoxLayout()
         hbox5 = QHBoxLayout()
+        hbox6 = QHBoxLayout()
+        hbox7 = QHBoxLayout()
 
         # Adding widgets section layouts
         logo.addWidget(logo1)
@@ -189,8 +338,23 @@ class MyWindow(QWidget):
         hbox3.setSpacing(20)
         hbox3.setAlignment(Qt.AlignCenter)
 
+        hbox6.addWidget(mode_label)
+        hbox6.addWidget(self.mode_box)
+        hbox6.addWidget(weight_label)
+        hbox6.addWidget(self.weight_box)
+        hbox6.setSpacing(20)
+        hbox6.setAlignment(Qt.AlignCenter)
+
+        hbox7.addWidget(limits_label)
+        hbox7.addWidget(self.limits_box)
+        for box in self.pollutant_boxes:
+            hbox7.addWidget(box)
+        hbox7.setSpacing(20)
+        hbox7.setAlignment(Qt.AlignCenter)
+
         hbox4.addWidget(self.distshortest)
         hbox4.addWidget(self.distalt)
+        hbox4.addWidget(self.distothers)
         hbox4.setSpacing(20)
         hbox4.setAlignment(Qt.AlignCenter)
 
@@ -212,6 +376,8 @@ class MyWindow(QWidget):
         vbox.addLayout(hbox2)
         vbox.addWidget(self.warning)
         vbox.addLayout(hbox3)
+        vbox.addLayout(hbox6)
+        vbox.addLayout(hbox7)
         vbox.addWidget(run_button)
         vbox.addWidget(self.progress)
         vbox.addWidget(self.progress_label)
@@ -230,8 +396,8 @@ class MyWindow(QWidget):
 
     def selection(self):
         """
-        Checks which radio button is selected and changes global window variable
-        This means the osmnx graph will choose the correct transport choice
+        Checks which radio button and route mode is selected and changes global window variables
+        This means the osmnx graph will choose the correct transport choice and routing method
 
         Attributes
             (self)
@@ -248,587 +414,158 @@ class MyWindow(QWidget):
         else:
             self.nettype = "walk"
 
-# ==========================================================================
-# 4.0 Running low-pollution route finder script
-# ==========================================================================
+        if self.mode_box.currentIndex() == 1:
+            self.routemode = "exposure"
+        elif self.mode_box.currentIndex() == 2:
+            self.routemode = "pareto"
+        else:
+            self.routemode = "limits"
+        self.weight_box.setEnabled(self.routemode == "exposure")
 
-    def runscript(self):
+    def changelimits(self):
         """
-        Runs the main script which results in a folium route map being contructed
-
-        Classes
-            Inputs: User inputs for start and end locations
-            Locations: Route class, with start, end, lat, long information
+        Finds the shown route again with the newly chosen limits and pollutants
+        The search area and geocoded locations of the last route are reused by plan_route(), so only the routes
+        themselves are found again
 
         Attributes
             (self)
 
         Methods
-            checkboundary(): Checks if coordinates are within the Greater London boundary
-            limitervalues(): Defines allowable air pollution limits for route calculation
-            geolocation(): Takes a node as input and returns x, y values
-            get_geo_data(): Gathers pollution data for nodes using obtainvalue raster function
-            compare(): Compares node pollution values to limits
-            good_node(): Checks if a node is within limits
-            process_path(): Checks all the nodes in a route for nodes exceeding limits
-            restricted_path(): Tries to construct a route with high pollution value nodes removed
-            edgepollution(): Creates index of pollution and adds to graph edges
-            colorpicker(): Chooses color based on pollution value
-            drawfig(): Constructs a folium map of routes
+            runscript(): Starts a worker to find the routes
 
         """
 
+        # At least one pollutant must be avoided, so the last box cannot be unticked
+        if not any(box.isChecked() for box in self.pollutant_boxes):
+            self.sender().setChecked(True)
+            return
+        if self.shown:
+            self.runscript()
+
 # ==========================================================================
-# 4.1 Getting user inputs and geocoding locations
+# 4.0 Running low-pollution route finder script
 # ==========================================================================
 
-        class Inputs:
-            """
-            Class representing user inputs
-
-            Attributes
-                initial (str): Inital location
-                target (str): Target location
-
-            Methods
-                .__init___(): Constructs the object
-                .geocodeaddresses(): Geocodes the inputs
-
-            """
-
-            def __init__(self, initial, target):
-                """
-                Constructs all the necessary attributes for the inputs object.
+    def updateprogress(self, request, value, text):
+        """
+        Shows the progress bar and updates it with the stage reached by plan_route()
 
-                Args
-                    initial(str): Initial location
-                    target(str): Target location
+        Args
+            request (int): Request number, progress of stale requests is ignored
+            value (int): Percentage progress
+            text (str): Message describing the stage
 
-                Returns
-                    None
-                """
+        """
 
-                self.initial = initial
-                self.target = target
+        if request != self.request:
+            return
+        self.progress_label.show()
+        self.progress.show()
+        self.progress.setValue(value)
+        self.progress_label.setText(text)
 
-            def geocodeaddresses(self):
-                """
-                Adds locational context to user input
+    def runscript(self):
+        """
+        Runs the main script which results in a folium route map being contructed
+        Routing is carried out by plan_route() in engine.py on a thread pool worker, so the window stays
+        responsive, and any route still being planned from earlier inputs is cancelled
 
-                Args
+        Attributes
+            (self)
 
-                Returns
-                    geocodeinit (list): Initial address, latitude and longtitude
-                    geocodetarget (list): Target address, latitude and longtitude
+        Methods
+            plan_route(): Geocodes the inputs and finds the fastest and lower pollution routes
+            maphtml(): Renders the folium map of routes, reusing a map already drawn for the same routes
 
-                """
-                # Class instance created for nominatim tool
-                loc = Nominatim(user_agent="Geopy Library")
-                initloc = loc.geocode(self.initial)
-                targetloc = loc.geocode(self.target)
-                try:
-                    geocodeinit = [initloc.address, initloc.latitude, initloc.longitude]
-                    geocodetarget = [targetloc.address, targetloc.latitude, targetloc.longitude]
-                except AttributeError:
-                    geocodeinit = "Fail"
-                    geocodetarget = "Fail"
-                    return geocodeinit, geocodetarget
-                return geocodeinit, geocodetarget
+        """
 
         # Get inputs from PyQt input boxes
         start = self.input1_text.text()
         end = self.input2_text.text()
-        # Creates class instance of Inputs with two user inputs
-        userinputs = Inputs(start, end)
 
-        geo_initial = userinputs.geocodeaddresses()[0]
-        geo_target = userinputs.geocodeaddresses()[1]
+        # Hiding warnings from the previous route
+        self.warning.hide()
+        self.samepath.hide()
+
+        # Cancelling the previous request, its results are ignored if it finishes before noticing
+        if self.worker is not None:
+            self.worker.cancel()
+        self.request += 1
+        mapfile = os.path.join(self.mapdir.name, f'route{self.request}.html')
+        limits = ('who2005', 'who2021')[self.limits_box.currentIndex()]
+        pollutantweights = tuple(1.0 if box.isChecked() else 0.0 for box in self.pollutant_boxes)
+        self.worker = RouteWorker(self.request, mapfile, start, end, self.routemode, self.nettype,
+                                  self.weight_box.value(), limits=limits, pollutantweights=pollutantweights)
+        self.worker.signals.progress.connect(self.updateprogress)
+        self.worker.signals.finished.connect(self.showroute)
+        self.worker.signals.failed.connect(self.showerror)
+        self.updateprogress(self.request, 0, 'Starting...')
+        self.pool.start(self.worker)
+
+    def showerror(self, request, error):
+        """
+        Displays the warning of a route which could not be planned
 
-        # If geocoding returns a fail from the try/except block warning is displayed
-        if geo_initial == 'Fail' and geo_target == 'Fail':
-            self.warning.setText('One or more addresses could not be located')
-            self.warning.show()
+        Args
+            request (int): Request number, errors of stale requests are ignored
+            error (Exception): Error raised by plan_route(), a RouteError or any unexpected exception
+
+        """
+
+        if request != self.request:
+            return
+        self.worker = None
+        if isinstance(error, RouteError):
+            self.warning.setText(str(error))
+        else:
+            self.warning.setText(f'Unable to plan route, an unexpected error occurred: {error}')
+        self.warning.show()
+        self.progress.hide()
+        self.progress_label.hide()
+        # Clearing inputs where addresses could not be located
+        if isinstance(error, LocationError):
             self.input1_text.setText("")
             self.input2_text.setText("")
-            return
 
-        def checkboundary(geocodedinital, geocodedtarget):
-            """
-            Takes a latitude and longitude and checks whether it is in the Greater London boundary
-            This is done by sampling the raster and checking for 0 or Null values
-
-            Args
-                geocodedinital (list): Input class style list with location, latitude, longitude of start location
-                geocodedtarget (list): Input class style list with location, latitude, longitude of end location
-
-            Returns
-                in_london (bool): True or false of whether location is within Greater London boundary
-            """
-            init_latlong = geocodedinital[-2], geocodedinital[-1]
-            target_latlong = geocodedtarget[-2], geocodedtarget[-1]
-            if (obtainvalue(init_latlong[0], init_latlong[1], 'no2') == 0 or None or
-                    obtainvalue(target_latlong[0], target_latlong[1], 'no2') == 0 or None):
-                in_london = False
-                return in_london
-            else:
-                in_london = True
-                return in_london
-
-        in_london_status = checkboundary(geo_initial, geo_target)
-
-        # If Greater London check returns False then a warning is displayed
-        if not in_london_status:
-            self.warning.show()
-            self.warning.setText('One or more locations outside of Greater London boundary')
-            return
+    def showroute(self, request, result, mapfile):
+        """
+        Displays the map and distances of a finished route
 
-# ==========================================================================
-# 4.2 Processing initial fastest route
-# ==========================================================================
+        Args
+            request (int): Request number, results of stale requests are ignored
+            result (RouteResult): Routes found by plan_route()
+            mapfile (str): File path of the folium map
 
-        # Hiding warnings and starting progress bar
-        self.warning.hide()
-        self.progress_label.show()
-        self.progress.show()
-        self.progress_label.setText('Locating start and end points...')
-        self.progress.setValue(20)
-        self.samepath.hide()
+        """
 
-        class Locations:
-            """
-            Class representing users locations, capable of producing geodataframes and nodes
-            Attributes easiest constructed using Nomantim tool within the Inputs class
-
-            Attributes
-                places (list): List of addresses
-                latitudes (list): List of latitudes
-                longtitudes (list): List of longtitudes
-
-            Methods
-                .__init___(): Constructs the object
-                .gpdframe(): Constructs a geopandas frame from the inputs with CRS 4326 geometry
-                .getnodes(): Returns the closest nodes to the inital and target locations
-
-            """
-
-            def __init__(self, places, latitudes, longitudes):
-                """
-                Constructs all the necessary attributes for the locations object.
-
-                Args
-                    places (list): List of addresses
-                    latitudes (list): List of latitudes
-                    longtitudes (list): List of longtitudes
-
-                Returns
-                    None
-
-                """
-                self.places = places
-                self.latitudes = latitudes
-                self.longitudes = longitudes
-
-            def gpdframe(self):
-                """
-                Constructs a geopandas frame from the inputs with CRS 4326 geometry
-
-                Args
-
-                Returns
-                    geodf(geopandas.geodataframe.GeoDataFrame): Geodataframe of the given inputs
-
-                """
-                df = pd.DataFrame({
-                    "Places": self.places,
-                    "Latitudes": self.latitudes,
-                    "Longitudes": self.longitudes,
-                })
-                geodf = gpd.GeoDataFrame(
-                    df, geometry=gpd.points_from_xy(df.Longitudes, df.Latitudes), crs="EPSG:4326"
-                )
-                return geodf
-
-            def getnodes(self):
-                """
-                Returns the closest nodes to the inital and target locations
-
-                Args
-
-                Returns
-                    orig_node (int): Node ID of nearest node on graph to initial location
-                    target_node (int): Node ID of nearest node on graph to target location
-
-                """
-                orig_node = ox.nearest_nodes(graph, self.longitudes[0], self.latitudes[0])
-                target_node = ox.nearest_nodes(graph, self.longitudes[1], self.latitudes[1])
-                return orig_node, target_node
-
-        # Creates an instance of the Locations class from the users earlier inputs
-        userlocations = Locations(
-            [geo_initial[0], geo_target[0]],
-            [geo_initial[1], geo_target[1]],
-            [geo_initial[2], geo_target[2]],
-        )
-
-        # Updating progress bar
-        self.progress.setValue(50)
-        self.progress_label.setText('Drawing route between locations')
-
-        # Variable created to store the geopandas data frame
-        gdf = userlocations.gpdframe()
-        # Creating a polygon of the search area and buffering it so that routes are not limited
-        box = gdf.unary_union.envelope
-        buffbox = box.buffer(0.01)
-
-        # Drawing graph of buffered area with correct transport type
-        graph = ox.graph_from_polygon(buffbox, network_type=self.nettype, truncate_by_edge=False, retain_all=True)
-        # Getting location nodes and drawing initial route
-        usernodes = userlocations.getnodes()
-
-        # If inital route cannot be drawn an error message is displayed
-        try:
-            route = nx.shortest_path(G=graph, source=usernodes[0], target=usernodes[1], weight="distance")
-        except NetworkXNoPath:
-            self.warning.show()
-            self.warning.setText("Unable to draw a route between locations, check addresses and retry")
-            self.progress.hide()
-            self.progress_label.hide()
+        if request != self.request:
             return
+        self.worker = None
+        self.shown = True
 
-        # Gathering route length and rounding to 2 decimal places
-        shortest_edges = ox.routing.route_to_gdf(graph, route)
-        shortest_length = sum(shortest_edges['length'])
-        shortest_length_round = round((shortest_length / 1000), 2)
-
-# ==========================================================================
-# 4.3 Finding lower pollution route
-# ==========================================================================
-        def limitervalues():
-            """
-            Returns a tuple of three values used as pollution limits
-            Allows one place to change values rather than constant redefinition
-
-            Args
-                (none)
-
-            Returns
-                chosenlimits (tuple): Tuple of PM2.5, PM10 and NO2 values
-
-            """
-
-            # Safe limits for air pollution - World Health Organisation
-            who2005 = {
-                "pm2_5": 10,
-                "pm10": 20,
-                "no2": 40
-            }
-            pm2_5value = float(who2005["pm2_5"])
-            pm10value = float(who2005["pm10"])
-            no2value = float(who2005["no2"])
-            chosenlimits = (pm2_5value, pm10value, no2value)
-            return chosenlimits
-
-        # Defining limits and initial tolerance
-        limits = limitervalues()
-        tolerance = 1
-
-        # Setting up a location to store pollution values that are high
-        geo_cache = {}
-
-        # Converting graph into geodataframe
-        geo_data = ox.graph_to_gdfs(graph, nodes=True, edges=False)
-
-        # Unordered sets created to store nodes
-        all_nodes = set(graph.nodes())
-        bad_nodes = set()
-
-        def get_location(node):
-            """
-            Takes a node as input and returns its x and y values
-
-            Args
-                node (dict): OSMnx type node
-            Returns
-                x (int): Value from x field of node dataframe
-                y (int): Value from y field of node dataframe
-            """
-            row = geo_data.loc[node]
-            x = row.x
-            y = row.y
-            return x, y
-
-        def get_geo_data(node):
-            """
-            Takes a node as input and gathers pollution data about node, uses obtainvalue function from raster script
-            Requires geocache dictionary to be setup prior i.e. geo_cache={}
-
-            Args
-                node (dict): OSMnx type node
-            Returns
-                node (dict): Node added directly to geocache
-            """
-            if node not in geo_cache.keys():
-                x, y = get_location(node)
-                geo_cache[node] = (
-                    obtainvalue(y, x, "pm2.5"),
-                    obtainvalue(y, x, "pm10"),
-                    obtainvalue(y, x, "no2"),
-                )
-            return geo_cache[node]
-
-        def compare(values, limiters):
-            """
-            Compares node pollution values to limits
-
-            Args
-                values (dict): OSMnx node dictionary
-            Returns
-                within (bool): Returns true if all values are within limits
-            """
-            within = all(value < limiter * tolerance for value, limiter in zip(values, limiters))
-            return within
-
-        def good_node(node):
-            """
-            Checks whether a node is a start or finish node (automatically skipped), and if it is within allowed limits
-
-            Args
-                node (dict): OSMnx node dictionary
-            Returns
-                goodbool (bool): Returns true if value is within limits or start/end node
-            """
-            if node in usernodes:
-                return True
-            goodbool = compare(get_geo_data(node), limits)
-            return goodbool
-
-        def process_path(path):
-            """
-            Checks all the nodes in a route for nodes exceeding limits, and adds these to a list of bad nodes
-            Requires creation of an empty set for bad nodes i.e. bad_nodes = set()
-
-            Args
-                path (list): List of node dictionaries as OSMnx route
-            Returns
-                good_path (bool): Returns true if all values are within limits
-            """
-            good_path = True
-            for node in path:
-                if not good_node(node):
-                    bad_nodes.add(node)
-                    good_path = False
-            return good_path
-
-        def restricted_path(res_graph):
-            """
-            Tries to constuct a path with the high pollution value nodes removed.
-            Where this is not possible a False statement is returned
-
-            Args
-                res_graph (MultiDiGraph): OSMnx pre-built graph as input
-            Returns
-                short_path (list): List of node dictionaries as OSMnx route if successful or False
-            """
-            nodes = all_nodes - bad_nodes
-            sub = nx.subgraph(res_graph, nodes)
-            try:
-                short_path = nx.shortest_path(sub, source=usernodes[0], target=usernodes[1], weight="distance")
-                return short_path
-            except NetworkXNoPath:
-                return False
-
-        # Update progress bar
-        self.progress.setValue(70)
-        self.progress_label.setText('Checking pollution along route')
-
-        # Attempts to make a valid path
-        valid_path = process_path(route)
-
-        # Blank attempt to add nodes to
-        attempt = []
-
-        # Where no valid path, while loop reattempts route by resetting bad nodes and upping limit tolerances
-        while not valid_path:
-            attempt = restricted_path(graph)
-            if not attempt:
-                tolerance *= 1.5
-                bad_nodes = set()
-            else:
-                valid_path = process_path(attempt)
-
-        # Gathering route length and rounding to 2 decimal places
-        alt_edges = ox.routing.route_to_gdf(graph, attempt)
-        alt_length = sum(alt_edges['length'])
-        alt_length_rounded = round((alt_length / 1000), 2)
-
-# ==========================================================================
-# 4.4 Styling routes based on pollution
-# ==========================================================================
+        # Gathering route lengths and rounding to 2 decimal places, with the mean pollution along each route
+        shortest_length_round = round((result.shortest_length / 1000), 2)
+        alt_length_rounded = round((result.alt_length / 1000), 2)
+        shortest_exposure = round(result.edges_values['exposure'], 1)
+        alt_exposure = round(result.alt_edges_values['exposure'], 1)
 
-        def edgepollution(figgraph, figroute):
-            """
-            Takes a route and its associated graph, and returns an edge index of pollution based on three pollutants
-            Requires obtainvalue() script from raster.py
-
-            Args
-                figgraph (MultiDiGraph): OSMnx pre-built graph as input
-                figroute (list): OSMnx list of node values constructed using routing module
-            Returns
-                route_values (dict):
-                    'edges': Edge number
-                    'values': Pollutant index
-
-            """
-
-            edges = ox.routing.route_to_gdf(figgraph, figroute, weight='length')
-            nodes = ox.graph_to_gdfs(figgraph, nodes=True, edges=False)
-            edges.sort_index(inplace=True)
-            for index, edge in edges.iterrows():
-                node1num = index[0]
-                node2num = index[1]
-                node1 = nodes.loc[node1num]
-                node2 = nodes.loc[node2num]
-                n1v1 = obtainvalue(node1['y'], node1['x'], 'PM2.5')
-                n1v2 = obtainvalue(node1['y'], node1['x'], 'PM10')
-                n1v3 = obtainvalue(node1['y'], node1['x'], 'NO2')
-                node1avg = (n1v1 + n1v2 + n1v3) / 3
-                n2v1 = obtainvalue(node2['y'], node2['x'], 'PM2.5')
-                n2v2 = obtainvalue(node2['y'], node2['x'], 'PM10')
-                n2v3 = obtainvalue(node2['y'], node2['x'], 'NO2')
-                node2avg = (n2v1 + n2v2 + n2v3) / 3
-                edges.loc[(node1num, node2num), 'avgvalue'] = (node1avg + node2avg) / 2
-                route_values = {'edges': figroute, 'values': edges['avgvalue'].tolist()}
-            return route_values
-
-        # Update progress bar
-        self.progress.setValue(80)
-        self.progress_label.setText('Drawing routes')
-
-        # Getting edge colors
-        edges_values = edgepollution(graph, route)
-        alt_edges_values = edgepollution(graph, attempt)
-
-        def colorpicker(value):
-            """
-            Takes float and returns a color from green to red to black scale based on how high the integer is
-
-            Args
-                value (float): Pollution edge value
-
-            Returns
-                color (string): Hexcode of color
-
-            """
-
-            if value < 10:
-                color = "#40b81c"
-            elif value < 20:
-                color = "#d1d119"
-            elif value < 30:
-                color = "#d1a619"
-            elif value < 40:
-                color = "#d14419"
-            elif value < 50:
-                color = "#9c1919"
-            elif value < 60:
-                color = "#3d0101"
-            else:
-                color = "#000000"
-            return color
-
-        def drawfig(foliumgraph, foliumroute, foliumalt, initial, target):
-            """
-            Takes two routes and their associated graph, and constructs a folium map
-            Requires obtainvalue() script from raster.py
-
-            Args
-                figgraph (MultiDiGraph): OSMnx pre-built graph as input
-                figroute (list): OSMnx list of node values constructed using routing module
-            Returns
-                m (map) (.html): Saves a html file of final route
-            """
-            originedges = ox.routing.route_to_gdf(foliumgraph, foliumroute['edges'], weight='length')
-            originedges['value'] = foliumroute['values']
-
-            alternateedges = ox.routing.route_to_gdf(foliumgraph, foliumalt['edges'], weight='length')
-            alternateedges['value'] = foliumalt['values']
-
-            if shortest_length_round > 12:
-                zoom = 11
-            elif shortest_length_round > 10:
-                zoom = 12
-            elif shortest_length_round > 5:
-                zoom = 13
-            else:
-                zoom = 14
-
-            center = [((float(geo_initial[1]) + float(geo_target[1])) / 2),
-                      ((float(geo_initial[2]) + float(geo_target[2])) / 2)]
-            m = folium.Map(
-                location=center,
-                zoom_start=zoom,
-                tiles="cartodb positron",
-                opacity=1
-            )
-
-            for index, edge in originedges.iterrows():
-                value = edge['value']
-                color = colorpicker(value)
-                origincoordinates = edge['geometry'].coords.xy
-                origincoord_tuples = list(zip(origincoordinates[1], origincoordinates[0]))
-
-                folium.PolyLine(
-                    locations=origincoord_tuples,
-                    color=color,
-                    weight=10,
-                    opacity=1,
-                    tooltip="Fastest Route"
-                ).add_to(m)
-
-            for index_alt, edge_alt in alternateedges.iterrows():
-                value = edge_alt['value']
-                color = colorpicker(value)
-                altcoordinates = edge_alt['geometry'].coords.xy
-                altcoord_tuples = list(zip(altcoordinates[1], altcoordinates[0]))
-
-                folium.PolyLine(
-                    locations=altcoord_tuples,
-                    color=color,
-                    weight=10,
-                    opacity=1,
-                    tooltip="Lower Pollution Alternative"
-                ).add_to(m)
-
-            folium.Marker(
-                location=[initial[1], initial[2]],
-                tooltip='Start',
-                icon=folium.Icon(color='green')
-            ).add_to(m)
-
-            folium.Marker(
-                location=[target[1], target[2]],
-                tooltip='End',
-                icon=folium.Icon(color='green')
-            ).add_to(m)
-
-            return m
-
-        # Draw and temporarily save map
-        folmap = drawfig(graph, edges_values, alt_edges_values, geo_initial, geo_target)
-        data = io.BytesIO()
-        folmap.save(data, close_file=False)
-
-        # Write saved map to view window in UI
-        self.view.setHtml(data.getvalue().decode())
+        # Load saved map into view window in UI
+        self.view.load(QUrl.fromLocalFile(mapfile))
 
         # Hide progress bar and display distances and warning if routes are the same
         self.progress_label.hide()
         self.progress.hide()
         self.distshortest.show()
-        self.distshortest.setText(f'Shortest Path: {shortest_length_round}km')
+        self.distshortest.setText(f'Shortest Path: {shortest_length_round}km, {shortest_exposure}µg/m3')
         self.distalt.show()
-        self.distalt.setText(f'Alternative Path: {alt_length_rounded}km')
-        if alt_length == shortest_length:
+        self.distalt.setText(f'Alternative Path: {alt_length_rounded}km, {alt_exposure}µg/m3')
+        # Other Pareto routes of the compare alternatives mode, shortest first
+        others = [f"{round(values['length'] / 1000, 2)}km, {round(values['exposure'], 1)}µg/m3"
+                  for values in result.alternatives]
+        self.distothers.setText(f"Other Paths: {'; '.join(others)}")
+        self.distothers.setVisible(bool(others))
+        if result.samepath():
             self.distalt.show()
             self.distshortest.show()
             self.samepath.show()
@@ -0,0 +1,287 @@
+import argparse
+import asyncio
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+
+# Import the route finding engine and resident data loaders
+from engine import plan_route, maphtml, warmup, routelimits, checkweight, RouteError, MODES, NETWORK_TYPES
+from cube import cube
+from metrics import registry, trace, finish
+
+# Log of unexpected errors, alongside the structured request log
+logger = logging.getLogger('routeplanner')
+
+
+def routeparams(query):
+    """
+        Takes the query string of a request and returns plan_route() arguments
+
+        Args
+            query (str): URL query string, e.g. start=Ealing&end=Ealing%20Broadway&mode=limits&nettype=walk,
+                optionally with a pollution scenario and year from the cube, e.g. scenario=ulez&year=2030, a limit
+                standard or PM2.5, PM10 and NO2 limits, e.g. limits=who2021 or limits=5,15,10, and pollutant
+                weights, e.g. pollutantweights=0,0,1 to route around NO2 alone
+
+        Returns
+            params (dict): Keyword arguments for plan_route(), raises ValueError if they are invalid
+    """
+
+    values = {key: items[-1] for key, items in parse_qs(query).items()}
+    if not values.get('start') or not values.get('end'):
+        raise ValueError('start and end are required')
+    params = {
+        'start': values['start'],
+        'end': values['end'],
+        'mode': values.get('mode', 'limits'),
+        'nettype': values.get('nettype', 'walk'),
+        'weight': checkweight(values.get('weight', 1.0)),
+        'scenario': values.get('scenario') or None,
+        'year': int(values['year']) if values.get('year') else None,
+        'limits': values.get('limits') or None,
+        'pollutantweights': values.get('pollutantweights') or None,
+    }
+    if params['mode'] not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    if params['nettype'] not in NETWORK_TYPES:
+        raise ValueError(f"nettype must be one of {', '.join(NETWORK_TYPES)}")
+    if params['scenario'] is not None:
+        params['year'] = cube.resolve(params['scenario'], params['year'])
+    # Raises ValueError if the limits or weights are invalid
+    routelimits(params['limits'], params['pollutantweights'])
+    return params
+
+
+def tracefields(params):
+    """
+        Returns the details of a request written to its trace, leaving out the start and end addresses so the
+        locations of users are not logged
+
+        Args
+            params (dict): Keyword arguments for plan_route()
+
+        Returns
+            fields (dict): Routing options of the request
+    """
+
+    return {name: value for name, value in params.items() if name not in ('start', 'end')}
+
+
+def failure(record, error):
+    """
+        Records an error raised while planning a route in a worker, as a value which can be sent to the parent
+
+        Args
+            record (Trace): Trace of the request
+            error (Exception): Error raised by plan_route() or maphtml()
+
+        Returns
+            error (Exception): The RouteError, or a RuntimeError naming any other error, as not every exception
+            can be pickled
+    """
+
+    record.status = type(error).__name__
+    if isinstance(error, RouteError):
+        return error
+    logger.exception('Unexpected error planning a route')
+    return RuntimeError(f'{type(error).__name__}: {error}')
+
+
+def routejob(params):
+    """
+        Plans a route in a worker process and returns it as plain values
+
+        Args
+            params (dict): Keyword arguments for plan_route()
+
+        Returns
+            result (dict): Route result, as from RouteResult.todict(), or None if no route was found
+            error (Exception): RouteError giving the reason no route was found, RuntimeError for any other error,
+            or None
+            record (Trace): Timings and counters of the request, finished in the parent process
+    """
+
+    result, error = None, None
+    with trace('route', **tracefields(params)) as record:
+        try:
+            result = plan_route(**params).todict()
+        except Exception as routeerror:
+            error = failure(record, routeerror)
+    return result, error, record
+
+
+def mapjob(params):
+    """
+        Plans a route in a worker process and returns its folium map as HTML
+
+        Args
+            params (dict): Keyword arguments for plan_route()
+
+        Returns
+            html (str): Folium map of both routes, or None if no route was found
+            error (Exception): RouteError giving the reason no route was found, RuntimeError for any other error,
+            or None
+            record (Trace): Timings and counters of the request, finished in the parent process
+    """
+
+    html, error = None, None
+    with trace('map', **tracefields(params)) as record:
+        try:
+            html = maphtml(plan_route(**params))
+        except Exception as routeerror:
+            error = failure(record, routeerror)
+    return html, error, record
+
+
+class RouteService:
+    """
+    Asyncio HTTP service answering route requests from a pool of warm worker processes
+
+    Endpoints
+        GET /route: JSON of both routes, their lengths and edge pollution
+        GET /map: HTML folium map of both routes
+        GET /health: Returns ok once the service is running
+        GET /metrics: Request and stage timings and counters in the Prometheus text format
+
+    Attributes
+        pool (ProcessPoolExecutor): Worker processes which plan routes
+
+    Methods
+        .__init___(): Constructs the service object and its worker pool
+        .dispatch(): Runs a request and returns the response
+        .handle(): Reads a HTTP request from a connection and writes the response
+        .serve(): Serves requests until cancelled
+
+    """
+
+    def __init__(self, workers=None):
+        """
+        Constructs all the necessary attributes for the service object.
+
+        Args
+            workers (int): Number of worker processes, defaults to the number of CPUs
+
+        Returns
+            None
+        """
+
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=warmup)
+
+    async def dispatch(self, method, target):
+        """
+        Runs a request, sending route planning to the worker pool so the event loop is never blocked
+
+        Args
+            method (str): HTTP method
+            target (str): Request path and query string
+
+        Returns
+            status (HTTPStatus): Response status
+            contenttype (str): Response content type
+            body (str): Response body
+        """
+
+        url = urlsplit(target)
+        if method != 'GET':
+            return HTTPStatus.METHOD_NOT_ALLOWED, 'application/json', json.dumps({'error': 'Only GET is supported'})
+        if url.path == '/health':
+            return HTTPStatus.OK, 'application/json', json.dumps({'status': 'ok'})
+        if url.path == '/metrics':
+            return HTTPStatus.OK, 'text/plain; version=0.0.4', registry.prometheus()
+        if url.path not in ('/route', '/map'):
+            return HTTPStatus.NOT_FOUND, 'application/json', json.dumps({'error': 'Not found'})
+
+        try:
+            params = routeparams(url.query)
+        except ValueError as error:
+            return HTTPStatus.BAD_REQUEST, 'application/json', json.dumps({'error': str(error)})
+
+        loop = asyncio.get_running_loop()
+        job = routejob if url.path == '/route' else mapjob
+        body, error, record = await loop.run_in_executor(self.pool, job, params)
+        # Traces of the workers are added to the totals of this process, which serves /metrics
+        finish(record)
+        if isinstance(error, RouteError):
+            return HTTPStatus.UNPROCESSABLE_ENTITY, 'application/json', json.dumps({'error': str(error)})
+        if error is not None:
+            # Details of unexpected errors are logged by the worker rather than sent to the client
+            return HTTPStatus.INTERNAL_SERVER_ERROR, 'application/json', json.dumps({'error': 'Internal server error'})
+        if url.path == '/route':
+            return HTTPStatus.OK, 'application/json', json.dumps(body)
+        return HTTPStatus.OK, 'text/html; charset=utf-8', body
+
+    async def handle(self, reader, writer):
+        """
+        Reads a HTTP request from a connection, dispatches it and writes the response
+
+        Args
+            reader (asyncio.StreamReader): Connection reader
+            writer (asyncio.StreamWriter): Connection writer
+
+        Returns
+            None
+        """
+
+        try:
+            requestline = (await reader.readline()).decode('latin-1').split()
+            # Headers are read and ignored, requests have no body
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if len(requestline) != 3:
+                status, contenttype, body = HTTPStatus.BAD_REQUEST, 'application/json', json.dumps(
+                    {'error': 'Malformed request'})
+            else:
+                status, contenttype, body = await self.dispatch(requestline[0], requestline[1])
+        except Exception as error:
+            status, contenttype, body = HTTPStatus.INTERNAL_SERVER_ERROR, 'application/json', json.dumps(
+                {'error': str(error)})
+
+        payload = body.encode('utf-8')
+        writer.write(f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                     f'Content-Type: {contenttype}\r\n'
+                     f'Content-Length: {len(payload)}\r\n'
+                     f'Connection: close\r\n\r\n'.encode('latin-1') + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        """
+        Serves requests until cancelled
+
+        Args
+            host (str): Host address to bind
+            port (int): Port to bind
+
+        Returns
+            None
+        """
+
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f'Serving routes on http://{host}:{port}')
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves low pollution routes over HTTP')
+    parser.add_argument('--host', default='127.0.0.1', help='Host address to bind, defaults to 127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000, help='Port to bind, defaults to 8000')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes, defaults to the number of CPUs')
+    parser.add_argument('--quiet', action='store_true', help='Do not log a JSON line for every request')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO, format='%(message)s')
+
+    # Loading data before the workers start, so forked workers share it
+    warmup()
+    service = RouteService(args.workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.pool.shutdown()